@@ -0,0 +1,152 @@
+"""
+Persistent cache for prepared datasets and derived aggregates, so a restarted server starts warm.
+
+An artifact is any picklable value built from a source file. It is stored under
+data/.cache/artifacts/ in a directory named after the artifact and a key that hashes the
+source content (columnar_cache.source_digest), the build parameters and the code version:
+the source of the modules that prepare and aggregate the data, so editing them invalidates
+every artifact. DataFrames inside the value are saved as .npy columns and memory-mapped back,
+everything else is pickled. Entries are written to a temporary directory and renamed into
+place, and only read when a cached loader first asks for them.
+
+Run from the repository root before a deploy to build every artifact the pages load:
+    python artifacts.py [--clear]
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+
+import pandas as pd
+
+from columnar_cache import CACHE_DIR, read_columns, source_digest, write_columns
+from profiling import profiled
+
+logger = logging.getLogger(__name__)
+
+ARTIFACT_DIR = os.path.join(CACHE_DIR, "artifacts")
+FORMAT_VERSION = 1
+# Modules whose code shapes the artifacts.
+CODE_MODULES = [
+    "artifacts", "binning", "cluster", "columnar_cache", "cube", "dataset", "diagnoses", "feature_store",
+    "filters", "histograms", "ingest", "kernels", "medications", "readmission", "streaming_stats", "utils",
+]
+
+_code_versions = {}
+
+
+def code_version(modules=tuple(CODE_MODULES)):
+    """Hash of the source of ``modules``, computed once per process."""
+    modules = tuple(modules)
+    if modules not in _code_versions:
+        digest = hashlib.sha256()
+        root = os.path.dirname(os.path.abspath(__file__))
+        for module in sorted(modules):
+            with open(os.path.join(root, module + ".py"), "rb") as f:
+                digest.update(module.encode() + b"\0" + f.read())
+        _code_versions[modules] = digest.hexdigest()
+    return _code_versions[modules]
+
+
+def artifact_dir(name, source, params=None, cache_dir=ARTIFACT_DIR):
+    key = json.dumps([FORMAT_VERSION, name, source_digest(source), params, code_version()], default=str)
+    return os.path.join(cache_dir, f"{name}-{hashlib.sha256(key.encode()).hexdigest()[:16]}")
+
+
+class _Pickler(pickle.Pickler):
+    """Pickles DataFrames as references to .npy column directories next to the pickle."""
+
+    def __init__(self, file, directory):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.directory = directory
+        self.frames = 0
+
+    def persistent_id(self, obj):
+        if not isinstance(obj, pd.DataFrame):
+            return None
+        name = f"frame{self.frames:03d}"
+        self.frames += 1
+        os.mkdir(os.path.join(self.directory, name))
+        columns = write_columns(obj, os.path.join(self.directory, name))
+        return name, columns, obj.index if not isinstance(obj.index, pd.RangeIndex) else None
+
+
+class _Unpickler(pickle.Unpickler):
+    def __init__(self, file, directory):
+        super().__init__(file)
+        self.directory = directory
+
+    def persistent_load(self, pid):
+        name, columns, index = pid
+        df = read_columns(os.path.join(self.directory, name), columns)
+        return df if index is None else df.set_axis(index, copy=False)
+
+
+def read_artifact(entry_dir):
+    with open(os.path.join(entry_dir, "value.pkl"), "rb") as f:
+        return _Unpickler(f, entry_dir).load()
+
+
+def write_artifact(entry_dir, value):
+    """Writes ``value`` to ``entry_dir`` through a temporary directory, so readers never see half an entry."""
+    parent = os.path.dirname(entry_dir)
+    os.makedirs(parent, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix=".tmp-", dir=parent)
+    try:
+        with open(os.path.join(tmp_dir, "value.pkl"), "wb") as f:
+            _Pickler(f, tmp_dir).dump(value)
+        os.rename(tmp_dir, entry_dir)
+    except OSError:
+        # Another process published the same entry first, or the cache is not writable.
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+@profiled()
+def load_or_build(name, source, build, params=None, cache_dir=ARTIFACT_DIR):
+    """
+    The artifact ``name`` of ``source`` with ``params``: read from disk, or ``build()`` and
+    stored. A broken entry is rebuilt.
+    """
+    entry_dir = artifact_dir(name, source, params, cache_dir)
+    if os.path.isdir(entry_dir):
+        try:
+            return read_artifact(entry_dir)
+        except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+            logger.warning("rebuilding unreadable artifact %s", entry_dir, exc_info=True)
+            shutil.rmtree(entry_dir, ignore_errors=True)
+    value = build()
+    write_artifact(entry_dir, value)
+    return value
+
+
+def warm_up():
+    """Builds the columnar cache entries and artifacts every page loads on first request."""
+    from dataset import build_dataset
+    from histograms import build_overview_histograms
+    from ingest import build_correlation_stats
+
+    dataset = build_dataset()
+    logger.info("dataset: %d rows", len(dataset))
+    build_overview_histograms()
+    build_correlation_stats()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--clear", action="store_true", help="delete every artifact first")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    if args.clear:
+        shutil.rmtree(ARTIFACT_DIR, ignore_errors=True)
+    warm_up()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
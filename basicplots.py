@@ -1,15 +1,21 @@
 import altair as alt
-import pandas as pd
-import re
+import numpy as np
 
+from diagnoses import DiagnosisCounts
+from filters import take_rows
 from globals import primary_color
-from utils import color_utils, icd9_to_category
+from medications import combination_codes, medication_masks
+from payload import log_chart_payload
+from profiling import profiled
+from readmission import readmitted_labels
+from utils import color_utils
 
 color_full = primary_color
 color_medium = color_utils.desaturate(primary_color, 0.4, 1.0)
 color_light = color_utils.desaturate(primary_color, 0.05, 1.0)
 
 
+@profiled()
 def get_barchart(race_counts, selection):
     highlight_color = "black"
     default_color = "lightgray"
@@ -28,12 +34,30 @@ def get_barchart(race_counts, selection):
     )
 
 
-def get_piechart(df, readmission_type, med_cols, race_selection=None):
-    df_work = df.copy()
-    df_work[med_cols] = df_work[med_cols].replace("?", pd.NA).replace({"No": 0, "Up": 1, "Down": 1, "Steady": 1})
-    df_work = df_work[df_work[med_cols].isin([1]).any(axis=1)]
+def readmission_by_race(df, readmission_type, med_cols, rows=None):
+    """Encounters (at ``rows``) taking any of ``med_cols`` per (race, readmission_label)."""
+    positions = np.arange(len(df)) if rows is None else rows
+    taking = combination_codes(medication_masks(df, med_cols, rows), med_cols) != 0
+    df_work = take_rows(df, positions[taking])
+    labels = readmitted_labels(df_work, readmission_type).rename("readmission_label")
+    return (
+        df_work.groupby([df_work["race"], labels], observed=True)
+        .size()
+        .reset_index(name="count")
+    )
+
+
+@profiled()
+def get_piechart(df, readmission_type, med_cols, race_selection=None, counts=None, rows=None):
+    """
+    Charts encounters per (race, readmission_label), aggregated server-side from ``df`` (at
+    ``rows``) unless ``counts`` already holds that table (e.g. from
+    cube.CubeSlice.readmission_by_race).
+    """
+    if counts is None:
+        counts = readmission_by_race(df, readmission_type, med_cols, rows)
+    base = alt.Chart(counts)
 
-    base = alt.Chart(df_work)
     if readmission_type == "Any":
         color_domain = ["NO", "<30", ">30"]
         color_range = [color_light, color_medium, color_full, ]
@@ -46,13 +70,6 @@ def get_piechart(df, readmission_type, med_cols, race_selection=None):
 
     pie_chart = (
         base
-        .transform_calculate(
-            readmission_label="datum.readmitted == 'NO' ? 'NO' : datum.readmitted == '<30' ? '<30' : '>30'"
-        )
-        .transform_aggregate(
-            count='count()',
-            groupby=['readmission_label', 'race']
-        )
         .mark_arc()
         .encode(
             theta='count:Q',
@@ -63,98 +80,19 @@ def get_piechart(df, readmission_type, med_cols, race_selection=None):
         )
         .properties(width=500, height=500)
     )
+    log_chart_payload("get_piechart", pie_chart)
     return pie_chart
 
 
-def icd9_to_category(code: str) -> str:
-    """Map an ICD-9(-CM) diagnosis code (001-999, V, E) to a high-level category."""
-    if pd.isna(code):
-        return "Unknown"
-
-    code_str = str(code).strip().upper()
-
-    # V codes: factors influencing health status / contact with health services
-    if code_str.startswith("V"):
-        return "Factors influencing health status / contact with health services"
-
-    # E codes: external causes of injury/poisoning
-    if code_str.startswith("E"):
-        return "External causes of injury and poisoning"
-
-    # Otherwise treat as numeric 001–999
-    m = re.match(r"(\d+)", code_str)
-    if not m:
-        return "Unknown"
-    num = int(m.group(1))
-
-    if 1 <= num <= 139:
-        return "Infectious and parasitic"
-    elif 140 <= num <= 239:
-        return "Neoplasms"
-    elif 240 <= num <= 279:
-        return "Endocrine, nutritional, metabolic, immunity"
-    elif 280 <= num <= 289:
-        return "Diseases of the blood"
-    elif 290 <= num <= 319:
-        return "Mental disorders"
-    elif 320 <= num <= 389:
-        return "Nervous system and sense organs"
-    elif 390 <= num <= 459:
-        return "Circulatory system"
-    elif 460 <= num <= 519:
-        return "Respiratory system"
-    elif 520 <= num <= 579:
-        return "Digestive system"
-    elif 580 <= num <= 629:
-        return "Genitourinary system"
-    elif 630 <= num <= 679:
-        return "Pregnancy, childbirth, puerperium"
-    elif 680 <= num <= 709:
-        return "Skin and subcutaneous tissue"
-    elif 710 <= num <= 739:
-        return "Musculoskeletal and connective tissue"
-    elif 740 <= num <= 759:
-        return "Congenital anomalies"
-    elif 760 <= num <= 779:
-        return "Perinatal conditions"
-    elif 780 <= num <= 799:
-        return "Symptoms, signs, ill-defined"
-    elif 800 <= num <= 999:
-        return "Injury and poisoning"
-    else:
-        return "Unknown"
-
-
-def getStackedBarChart(df, readmission_type, race_selection=None):
-    diag_cat_cols = ["diag_1_cat", "diag_2_cat", "diag_3_cat"]
-    diag_cols = ["diag_1", "diag_2", "diag_3"]
-    used_cols = diag_cols + ["readmitted", "race"]
-
-    df_work = df[used_cols].copy()
-    if readmission_type != "Any":
-        df_work["readmitted"].replace(">30", "NO", inplace=True)
-    df_work[diag_cols] = df_work[diag_cols].replace("?", pd.NA)
-    for col in diag_cols:
-        df_work[f"{col}_cat"] = df_work[col].apply(icd9_to_category)
-
-    df_long = (
-        df.melt(
-            id_vars=["readmitted", "race"],
-            value_vars=diag_cat_cols,
-            var_name="diag_position",
-            value_name="icd9_category"
-        )
-        .dropna(subset=["icd9_category"])
-    )
-
-    counts = (
-        df_long
-        .groupby(["race", "readmitted", "icd9_category"], as_index=False)
-        .size()
-        .rename(columns={"size": "count"})
-    )
-    if readmission_type != "Any":
-        counts = counts[counts["readmitted"].isin(["NO", "<30"])]
+@profiled()
+def getStackedBarChart(df, readmission_type, race_selection=None, diagnoses=None, rows=None):
+    """
+    Readmission mix per diagnosis category. ``diagnoses`` is a diagnoses.DiagnosisCounts for
+    ``df`` at ``rows``; it is counted from those rows when not given.
+    """
+    if diagnoses is None:
+        diagnoses = DiagnosisCounts.from_frame(take_rows(df, rows))
+    counts = diagnoses.readmission_table(readmission_type)
 
     base = alt.Chart(counts)
     if race_selection is not None:
@@ -184,48 +122,30 @@ def getStackedBarChart(df, readmission_type, race_selection=None):
         )
         .properties(width=600, height=350)
     )
+    log_chart_payload("getStackedBarChart", chart)
     return chart
 
 
-def getMosaic(df, readmission_type, med_cols, race_selection=None):
-    diag_cat_cols = ["diag_1_cat", "diag_2_cat", "diag_3_cat"]
-    bin_cols = [f"{c}_bin" for c in med_cols]
-
-    map_dict = {"No": 0, "Up": 1, "Down": 1, "Steady": 1}
-    diag_cols = ["diag_1", "diag_2", "diag_3"]
-    used_cols = med_cols + ["race"] + diag_cols
-    df_work = df[used_cols].copy()
-    df_work[med_cols] = df_work[med_cols].replace("?", pd.NA).replace(map_dict)
-
-    df_diag_long = (
-        df.melt(
-            id_vars=["race"] + bin_cols,
-            value_vars=diag_cat_cols,
-            var_name="diag_position",
-            value_name="diagnosis_category"
-        )
-        .dropna(subset=["diagnosis_category"])
-    )
-
-    agg_means = df_diag_long.groupby(["race", "diagnosis_category"], as_index=False)[bin_cols].mean()
-    agg_counts = (
-        df_diag_long.groupby(["race", "diagnosis_category"], as_index=False)
-        .size().rename(columns={"size": "n"})
-    )
-    agg = agg_means.merge(agg_counts, on=["race", "diagnosis_category"], how="left")
-
-    agg_long = agg.melt(
-        id_vars=["race", "diagnosis_category", "n"],
-        value_vars=bin_cols,
-        var_name="med_bin",
-        value_name="mean_used"
-    )
-    agg_long["medication"] = agg_long["med_bin"].str.replace("_bin$", "", regex=True)
+@profiled()
+def getMosaic(df, readmission_type, med_cols, race_selection=None, diagnoses=None, rows=None):
+    """
+    Share of patients on each medication per diagnosis category; ``diagnoses`` and ``rows`` as
+    for getStackedBarChart.
+    """
+    if diagnoses is None:
+        diagnoses = DiagnosisCounts.from_frame(take_rows(df, rows))
+    # Sums rather than means, so the browser can re-aggregate across the races kept by the
+    # race selection.
+    agg_long = diagnoses.medication_table(med_cols)
 
     base = alt.Chart(agg_long)
+    if race_selection is not None:
+        base = base.transform_filter(race_selection)
 
     heatmap = (
         base
+        .transform_aggregate(used="sum(used)", n="sum(n)", groupby=["diagnosis_category", "medication"])
+        .transform_calculate(mean_used="datum.used / datum.n")
         .mark_rect(cursor='default')
         .encode(
             x=alt.X("diagnosis_category:N", title="Diagnosis category", axis=alt.Axis(labelLimit=500)),
@@ -242,8 +162,5 @@ def getMosaic(df, readmission_type, med_cols, race_selection=None):
         )
         .properties(width=600, height=350)
     )
-
-    if race_selection is not None:
-        heatmap = heatmap.transform_filter(race_selection)
-
+    log_chart_payload("getMosaic", heatmap)
     return heatmap
@@ -0,0 +1,81 @@
+"""
+Scaling of the (medication, status, outcome) counts behind getOverviewPlots.
+
+Compares the previous per-cell comparison loop over string columns with
+kernels.crosstab_counts over int8 status codes. Run from the repository root:
+    python benchmarks/bench_crosstab.py [max_rows]
+"""
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from kernels import crosstab_counts  # noqa: E402
+from medications import MEDICATION_COLUMNS, STATUSES, status_codes  # noqa: E402
+
+
+def sample_frame(n, seed=0):
+    rng = np.random.default_rng(seed)
+    data = {med: pd.Categorical(rng.choice(STATUSES, n, p=[0.85, 0.1, 0.025, 0.025]), categories=STATUSES)
+            for med in MEDICATION_COLUMNS}
+    data["readmitted"] = rng.choice(["NO", "<30", ">30"], n, p=[0.54, 0.11, 0.35])
+    return pd.DataFrame(data)
+
+
+def loop_counts(df, med_cols):
+    readmit = df["readmitted"].isin([">30", "<30"]).astype(int)
+    counts = np.zeros((len(med_cols), len(STATUSES), 2), dtype=np.int64)
+    for m, med in enumerate(med_cols):
+        for s, status in enumerate(STATUSES):
+            count = (df[med] == status).sum()
+            count_med_and_readmit = ((df[med] == status) & readmit).sum()
+            counts[m, s] = [count - count_med_and_readmit, count_med_and_readmit]
+    return counts
+
+
+def kernel_counts(status, outcome):
+    med_index = np.arange(status.shape[1])[None, :]
+    return crosstab_counts([med_index, status, outcome], (status.shape[1], len(STATUSES), 2))
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def sample_inputs(df):
+    status = np.column_stack([status_codes(df[med]) for med in MEDICATION_COLUMNS])
+    outcome = df["readmitted"].isin([">30", "<30"]).to_numpy(dtype=np.int8)
+    return status, outcome
+
+
+def main():
+    max_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    # An empty filter selects no rows: every count is zero, as with the loop.
+    empty = sample_frame(0)
+    if not (kernel_counts(*sample_inputs(empty)) == loop_counts(empty, MEDICATION_COLUMNS)).all():
+        print("kernel result differs from the loop on empty input")
+        return 1
+    print(f"{'rows':>10} {'loop ms':>10} {'kernel ms':>10} {'speedup':>8}")
+    n = 10_000
+    while n <= max_rows:
+        df = sample_frame(n)
+        status, outcome = sample_inputs(df)
+
+        expected, loop_s = timed(loop_counts, df, MEDICATION_COLUMNS)
+        result, kernel_s = timed(kernel_counts, status, outcome)
+        if not (expected == result).all():
+            print("kernel result differs from the loop")
+            return 1
+        print(f"{n:>10,} {loop_s * 1000:>10.1f} {kernel_s * 1000:>10.1f} {loop_s / kernel_s:>7.1f}x")
+        n *= 10
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,131 @@
+"""
+Compare utils.categorize_codes and the per-row utils.icd9_to_category against the original
+if/elif categorization, and time them.
+
+Run from the repository root:
+    python benchmarks/bench_icd9.py [n_rows]
+"""
+import os
+import re
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from utils import categorize_codes, icd9_to_category  # noqa: E402
+
+
+def reference_category(code: str) -> str:
+    """
+    The original per-code utils.icd9_to_category, frozen here as an independent reference:
+    it does not read ICD9_RANGES, so a mistake in that table shows up as mismatches.
+    """
+
+    if pd.isna(code):
+        return "Unknown"
+
+    code_str = str(code).strip().upper()
+
+    # V codes: factors influencing health status / contact with health services
+    if code_str.startswith("V"):
+        return "Factors influencing health status / contact with health services"
+
+    # E codes: external causes of injury/poisoning
+    if code_str.startswith("E"):
+        return "External causes of injury and poisoning"
+
+    # Otherwise treat as numeric 001–999
+    m = re.match(r"(\d+)", code_str)
+    if not m:
+        return "Unknown"
+    num = int(m.group(1))
+
+    if 1 <= num <= 139:
+        return "Infectious and parasitic"
+    elif 140 <= num <= 239:
+        return "Neoplasms"
+    elif 240 <= num <= 279:
+        return "Endocrine, nutritional, metabolic, immunity"
+    elif 280 <= num <= 289:
+        return "Diseases of the blood"
+    elif 290 <= num <= 319:
+        return "Mental disorders"
+    elif 320 <= num <= 389:
+        return "Nervous system and sense organs"
+    elif 390 <= num <= 459:
+        return "Circulatory system"
+    elif 460 <= num <= 519:
+        return "Respiratory system"
+    elif 520 <= num <= 579:
+        return "Digestive system"
+    elif 580 <= num <= 629:
+        return "Genitourinary system"
+    elif 630 <= num <= 679:
+        return "Pregnancy, childbirth, puerperium"
+    elif 680 <= num <= 709:
+        return "Skin and subcutaneous tissue"
+    elif 710 <= num <= 739:
+        return "Musculoskeletal and connective tissue"
+    elif 740 <= num <= 759:
+        return "Congenital anomalies"
+    elif 760 <= num <= 779:
+        return "Perinatal conditions"
+    elif 780 <= num <= 799:
+        return "Symptoms, signs, ill-defined"
+    elif 800 <= num <= 999:
+        return "Injury and poisoning"
+    else:
+        return "Unknown"
+
+
+def sample_codes(n, seed=0):
+    """Diagnosis-like codes: plain and decimal numbers, V/E codes, '?' and blanks."""
+    rng = np.random.default_rng(seed)
+    numbers = rng.integers(0, 1200, n).astype(str)
+    decimals = np.char.add(np.char.add(numbers, "."), rng.integers(0, 10, n).astype(str))
+    codes = np.where(rng.random(n) < 0.5, numbers, decimals).astype(object)
+    kind = rng.random(n)
+    codes[kind < 0.05] = np.char.add("V", rng.integers(1, 90, (kind < 0.05).sum()).astype(str))
+    codes[(kind >= 0.05) & (kind < 0.06)] = "E" + "880"
+    codes[(kind >= 0.06) & (kind < 0.07)] = "?"
+    codes[(kind >= 0.07) & (kind < 0.08)] = None
+    codes[(kind >= 0.08) & (kind < 0.09)] = " v45 "
+    return pd.Series(codes)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 300_000
+    codes = sample_codes(n)
+
+    expected = codes.apply(reference_category)
+
+    start = time.perf_counter()
+    scalar = codes.apply(icd9_to_category)
+    scalar_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result = categorize_codes(codes)
+    vector_s = time.perf_counter() - start
+
+    # Columns coming from the columnar cache are already categorical.
+    categorical = codes.astype("category")
+    start = time.perf_counter()
+    result_cat = categorize_codes(categorical)
+    categorical_s = time.perf_counter() - start
+
+    mismatches = int((scalar.to_numpy() != expected.to_numpy()).sum())
+    mismatches += int((np.asarray(result, dtype=object) != expected.to_numpy()).sum())
+    mismatches += int((np.asarray(result_cat, dtype=object) != expected.to_numpy()).sum())
+    print(f"rows: {n:,}")
+    print(f"icd9_to_category (apply): {scalar_s * 1000:9.1f} ms")
+    print(f"categorize_codes:         {vector_s * 1000:9.1f} ms  ({scalar_s / vector_s:.0f}x)")
+    print(f"categorize_codes (cat):   {categorical_s * 1000:9.1f} ms  ({scalar_s / categorical_s:.0f}x)")
+    print(f"mismatches: {mismatches}")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,312 @@
+"""
+Time and peak memory of every stage of the dashboard's data path, on synthetic data.
+
+For each size a synthetic CSV (benchmarks/synthetic.py) is generated once under
+benchmarks/.data/ and reused by later runs. Each size runs in its own process, so a size
+that runs out of memory is reported without losing the others. Stages follow the calls the
+pages make: loading through the columnar cache (cold and warm), prepare_df, the shared
+dataset structures, filtering, every chart builder, the cluster graph and the correlation
+aggregations. Time is the best of --repeat runs; peak memory is the tracemalloc peak of one
+further run (memory-mapped columns are not counted).
+
+Run from the repository root:
+    python benchmarks/bench_suite.py [--rows 10k,100k,1m,10m] [--save NAME] [--compare NAME]
+
+--save writes benchmarks/baselines/NAME.json; --compare prints each stage relative to that
+baseline and exits with 1 when a stage is slower by more than --tolerance or fails where the
+baseline passed. Stages that did not complete are recorded with a "status": "oom" or "failed"
+for the stage (or the setup before it) that stopped the worker, and "skipped" for the rest.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(BENCH_DIR, "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCH_DIR)
+
+DATA_DIR = os.path.join(BENCH_DIR, ".data")
+BASELINE_DIR = os.path.join(BENCH_DIR, "baselines")
+DEFAULT_SIZES = "10k,100k,1m"
+MEDICATION_SLICE = slice(24, 47)
+# The filter state and medications the Medication Analysis page starts with, narrowed by age.
+AGE_RANGE, WEIGHT_RANGE, INCLUDE_UNKNOWN = (40, 80), (0, 200), True
+SELECTED = ["insulin", "metformin", "glipizide", "glyburide", "rosiglitazone"]
+SCATTER_PAIRS = [("num_medications", "time_in_hospital"), ("num_lab_procedures", "num_medications"),
+                 ("num_procedures", "num_medications"), ("age_midpoint", "num_medications")]
+# Fixed, so streaming ingest does not size its chunks from the memory this process already uses.
+INGEST_CHUNK_ROWS = 100_000
+# Differences below this are noise, whatever the ratio.
+NOISE_SECONDS = 0.005
+# Worker exit code for a MemoryError; killed by the OOM killer it exits with -9 (SIGKILL).
+OOM_EXIT = 3
+# Every stage yielded by stages(), in order, so stages a failed worker never reached are recorded.
+STAGE_NAMES = [
+    "ingest (streaming)", "load_data (cold)", "load_data (warm)", "prepare_df", "DataCube", "FilterEngine",
+    "filter_all", "FilterEngine.indices", "DiagnosisService.counts", "GroupedHistograms", "get_barchart",
+    "get_piechart", "getStackedBarChart", "getMosaic", "getOverviewPlots", "getUpsetPlot", "build_graph",
+    "Cooccurrence.from_slice", "Cooccurrence.graph", "render_graph", "binned scatter", "correlation moments",
+]
+
+
+def parse_size(text):
+    text = text.strip().lower()
+    scale = {"k": 10 ** 3, "m": 10 ** 6}.get(text[-1:], 1)
+    return int(float(text.rstrip("km")) * scale)
+
+
+def dataset_path(rows, seed=0):
+    from synthetic import write_csv
+
+    path = os.path.join(DATA_DIR, f"diabetic_synthetic-{rows}-{seed}.csv")
+    if not os.path.exists(path):
+        print(f"generating {rows:,} rows into {path}", flush=True)
+        write_csv(path, rows, seed)
+    return path
+
+
+def measure(fn, repeat):
+    """Best wall time of ``repeat`` runs, then the tracemalloc peak of one more run."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {"seconds": round(best, 6), "peak_mb": round(peak / 2 ** 20, 3)}
+
+
+def stages(path, cache_dir):
+    """
+    (name, function) for every stage, with the inputs built up the way the pages do. A
+    generator, so the stages that need no loaded data run (and are reported) first.
+    """
+    import altair as alt
+    import pandas as pd
+
+    import cluster
+    from basicplots import get_barchart, get_piechart, getMosaic, getStackedBarChart
+    from binning import MAX_POINTS, BinnedCounts
+    from columnar_cache import load_csv_cached
+    from cube import DataCube
+    from diagnoses import DiagnosisService
+    from filters import FilterEngine, filter_all, prepare_frame
+    from histograms import OVERVIEW_HISTOGRAMS, GroupedHistograms
+    from ingest import CORRELATION_COLUMNS, ingest
+    from overviewPlots import getOverviewPlots
+    from streaming_stats import CorrelationAccumulator, iter_chunks
+    from upset import getUpsetPlot
+    from utils import LRUCache
+
+    def load_cold():
+        fresh = tempfile.mkdtemp(dir=DATA_DIR)
+        try:
+            load_csv_cached(path, MEDICATION_SLICE, cache_dir=fresh)
+        finally:
+            shutil.rmtree(fresh, ignore_errors=True)
+
+    def stream():
+        # From the CSV, without a cache entry: the out-of-core path for files larger than memory.
+        empty = tempfile.mkdtemp(dir=DATA_DIR)
+        try:
+            ingest(path, MEDICATION_SLICE, chunk_rows=INGEST_CHUNK_ROWS, cache_dir=empty)
+        finally:
+            shutil.rmtree(empty, ignore_errors=True)
+
+    yield "ingest (streaming)", stream
+    yield "load_data (cold)", load_cold
+
+    raw, med_cols = load_csv_cached(path, MEDICATION_SLICE, cache_dir=cache_dir)
+    frame = prepare_frame(raw, med_cols)
+    cube = DataCube.from_frame(frame, med_cols)
+    engine = FilterEngine(frame)
+    diagnosis_service = DiagnosisService(engine)
+    rows = engine.indices(AGE_RANGE, WEIGHT_RANGE, INCLUDE_UNKNOWN)
+    cube_slice = cube.slice(AGE_RANGE, WEIGHT_RANGE, INCLUDE_UNKNOWN, "Any")
+    diagnoses = diagnosis_service.counts(AGE_RANGE, WEIGHT_RANGE, INCLUDE_UNKNOWN)
+    selection = alt.selection_point(fields=["race"], toggle=True)
+    meds = [m for m in SELECTED if m in med_cols]
+
+    def filter_rows():
+        engine.cache = LRUCache(engine.cache.max_entries, name=engine.cache.name)
+        engine.indices(AGE_RANGE, WEIGHT_RANGE, INCLUDE_UNKNOWN)
+
+    def diagnosis_counts():
+        diagnosis_service.cache = LRUCache(diagnosis_service.cache.max_entries, name=diagnosis_service.cache.name)
+        diagnosis_service.counts(AGE_RANGE, WEIGHT_RANGE, INCLUDE_UNKNOWN)
+
+    cooccurrence = cluster.Cooccurrence.from_frame(frame, "Any", med_cols, rows)
+    graph = cooccurrence.graph(50)
+
+    ages = raw["age"].map(lambda a: sum(int(v) for v in a.strip("[)").split("-")) / 2).astype(float)
+    scatter_frame = pd.DataFrame({**{c: raw[c] for c in CORRELATION_COLUMNS if c in raw.columns},
+                                  "readmitted": raw["readmitted"], "age_midpoint": ages}, copy=False)
+
+    def binned_scatter():
+        for x, y in SCATTER_PAIRS:
+            BinnedCounts.from_frame(scatter_frame, x, y, 100).limit_points(MAX_POINTS).to_frame(x, y)
+
+    def correlation_moments():
+        acc = CorrelationAccumulator.from_chunks(CORRELATION_COLUMNS, iter_chunks(frame[CORRELATION_COLUMNS]))
+        acc.pearson(), acc.spearman()
+
+    yield from [
+        ("load_data (warm)", lambda: load_csv_cached(path, MEDICATION_SLICE, cache_dir=cache_dir)),
+        ("prepare_df", lambda: prepare_frame(raw, med_cols)),
+        ("DataCube", lambda: DataCube.from_frame(frame, med_cols)),
+        ("FilterEngine", lambda: FilterEngine(frame)),
+        ("filter_all", lambda: filter_all(frame, AGE_RANGE, WEIGHT_RANGE, INCLUDE_UNKNOWN)),
+        ("FilterEngine.indices", filter_rows),
+        ("DiagnosisService.counts", diagnosis_counts),
+        ("GroupedHistograms", lambda: GroupedHistograms(raw, "gender", OVERVIEW_HISTOGRAMS)),
+        ("get_barchart", lambda: get_barchart(cube_slice.race_counts(), selection)),
+        ("get_piechart", lambda: get_piechart(frame, "Any", meds, race_selection=selection,
+                                              counts=cube_slice.readmission_by_race(meds), rows=rows)),
+        ("getStackedBarChart", lambda: getStackedBarChart(frame, "Any", race_selection=selection,
+                                                          diagnoses=diagnoses, rows=rows)),
+        ("getMosaic", lambda: getMosaic(frame, "Any", meds, race_selection=selection, diagnoses=diagnoses,
+                                        rows=rows)),
+        ("getOverviewPlots", lambda: getOverviewPlots(frame, "Any", meds,
+                                                      status_counts=cube_slice.status_counts(meds), rows=rows)),
+        ("getUpsetPlot", lambda: getUpsetPlot(frame, meds, rows=rows)),
+        ("build_graph", lambda: cluster.build_graph(frame, 50, "Any", med_cols, rows)),
+        ("Cooccurrence.from_slice", lambda: cluster.Cooccurrence.from_slice(
+            cube.slice(AGE_RANGE, WEIGHT_RANGE, INCLUDE_UNKNOWN, "Any"), med_cols)),
+        ("Cooccurrence.graph", lambda: cooccurrence.graph(50)),
+        ("render_graph", lambda: cluster.render_graph(graph, "Readmission risk").generate_html()),
+        ("binned scatter", binned_scatter),
+        ("correlation moments", correlation_moments),
+    ]
+
+
+def run_size(rows, repeat, out_path):
+    """Worker: runs every stage on ``rows`` encounters and writes the results to ``out_path``."""
+    # Deprecation noise from altair and pandas, repeated for every chart.
+    warnings.simplefilter("ignore")
+    logging.disable(logging.WARNING)
+    path = dataset_path(rows)
+    cache_dir = os.path.join(DATA_DIR, "cache")
+    results = {}
+    try:
+        for name, fn in stages(path, cache_dir):
+            if name != STAGE_NAMES[len(results)]:
+                raise RuntimeError(f"stage {name!r} is out of order in STAGE_NAMES")
+            results[name] = measure(fn, 1 if "cold" in name else repeat)
+            print(f"{rows:>11,} {name:<26} {results[name]['seconds'] * 1000:>10.1f} ms "
+                  f"{results[name]['peak_mb']:>9.1f} MB", flush=True)
+            with open(out_path, "w") as f:
+                json.dump(results, f)
+    except MemoryError:
+        return OOM_EXIT
+    return 0
+
+
+def record_failure(stage_results, code):
+    """Marks the stage that stopped a worker with exit ``code`` and every later one."""
+    missing = [name for name in STAGE_NAMES if name not in stage_results]
+    if not missing:
+        return
+    status = "oom" if code in (OOM_EXIT, -9) else "failed"
+    stage_results[missing[0]] = {"status": status, "exit_code": code}
+    for name in missing[1:]:
+        stage_results[name] = {"status": "skipped", "after": missing[0]}
+
+
+def environment():
+    import pandas as pd
+
+    return {
+        "machine": platform.machine(), "processor": platform.processor(), "cpus": os.cpu_count(),
+        "python": platform.python_version(), "numpy": np.__version__, "pandas": pd.__version__,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Prints every stage against the baseline; returns the number of regressions."""
+    regressions = 0
+    print(f"\n{'rows':>11} {'stage':<26} {'baseline ms':>12} {'now ms':>10} {'ratio':>7}")
+    for rows, stage_results in results.items():
+        for name, now in stage_results.items():
+            before = baseline.get(rows, {}).get(name)
+            if before is None:
+                continue
+            if "status" in now or "status" in before:
+                # A stage that fails now but passed in the baseline is a regression.
+                failed_now = "status" in now and "status" not in before
+                regressions += failed_now
+                print(f"{int(rows):>11,} {name:<26} {before.get('status', 'ok'):>12} {now.get('status', 'ok'):>10}"
+                      f"{'  REGRESSION' if failed_now else ''}")
+                continue
+            ratio = now["seconds"] / before["seconds"] if before["seconds"] else float("inf")
+            slower = ratio > 1 + tolerance and now["seconds"] - before["seconds"] > NOISE_SECONDS
+            regressions += slower
+            print(f"{int(rows):>11,} {name:<26} {before['seconds'] * 1000:>12.1f} {now['seconds'] * 1000:>10.1f} "
+                  f"{ratio:>6.2f}x{'  REGRESSION' if slower else ''}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", default=DEFAULT_SIZES, help=f"comma-separated sizes (default {DEFAULT_SIZES})")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--save", metavar="NAME")
+    parser.add_argument("--compare", metavar="NAME")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed slowdown ratio (default 0.5)")
+    parser.add_argument("--worker", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--out", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    os.chdir(ROOT)
+    os.makedirs(DATA_DIR, exist_ok=True)
+    if args.worker is not None:
+        return run_size(args.worker, args.repeat, args.out)
+
+    results, failed = {}, []
+    print(f"{'rows':>11} {'stage':<26} {'time':>13} {'peak':>12}")
+    for rows in (parse_size(s) for s in args.rows.split(",")):
+        with tempfile.NamedTemporaryFile(suffix=".json", dir=DATA_DIR, delete=False) as out:
+            out_path = out.name
+        try:
+            code = subprocess.call([sys.executable, os.path.abspath(__file__), "--worker", str(rows),
+                                    "--repeat", str(args.repeat), "--out", out_path])
+            with open(out_path) as f:
+                results[str(rows)] = json.load(f) if os.path.getsize(out_path) else {}
+        finally:
+            os.remove(out_path)
+        if code != 0:
+            failed.append(rows)
+            print(f"{rows:>11,} stopped after {len(results[str(rows)])} stages (exit code {code}; "
+                  f"a negative code is the signal, e.g. -9 when killed for memory)", flush=True)
+            record_failure(results[str(rows)], code)
+
+    if args.save:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        with open(os.path.join(BASELINE_DIR, args.save + ".json"), "w") as f:
+            json.dump({"environment": environment(), "results": results}, f, indent=1)
+    regressions = 0
+    if args.compare:
+        with open(os.path.join(BASELINE_DIR, args.compare + ".json")) as f:
+            regressions = compare(results, json.load(f)["results"], args.tolerance)
+    return 1 if failed or regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
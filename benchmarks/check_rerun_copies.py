@@ -0,0 +1,109 @@
+"""
+Checks that reruns of the dashboard pages never copy a whole dataset frame.
+
+Each page is run once to fill the process-wide caches, then rerun with a hook on
+DataFrame.__finalize__, which pandas calls for every frame derived from another one (copy,
+iloc/take, boolean indexing, column selection). The check fails if a rerun derives a frame
+with at least MIN_ROWS_SHARE of the dataset's rows and MIN_COLUMNS columns. Run from the
+repository root, with the data files in data/:
+    python benchmarks/check_rerun_copies.py
+
+Exits with status 0 when every page passes and 1 when any page copies a frame, raises or
+cannot be run at all, so it can gate CI.
+"""
+import os
+import sys
+import traceback
+
+import pandas as pd
+from streamlit.testing.v1 import AppTest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+MIN_ROWS_SHARE = 0.5
+MIN_COLUMNS = 5
+
+
+class FrameCopyHook:
+    def __init__(self, n_rows):
+        self.min_rows = int(n_rows * MIN_ROWS_SHARE)
+        self.copies = []
+        self._original = pd.DataFrame.__finalize__
+
+    def __enter__(self):
+        hook = self
+
+        def finalize(frame, other, method=None, **kwargs):
+            if len(frame) >= hook.min_rows and frame.shape[1] >= MIN_COLUMNS:
+                hook.copies.append((frame.shape, method, "".join(traceback.format_stack(limit=8)[:-1])))
+            return hook._original(frame, other, method=method, **kwargs)
+
+        pd.DataFrame.__finalize__ = finalize
+        return self
+
+    def __exit__(self, *exc):
+        pd.DataFrame.__finalize__ = self._original
+
+
+def main_page_app():
+    with open(os.path.join(ROOT, "main.py")) as f:
+        source = f.read()
+    # Run the analysis page directly instead of through st.navigation.
+    return AppTest.from_string(source[:source.index("pages = {")] + "main()\n", default_timeout=300)
+
+
+def check(name, app, n_rows, rerun):
+    try:
+        return _check(name, app, n_rows, rerun)
+    except Exception:
+        print(f"{name}: check crashed\n{traceback.format_exc()}")
+        return False
+
+
+def _check(name, app, n_rows, rerun):
+    app.run()
+    if app.exception:
+        print(f"{name}: first run failed: {app.exception[0].value}")
+        return False
+    with FrameCopyHook(n_rows) as hook:
+        rerun(app)
+    if app.exception:
+        print(f"{name}: rerun failed: {app.exception[0].value}")
+        return False
+    for shape, method, stack in hook.copies:
+        print(f"{name}: {shape[0]} x {shape[1]} frame derived on rerun (method={method})\n{stack}")
+    print(f"{name}: {'ok' if not hook.copies else f'{len(hook.copies)} full-frame copies'}")
+    return not hook.copies
+
+
+def rerun_main(app):
+    app.sidebar.slider[0].set_value((20, 80))
+    app.run()
+    app.sidebar.radio[0].set_value("<30 days only")
+    app.run()
+
+
+def main():
+    os.chdir(ROOT)
+    from dataset import load_dataset
+    from filters import load_data_full
+
+    full_rows = len(load_data_full()[0])
+    results = {
+        "main": check("main", main_page_app(), len(load_dataset()), rerun_main),
+        "dataset_overview": check("dataset_overview", AppTest.from_file("dataset_overview.py", default_timeout=300),
+                                  full_rows, lambda app: app.run()),
+        "correlations": check("correlations", AppTest.from_file("correlations.py", default_timeout=300), full_rows,
+                              lambda app: app.run()),
+    }
+    failed = [name for name, ok in results.items() if not ok]
+    if failed:
+        print(f"FAILED: {', '.join(failed)}", file=sys.stderr)
+        return 1
+    print(f"passed: {len(results)} pages")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,161 @@
+"""
+Synthetic encounters with the schema of the UCI "Diabetes 130-US hospitals" dataset.
+
+Marginals follow the published dataset: race, gender and age bracket shares, a weight that is
+unknown for ~97% of encounters, ICD-9 diagnoses drawn by chapter (circulatory and respiratory
+codes dominate, 250.xx for diabetes, V/E codes, "?" when missing), the share of encounters on
+each of the 23 medications (insulin ~53%, examide and citoglipton never) with Steady/Up/Down
+among users, and the NO/>30/<30 readmission classes. Columns are independent of each other.
+
+Run from the repository root to write CSVs the dashboard can load:
+    python benchmarks/synthetic.py data/diabetic_data.csv --rows 100000 [--smol data/diabetic_data_smol.csv]
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from medications import MEDICATION_COLUMNS  # noqa: E402
+
+# Share of encounters with a status other than "No".
+MEDICATION_USE = {
+    "metformin": 0.196, "repaglinide": 0.015, "nateglinide": 0.007, "chlorpropamide": 0.0009,
+    "glimepiride": 0.051, "acetohexamide": 0.00001, "glipizide": 0.125, "glyburide": 0.105,
+    "tolbutamide": 0.0002, "pioglitazone": 0.072, "rosiglitazone": 0.063, "acarbose": 0.003,
+    "miglitol": 0.0004, "troglitazone": 0.00003, "tolazamide": 0.0004, "examide": 0.0,
+    "citoglipton": 0.0, "insulin": 0.534, "glyburide-metformin": 0.007, "glipizide-metformin": 0.0001,
+    "glimepiride-pioglitazone": 0.00001, "metformin-rosiglitazone": 0.00002, "metformin-pioglitazone": 0.00001,
+}
+USER_STATUSES = (["Steady", "Up", "Down"], [0.7, 0.15, 0.15])
+
+RACES = (["Caucasian", "AfricanAmerican", "?", "Hispanic", "Other", "Asian"],
+         [0.748, 0.189, 0.022, 0.02, 0.015, 0.006])
+GENDERS = (["Female", "Male", "Unknown/Invalid"], [0.5376, 0.4623, 0.0001])
+AGES = ([f"[{a}-{a + 10})" for a in range(0, 100, 10)],
+        [0.002, 0.007, 0.016, 0.037, 0.095, 0.17, 0.221, 0.256, 0.169, 0.027])
+WEIGHTS = (["?"] + [f"[{w}-{w + 25})" for w in range(0, 200, 25)] + [">200"],
+           [0.9686, 0.0005, 0.0009, 0.0088, 0.0131, 0.0062, 0.0012, 0.0003, 0.0001, 0.0003])
+READMITTED = (["NO", ">30", "<30"], [0.539, 0.349, 0.112])
+GLUCOSE = (["None", "Norm", ">200", ">300"], [0.947, 0.026, 0.015, 0.012])
+A1C = (["None", "Norm", ">7", ">8"], [0.833, 0.049, 0.037, 0.081])
+
+# ICD-9 chapters as (first, last three-digit code, share of diagnoses); 250 is diabetes.
+ICD9_CHAPTERS = [
+    (1, 139, 0.03), (140, 239, 0.04), (240, 249, 0.02), (250, 250, 0.08), (251, 279, 0.03),
+    (280, 289, 0.01), (290, 319, 0.02), (320, 389, 0.02), (390, 459, 0.30), (460, 519, 0.14),
+    (520, 579, 0.09), (580, 629, 0.05), (630, 679, 0.005), (680, 709, 0.025), (710, 739, 0.05),
+    (740, 759, 0.001), (780, 799, 0.07), (800, 999, 0.07),
+]
+V_CODE_SHARE, E_CODE_SHARE = 0.02, 0.01
+# Missing diagnoses ("?") per column.
+DIAG_MISSING = {"diag_1": 0.0002, "diag_2": 0.0035, "diag_3": 0.014}
+
+DEFAULT_CHUNK_ROWS = 500_000
+
+
+def _choice(rng, values_weights, n):
+    values, weights = values_weights
+    weights = np.asarray(weights, dtype=float)
+    return rng.choice(np.asarray(values, dtype=object), n, p=weights / weights.sum())
+
+
+def diagnosis_codes(rng, n, missing=0.0):
+    """ICD-9 codes as strings: "428", "250.83", "V45", "E888" or "?"."""
+    first, last, share = (np.array(v) for v in zip(*ICD9_CHAPTERS))
+    shares = np.append(share, [V_CODE_SHARE, E_CODE_SHARE])
+    chapter = rng.choice(len(shares), n, p=shares / shares.sum())
+    is_icd = chapter < len(ICD9_CHAPTERS)
+    idx = np.minimum(chapter, len(ICD9_CHAPTERS) - 1)
+    number = rng.integers(first[idx], last[idx] + 1)
+
+    codes = number.astype(str).astype(object)
+    decimal = is_icd & (rng.random(n) < 0.4)
+    codes[decimal] = codes[decimal] + "." + rng.integers(0, 100, decimal.sum()).astype(str)
+    v_code, e_code = chapter == len(ICD9_CHAPTERS), chapter == len(ICD9_CHAPTERS) + 1
+    codes[v_code] = np.char.add("V", rng.integers(1, 92, v_code.sum()).astype(str)).astype(object)
+    codes[e_code] = np.char.add("E", rng.integers(800, 1000, e_code.sum()).astype(str)).astype(object)
+    codes[rng.random(n) < missing] = "?"
+    return codes
+
+
+def generate(n, seed=0, first_encounter=0):
+    """``n`` synthetic encounters as a DataFrame with the UCI column order and string values."""
+    rng = np.random.default_rng(seed)
+    d = {
+        "encounter_id": 12522 + 7 * (first_encounter + np.arange(n, dtype=np.int64)),
+        "patient_nbr": rng.integers(135, 189502620, n),
+        "race": _choice(rng, RACES, n),
+        "gender": _choice(rng, GENDERS, n),
+        "age": _choice(rng, AGES, n),
+        "weight": _choice(rng, WEIGHTS, n),
+        "admission_type_id": rng.integers(1, 9, n),
+        "discharge_disposition_id": rng.integers(1, 30, n),
+        "admission_source_id": rng.integers(1, 26, n),
+        "time_in_hospital": np.clip(rng.geometric(0.22, n), 1, 14),
+        "payer_code": _choice(rng, (["?", "MC", "HM", "SP", "BC", "MD"], [0.40, 0.32, 0.06, 0.05, 0.05, 0.12]), n),
+        "medical_specialty": _choice(rng, (["?", "InternalMedicine", "Emergency/Trauma", "Family/GeneralPractice",
+                                            "Cardiology", "Surgery-General"], [0.49, 0.14, 0.08, 0.07, 0.05, 0.17]), n),
+        "num_lab_procedures": np.clip(rng.normal(43, 20, n).round(), 1, 132).astype(np.int64),
+        "num_procedures": np.clip(rng.poisson(1.3, n), 0, 6),
+        "num_medications": np.clip(rng.normal(16, 8, n).round(), 1, 81).astype(np.int64),
+        "number_outpatient": rng.poisson(0.37, n),
+        "number_emergency": rng.poisson(0.2, n),
+        "number_inpatient": rng.poisson(0.64, n),
+    }
+    for col, missing in DIAG_MISSING.items():
+        d[col] = diagnosis_codes(rng, n, missing)
+    d["number_diagnoses"] = np.clip(rng.normal(7.4, 1.9, n).round(), 1, 16).astype(np.int64)
+    d["max_glu_serum"] = _choice(rng, GLUCOSE, n)
+    d["A1Cresult"] = _choice(rng, A1C, n)
+    for med in MEDICATION_COLUMNS:
+        status = np.full(n, "No", dtype=object)
+        users = rng.random(n) < MEDICATION_USE[med]
+        status[users] = _choice(rng, USER_STATUSES, users.sum())
+        d[med] = status
+    taking = np.column_stack([d[med] != "No" for med in MEDICATION_COLUMNS]).any(axis=1)
+    d["change"] = np.where(taking & (rng.random(n) < 0.5), "Ch", "No")
+    d["diabetesMed"] = np.where(taking, "Yes", "No")
+    d["readmitted"] = _choice(rng, READMITTED, n)
+    return pd.DataFrame(d)
+
+
+def write_csv(path, n, seed=0, chunk_rows=DEFAULT_CHUNK_ROWS, columns=None):
+    """Writes ``n`` encounters to ``path`` in chunks, so any size fits in memory."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = path + ".tmp"
+    for i, start in enumerate(range(0, n, chunk_rows)):
+        chunk = generate(min(chunk_rows, n - start), seed=[seed, i], first_encounter=start)
+        if columns is not None:
+            chunk = chunk[columns]
+        chunk.to_csv(tmp_path, mode="w" if i == 0 else "a", header=i == 0, index=False)
+    os.replace(tmp_path, path)
+    return path
+
+
+def smol_columns():
+    """Columns of data/diabetic_data_smol.csv: filters.load_data reads its medications at 7:30."""
+    return ["race", "gender", "age", "weight", "diag_1", "diag_2", "diag_3"] + MEDICATION_COLUMNS + [
+        "change", "diabetesMed", "readmitted"]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("path")
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--smol", help="also write the dashboard's small file with this many --smol-rows")
+    parser.add_argument("--smol-rows", type=int, default=20_000)
+    args = parser.parse_args(argv)
+
+    write_csv(args.path, args.rows, args.seed)
+    if args.smol:
+        write_csv(args.smol, args.smol_rows, args.seed, columns=smol_columns())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+
+from kernels import crosstab_counts
+from readmission import READMIT_LABELS
+
+# The correlations scatter plots stay below Altair's 5000 row limit with some room to spare.
+MAX_POINTS = 4000
+
+
+def bin_width(values, max_bins) -> int:
+    """Smallest integer bin width that covers ``values`` with at most ``max_bins`` bins."""
+    values = np.asarray(values, dtype=float)
+    values = values[~np.isnan(values)]
+    if not len(values) or max_bins is None:
+        return 1
+    span = np.floor(values.max()) - np.floor(values.min()) + 1
+    return max(1, int(np.ceil(span / max_bins)))
+
+
+class BinnedCounts:
+    """
+    Encounter counts on a 2D grid of integer bins, split by readmission class.
+
+    Bins are [origin + i * width, origin + (i + 1) * width) per axis. Values are floored to
+    integers first, as the plotted fields (counts of days, procedures, medications, and age
+    bracket midpoints) already are; rows with a missing value on either axis are skipped.
+    All rows go through one crosstab_counts pass.
+    """
+
+    def __init__(self, x, y, readmitted, x_width=1, y_width=1):
+        x = np.floor(np.asarray(x, dtype=float))
+        y = np.floor(np.asarray(y, dtype=float))
+        valid = ~(np.isnan(x) | np.isnan(y))
+        self.x_origin = x[valid].min() if valid.any() else 0.0
+        self.y_origin = y[valid].min() if valid.any() else 0.0
+        self.x_width, self.y_width = x_width, y_width
+
+        x_idx = np.where(valid, (np.nan_to_num(x) - self.x_origin) // x_width, -1).astype(np.int64)
+        y_idx = np.where(valid, (np.nan_to_num(y) - self.y_origin) // y_width, -1).astype(np.int64)
+        readmit_idx = pd.Categorical(readmitted, categories=READMIT_LABELS).codes
+        shape = (max(x_idx.max(initial=-1) + 1, 1), max(y_idx.max(initial=-1) + 1, 1), len(READMIT_LABELS))
+        self.counts = crosstab_counts([x_idx, y_idx, readmit_idx], shape)
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, x_field, y_field, max_bins=None):
+        """Bins ``x_field`` against ``y_field``, widening bins so neither axis exceeds ``max_bins``."""
+        return cls(df[x_field], df[y_field], df["readmitted"],
+                   bin_width(df[x_field], max_bins), bin_width(df[y_field], max_bins))
+
+    @property
+    def n_points(self):
+        return int(np.count_nonzero(self.counts.sum(axis=-1)))
+
+    def coarsen(self, x_factor=1, y_factor=1):
+        """A copy with ``x_factor`` x ``y_factor`` neighbouring bins merged, without rescanning rows."""
+        out = object.__new__(BinnedCounts)
+        out.__dict__.update(self.__dict__)
+        out.x_width, out.y_width = self.x_width * x_factor, self.y_width * y_factor
+        nx, ny, n_labels = self.counts.shape
+        padded = np.zeros((-(-nx // x_factor) * x_factor, -(-ny // y_factor) * y_factor, n_labels),
+                          dtype=self.counts.dtype)
+        padded[:nx, :ny] = self.counts
+        out.counts = padded.reshape(padded.shape[0] // x_factor, x_factor,
+                                    padded.shape[1] // y_factor, y_factor, n_labels).sum(axis=(1, 3))
+        return out
+
+    def limit_points(self, max_points=MAX_POINTS):
+        """Doubles the bin width of the axis with more bins until at most ``max_points`` are occupied."""
+        binned = self
+        while binned.n_points > max_points:
+            wider_x = binned.counts.shape[0] >= binned.counts.shape[1]
+            binned = binned.coarsen(2 if wider_x else 1, 1 if wider_x else 2)
+        return binned
+
+    def to_frame(self, x_field, y_field):
+        """
+        One row per occupied bin: bin centre on each axis, counts per readmission class,
+        total_count, readmission_rate and the per-class percentages.
+        """
+        totals = self.counts.sum(axis=-1)
+        xi, yi = np.nonzero(totals)
+        table = pd.DataFrame({
+            x_field: self.x_origin + xi * self.x_width + (self.x_width - 1) / 2,
+            y_field: self.y_origin + yi * self.y_width + (self.y_width - 1) / 2,
+            "total_count": totals[xi, yi],
+        })
+        for i, label in enumerate(READMIT_LABELS):
+            table[label] = self.counts[xi, yi, i]
+        table["readmission_rate"] = (table["<30"] + table[">30"]) / table["total_count"] * 100
+        for label in READMIT_LABELS:
+            table[f"{label}_pct"] = (table[label] / table["total_count"] * 100).round(1)
+        return table
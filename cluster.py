@@ -1,58 +1,144 @@
 import networkx as nx
+import numpy as np
 from pyvis.network import Network
-import streamlit as st
 
+from medications import combination_codes, cooccurrence_matrix, medication_frequencies, medication_masks
+from profiling import profiled
+from readmission import readmission_outcome
+from utils import LRUCache
 
-@st.cache_data
-def build_graph(df, min_cooccurrence, readmission_type, med_cols):
-    taken_medication = (df[med_cols] != "No").astype(int)
+LAYOUT_SEED = 42
+# Half the width of the layout in pixels; vis.js centres and zooms it to fit.
+LAYOUT_SCALE = 400
+_layouts = LRUCache(32, name="graph_layouts")
+_html = LRUCache(16, name="graph_html")
 
-    if readmission_type == "Any":
-        readmit = df["readmitted"].isin([">30", "<30"]).astype(int)
-    else:
-        readmit = (df["readmitted"] == "<30").astype(int)
 
-    med_freq = taken_medication.sum()
-    med_readmit = {
-        med: float(readmit[taken_medication[med] == 1].mean())
-        for med in med_cols
-    }
+def _overlap(co, freq_i, freq_j, n):
+    return co / np.minimum(freq_i, freq_j)
 
-    co_matrix = (taken_medication.T @ taken_medication).to_numpy()
 
-    G = nx.Graph()
-    for med in med_cols:
-        freq = int(med_freq[med])
-        readmit_value = float(med_readmit[med])
-        if freq > 0:
-            G.add_node(
-                med,
-                freq=freq,
-                readmit=readmit_value
-            )
+def _jaccard(co, freq_i, freq_j, n):
+    return co / (freq_i + freq_j - co)
 
-    for i, m1 in enumerate(med_cols):
-        for j, m2 in enumerate(med_cols):
-            if i < j and co_matrix[i, j] >= min_cooccurrence:
-                value = float(co_matrix[i, j]) / float(min(freq, int(med_freq[m2])))
-                G.add_edge(m1, m2, value=value)
 
-    return G
+def _lift(co, freq_i, freq_j, n):
+    return co * n / (freq_i * freq_j)
+
 
+def _pmi(co, freq_i, freq_j, n):
+    return np.log2(_lift(co, freq_i, freq_j, n))
 
-def render_graph(G, size_mode):
-    net = Network(height="750px", width="100%")
 
-    net.force_atlas_2based(
-        gravity=-50,
-        central_gravity=0.01,
-        spring_length=150,
-        spring_strength=0.08
-    )
+# Edge weights from the co-occurrence count of a pair, the frequencies of both medications and
+# the number of encounters.
+EDGE_WEIGHTS = {
+    "Overlap": _overlap,
+    "Jaccard": _jaccard,
+    "Lift": _lift,
+    "PMI": _pmi,
+}
+
+
+class Cooccurrence:
+    """
+    Medication frequencies, readmission rates and pairwise co-occurrence counts of a filter
+    state; everything build_graph needs except the threshold and the edge weight, so the
+    (cached) instance answers slider changes without touching the rows again.
+    """
+
+    def __init__(self, med_cols, n, freqs, readmit_rates, matrix):
+        self.med_cols = list(med_cols)
+        self.n = n
+        self.freqs = freqs
+        self.readmit_rates = readmit_rates
+        self.matrix = matrix
+
+    @classmethod
+    @profiled("cooccurrence_stats")
+    def from_frame(cls, df, readmission_type, med_cols, rows=None):
+        codes = combination_codes(medication_masks(df, med_cols, rows), med_cols)
+        readmit = readmission_outcome(df, readmission_type, rows).astype(float)
+
+        freqs = medication_frequencies(codes, len(med_cols))
+        readmit_sums = medication_frequencies(codes, len(med_cols), weights=readmit)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            readmit_rates = readmit_sums / freqs
+        return cls(med_cols, len(codes), freqs, readmit_rates, cooccurrence_matrix(codes, len(med_cols)))
+
+    @classmethod
+    @profiled("cooccurrence_stats")
+    def from_slice(cls, cube_slice, med_cols):
+        """The same statistics from a DataCube slice, i.e. from per-bracket sums instead of rows."""
+        taking, matrix = cube_slice.medication_counts(med_cols)
+        freqs = np.diag(matrix).copy()
+        with np.errstate(invalid="ignore", divide="ignore"):
+            readmit_rates = taking[1:].sum(axis=0) / freqs
+        return cls(med_cols, cube_slice.total, freqs, readmit_rates, matrix)
+
+    def edges(self, min_cooccurrence, weight="Overlap"):
+        """Index pairs i < j co-occurring at least ``min_cooccurrence`` times, and their weights."""
+        above = np.triu(self.matrix >= min_cooccurrence, k=1)
+        i, j = np.nonzero(above)
+        values = EDGE_WEIGHTS[weight](self.matrix[i, j].astype(float), self.freqs[i].astype(float),
+                                      self.freqs[j].astype(float), self.n)
+        return i, j, values
+
+    @profiled("threshold_graph")
+    def graph(self, min_cooccurrence, weight="Overlap"):
+        G = nx.Graph()
+        for med, freq, readmit in zip(self.med_cols, self.freqs, self.readmit_rates):
+            if freq > 0:
+                G.add_node(med, freq=int(freq), readmit=float(readmit))
+
+        i, j, values = self.edges(min_cooccurrence, weight)
+        G.add_edges_from((self.med_cols[a], self.med_cols[b], {"value": float(v)}) for a, b, v in zip(i, j, values))
+        return G
 
+
+@profiled()
+def build_graph(df, min_cooccurrence, readmission_type, med_cols, rows=None, weight="Overlap"):
+    return Cooccurrence.from_frame(df, readmission_type, med_cols, rows).graph(min_cooccurrence, weight)
+
+
+def topology_key(G):
+    return tuple(sorted(G.nodes)), tuple(sorted(tuple(sorted(e)) for e in G.edges))
+
+
+def graph_fingerprint(G, size_mode):
+    """Hashable key of everything render_graph draws."""
+    nodes = tuple((n, G.nodes[n]["freq"], G.nodes[n]["readmit"]) for n in sorted(G.nodes))
+    edges = tuple(sorted((*sorted((u, v)), d.get("value")) for u, v, d in G.edges(data=True)))
+    return nodes, edges, size_mode
+
+
+def graph_layout(G):
+    """
+    Node positions in pixels, from a seeded spring layout of the graph's topology. The same
+    nodes and edges always get the same positions, whatever the thresholds or weights were.
+    """
+    nodes, edges = key = topology_key(G)
+
+    def compute():
+        H = nx.Graph()
+        H.add_nodes_from(nodes)
+        H.add_edges_from(edges)
+        positions = nx.spring_layout(H, seed=LAYOUT_SEED, scale=LAYOUT_SCALE)
+        return {n: (float(x), float(y)) for n, (x, y) in positions.items()}
+
+    return _layouts.get_or_compute(key, compute)
+
+
+@profiled()
+def render_graph(G, size_mode):
+    """The pyvis network of ``G``, laid out by graph_layout with browser physics disabled."""
+    net = Network(height="750px", width="100%", cdn_resources="remote")
     net.from_nx(G)
+    net.toggle_physics(False)
 
+    positions = graph_layout(G)
     for node in net.nodes:
+        node["x"], node["y"] = positions[node["id"]]
         freq = int(G.nodes[node["id"]]["freq"])
         readmit = float(G.nodes[node["id"]]["readmit"])
 
@@ -71,8 +157,18 @@ def render_graph(G, size_mode):
             f"Readmission rate: {readmit:.1%}"
         )
 
+    # Overlap and Jaccard lie in [0, 1]; lift and PMI are scaled to the strongest edge.
+    # Pairs taken together less often than by chance (negative PMI) are dashed.
+    scale = max([1.0] + [abs(float(edge.get("value", 1))) for edge in net.edges])
     for edge in net.edges:
         edge["value"] = float(edge.get("value", 1))
-        edge["width"] = float(edge["value"]) * 5
+        edge["width"] = abs(edge["value"]) / scale * 5
+        edge["dashes"] = edge["value"] < 0
 
     return net
+
+
+@profiled()
+def graph_html(G, size_mode):
+    """Self-contained HTML of render_graph, rendered in memory and cached by graph_fingerprint."""
+    return _html.get_or_compute(graph_fingerprint(G, size_mode), lambda: render_graph(G, size_mode).generate_html())
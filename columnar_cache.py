@@ -0,0 +1,334 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from profiling import profiled
+
+CACHE_DIR = os.path.join("data", ".cache")
+FORMAT_VERSION = 1
+MEDICATION_MIN_COUNT = 100
+# Rows parsed at a time when a cache entry is built; bounds its memory whatever the file size.
+BUILD_CHUNK_ROWS = 200_000
+
+# Explicit on-disk dtypes for the UCI diabetes columns. "category" columns are stored as
+# integer codes plus their labels; columns missing here keep the dtype pandas infers.
+SCHEMA = {
+    "encounter_id": "int64",
+    "patient_nbr": "int64",
+    "race": "category",
+    "gender": "category",
+    "age": "category",
+    "weight": "category",
+    "admission_type_id": "int16",
+    "discharge_disposition_id": "int16",
+    "admission_source_id": "int16",
+    "time_in_hospital": "int16",
+    "payer_code": "category",
+    "medical_specialty": "category",
+    "num_lab_procedures": "int16",
+    "num_procedures": "int16",
+    "num_medications": "int16",
+    "number_outpatient": "int16",
+    "number_emergency": "int16",
+    "number_inpatient": "int16",
+    "diag_1": "category",
+    "diag_2": "category",
+    "diag_3": "category",
+    "number_diagnoses": "int16",
+    "max_glu_serum": "category",
+    "A1Cresult": "category",
+    "change": "category",
+    "diabetesMed": "category",
+    "readmitted": "category",
+}
+
+
+def file_fingerprint(path):
+    """Size and mtime of a source file; cheap enough to check on every load."""
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def file_hash(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@profiled()
+def load_csv_cached(path, medication_slice, min_count=MEDICATION_MIN_COUNT, cache_dir=CACHE_DIR):
+    """
+    Load a CSV through the columnar cache.
+
+    The first call parses the CSV in chunks of BUILD_CHUNK_ROWS rows and writes one .npy file
+    per column (categorical columns as codes) plus a meta.json holding the schema, the source
+    fingerprint and the filtered medication list. Later calls memory-map those files, so several
+    processes share the same page cache and nothing is parsed again.
+
+    Returns the DataFrame and the medication columns with more than ``min_count`` users.
+    """
+    params = _params(medication_slice, min_count)
+    entry_dir = _find_entry(path, params, cache_dir)
+    if entry_dir is None:
+        entry_dir = _build_entry(path, medication_slice, params, cache_dir)
+    return _open_entry(entry_dir)
+
+
+def open_cached(path, medication_slice, min_count=MEDICATION_MIN_COUNT, cache_dir=CACHE_DIR):
+    """Like load_csv_cached, but returns None instead of parsing the CSV when no entry exists."""
+    entry_dir = _find_entry(path, _params(medication_slice, min_count), cache_dir)
+    return None if entry_dir is None else _open_entry(entry_dir)
+
+
+def source_digest(path, cache_dir=CACHE_DIR):
+    """SHA-256 of a source file, taken from a cache entry of its current version when there is one."""
+    fingerprint = file_fingerprint(path)
+    if os.path.isdir(cache_dir):
+        for name in sorted(os.listdir(cache_dir)):
+            meta = _read_meta(os.path.join(cache_dir, name)) if name.startswith(_entry_prefix(path)) else None
+            if meta is not None and meta["source"] == os.path.abspath(path) and meta["fingerprint"] == fingerprint:
+                return meta["sha256"]
+    return file_hash(path)
+
+
+def csv_dtypes(columns):
+    """read_csv dtypes for ``columns``: SCHEMA category columns are read as strings."""
+    return {c: str for c in columns if SCHEMA.get(c) == "category"}
+
+
+def _params(medication_slice, min_count):
+    return {"medication_slice": [medication_slice.start, medication_slice.stop], "min_count": min_count}
+
+
+def _entry_prefix(path):
+    return os.path.splitext(os.path.basename(path))[0] + "-"
+
+
+def _read_meta(entry_dir):
+    try:
+        with open(os.path.join(entry_dir, "meta.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _find_entry(path, params, cache_dir):
+    if not os.path.isdir(cache_dir):
+        return None
+
+    fingerprint = file_fingerprint(path)
+    source = os.path.abspath(path)
+    candidates = []
+    for name in sorted(os.listdir(cache_dir)):
+        if not name.startswith(_entry_prefix(path)):
+            continue
+        entry_dir = os.path.join(cache_dir, name)
+        meta = _read_meta(entry_dir)
+        if (meta is None or meta["format_version"] != FORMAT_VERSION or meta["source"] != source
+                or meta["params"] != params or meta["fingerprint"]["size"] != fingerprint["size"]):
+            continue
+        if meta["fingerprint"]["mtime_ns"] == fingerprint["mtime_ns"]:
+            return entry_dir
+        candidates.append((entry_dir, meta))
+
+    # Same size but a different mtime (e.g. the file was copied or touched): fall back to
+    # the content hash before paying for a full re-parse.
+    if candidates:
+        digest = file_hash(path)
+        for entry_dir, meta in candidates:
+            if meta["sha256"] == digest:
+                return entry_dir
+    return None
+
+
+def _to_schema_dtype(series, dtype):
+    if dtype == "category" or series.hasnans or not np.issubdtype(np.dtype(dtype), np.integer):
+        return series
+    info = np.iinfo(dtype)
+    if series.min() < info.min or series.max() > info.max:
+        return series
+    return series.astype(dtype)
+
+
+def _build_entry(path, medication_slice, params, cache_dir, chunk_rows=BUILD_CHUNK_ROWS):
+    fingerprint = file_fingerprint(path)
+    digest = file_hash(path)
+
+    header = pd.read_csv(path, nrows=0).columns
+    medication_column_names = header[medication_slice].tolist()
+    users = dict.fromkeys(medication_column_names, 0)
+
+    def chunks():
+        for chunk in pd.read_csv(path, dtype=csv_dtypes(header), chunksize=chunk_rows):
+            for c in medication_column_names:
+                users[c] += int((chunk[c] != "No").sum())
+            yield chunk
+
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix=".tmp-", dir=cache_dir)
+    columns, n_rows = write_chunks(chunks(), tmp_dir, SCHEMA)
+    medication_column_names_filtered = [c for c in medication_column_names if users[c] > params["min_count"]]
+
+    meta = {
+        "format_version": FORMAT_VERSION,
+        "source": os.path.abspath(path),
+        "fingerprint": fingerprint,
+        "sha256": digest,
+        "params": params,
+        "n_rows": n_rows,
+        "columns": columns,
+        "medication_column_names_filtered": medication_column_names_filtered,
+    }
+    with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+        json.dump(meta, f)
+
+    key = hashlib.sha256(json.dumps([FORMAT_VERSION, digest, params]).encode()).hexdigest()
+    entry_dir = os.path.join(cache_dir, _entry_prefix(path) + key[:16])
+    try:
+        os.rename(tmp_dir, entry_dir)
+    except OSError:
+        # Another process published the same entry first; keep theirs.
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return entry_dir
+
+
+def _open_entry(entry_dir):
+    meta = _read_meta(entry_dir)
+    return read_columns(entry_dir, meta["columns"]), list(meta["medication_column_names_filtered"])
+
+
+def write_columns(df: pd.DataFrame, directory, dtypes=None):
+    """
+    Saves every column of ``df`` as a .npy file in ``directory``, categorical columns as codes.
+
+    ``dtypes`` maps column names to the dtype to store ("category" or a numpy integer dtype);
+    other columns keep theirs, with object columns stored as categories. Returns the column
+    descriptions read_columns takes.
+    """
+    dtypes = dtypes or {}
+    columns = []
+    for i, col in enumerate(df.columns):
+        series = df[col]
+        dtype = dtypes.get(col, "category" if series.dtype == object else str(series.dtype))
+        file_name = f"c{i:03d}.npy"
+        if dtype == "category":
+            cat = pd.Categorical(series)
+            np.save(os.path.join(directory, file_name), cat.codes)
+            columns.append({"name": col, "dtype": "category", "file": file_name,
+                            "categories": cat.categories.tolist(), "ordered": bool(cat.ordered)})
+        else:
+            values = _to_schema_dtype(series, dtype).to_numpy()
+            np.save(os.path.join(directory, file_name), values)
+            columns.append({"name": col, "dtype": str(values.dtype), "file": file_name})
+    return columns
+
+
+class _ChunkedColumn:
+    """
+    One column written chunk by chunk. Each chunk is staged as its own .npy file and finish()
+    joins them into the column file, so only one chunk is ever held in memory.
+
+    Labels become integer codes in order of first appearance and are renumbered at the end:
+    sorted like pd.Categorical for plain values, kept in dtype order (unused ones included)
+    when the chunks are categorical already. Numbers are stored in the dtype that holds every
+    chunk, e.g. a SCHEMA int16 column stays int64 once one chunk does not fit int16.
+    """
+
+    def __init__(self, directory, index, name, dtype):
+        self.directory = directory
+        self.name = name
+        self.file = f"c{index:03d}.npy"
+        self.dtype = dtype
+        self.parts = []
+        self.labels = None
+        self.sort_labels = True
+        self.ordered = False
+
+    def append(self, series):
+        dtype = self.dtype or ("category" if series.dtype == object else str(series.dtype))
+        if dtype == "category" or self.labels is not None:
+            if self.parts and self.labels is None:
+                raise ValueError(f"column {self.name!r} changes from numbers to labels between chunks; "
+                                 f"give it a SCHEMA dtype")
+            values = self._codes(series)
+        else:
+            values = _to_schema_dtype(series, dtype).to_numpy()
+        part = os.path.join(self.directory, f"{self.file[:-4]}-{len(self.parts):05d}.npy")
+        np.save(part, values)
+        self.parts.append(part)
+
+    def _codes(self, series):
+        cat = pd.Categorical(series)
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            self.sort_labels = False
+            self.ordered = bool(cat.ordered)
+        if self.labels is None:
+            self.labels = cat.categories
+        else:
+            self.labels = self.labels.append(cat.categories[~cat.categories.isin(self.labels)])
+        to_label = self.labels.get_indexer(cat.categories)
+        codes = cat.codes
+        return np.where(codes < 0, -1, to_label[codes]).astype(np.int32)
+
+    def finish(self, n_rows):
+        """Joins the staged chunks into the column file and returns its description."""
+        if self.labels is not None:
+            categories = pd.Categorical(self.labels).categories if self.sort_labels else self.labels
+            renumber = categories.get_indexer(self.labels)
+            dtype = pd.Categorical.from_codes([], categories=categories).codes.dtype
+            description = {"name": self.name, "dtype": "category", "file": self.file,
+                           "categories": categories.tolist(), "ordered": self.ordered}
+        else:
+            renumber = None
+            dtype = np.result_type(*(np.load(part, mmap_mode="r").dtype for part in self.parts))
+            description = {"name": self.name, "dtype": str(dtype), "file": self.file}
+
+        out = np.lib.format.open_memmap(os.path.join(self.directory, self.file), mode="w+", dtype=dtype,
+                                        shape=(n_rows,))
+        start = 0
+        for part in self.parts:
+            values = np.load(part, mmap_mode="r")
+            if renumber is not None:
+                values = np.where(values < 0, -1, renumber[values])
+            out[start:start + len(values)] = values
+            start += len(values)
+            del values
+            os.remove(part)
+        out.flush()
+        return description
+
+
+def write_chunks(chunks, directory, dtypes=None):
+    """
+    write_columns for a frame that arrives in chunks, e.g. from read_csv(chunksize=...), with
+    one chunk in memory at a time. Returns the column descriptions and the row count.
+    """
+    dtypes = dtypes or {}
+    columns, n_rows = None, 0
+    for chunk in chunks:
+        if columns is None:
+            columns = [_ChunkedColumn(directory, i, col, dtypes.get(col)) for i, col in enumerate(chunk.columns)]
+        for column in columns:
+            column.append(chunk[column.name])
+        n_rows += len(chunk)
+    return [column.finish(n_rows) for column in columns or []], n_rows
+
+
+def read_columns(directory, columns) -> pd.DataFrame:
+    """The frame saved by write_columns, on read-only memory-mapped arrays."""
+    data = {}
+    for col in columns:
+        values = np.load(os.path.join(directory, col["file"]), mmap_mode="r")
+        if col["dtype"] == "category":
+            data[col["name"]] = pd.Categorical.from_codes(values, categories=col["categories"],
+                                                          ordered=col.get("ordered", False))
+        else:
+            data[col["name"]] = values
+    return pd.DataFrame(data, copy=False)
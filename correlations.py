@@ -2,9 +2,11 @@ import streamlit as st
 import pandas as pd
 import altair as alt
 
+from binning import MAX_POINTS, BinnedCounts
 from filters import load_data_full
 from globals import primary_color
-from utils import color_utils
+from ingest import build_correlation_stats
+from utils import LRUCache, color_utils
 
 color_full = primary_color
 color_medium = color_utils.desaturate(primary_color, 0.4, 1.0)
@@ -15,18 +17,15 @@ st.set_page_config(page_title="Correlations", page_icon="📊", layout="wide")
 st.title("Relations of Key Metrics")
 st.markdown("""
 This section explores correlations between different metrics and their impact on patient readmission rates.
-Data on this page includes a random subset of 10,000 records for performance reasons.
+All encounters are included; the scatter plots show them binned on a grid.
 """)
 
 
-# Cached preprocessing function
-@st.cache_data(show_spinner="Loading and preprocessing data...")
-def load_and_preprocess_data(sample_size=10000):
+# Shared, read-only frame: the columns below are views of the memory-mapped full dataset.
+@st.cache_resource(show_spinner="Loading and preprocessing data...")
+def load_and_preprocess_data():
     dataframe, medication_column_names_filtered = load_data_full()
 
-    if len(dataframe) > sample_size:
-        dataframe = dataframe.sample(n=sample_size, random_state=42)
-
     def age_to_midpoint(age_str):
         if pd.isna(age_str):
             return None
@@ -41,8 +40,6 @@ def load_and_preprocess_data(sample_size=10000):
                 return None
         return None
 
-    dataframe['age_midpoint'] = dataframe['age'].apply(age_to_midpoint)
-
     columns_to_keep = [
         'readmitted',
         'time_in_hospital',
@@ -51,12 +48,11 @@ def load_and_preprocess_data(sample_size=10000):
         'num_medications',
         'age',
         'gender',
-        'age_midpoint'
     ]
-
-    dataframe_filtered = dataframe[columns_to_keep].copy()
-
-    return dataframe_filtered
+    columns = {col: dataframe[col] for col in columns_to_keep}
+    # map on the categorical age column converts each bracket label once.
+    columns['age_midpoint'] = dataframe['age'].map(age_to_midpoint).astype(float)
+    return pd.DataFrame(columns, copy=False)
 
 
 dataframe = load_and_preprocess_data()
@@ -73,35 +69,24 @@ st.caption(
     "Scroll to zoom into the data. Double-click to reset zoom. Point size indicates number of encounters. Color shows readmission rate at that location.")
 
 SCATTER_HEIGHT = 450
+# Wider axes are binned more coarsely so every scatter plot stays readable.
+MAX_BINS_PER_AXIS = 100
 
 
-def create_scatter_aggregated(data, x_field, y_field, x_title, y_title, title):
-    agg_data = data.groupby([x_field, y_field, 'readmitted']).size().reset_index(name='count')
-
-    location_stats = agg_data.groupby([x_field, y_field]).agg({
-        'count': 'sum'
-    }).reset_index()
-    location_stats.rename(columns={'count': 'total_count'}, inplace=True)
+@st.cache_resource
+def scatter_cache():
+    return LRUCache(16, name="binned_scatter")
 
-    readmit_pivot = agg_data.pivot_table(
-        index=[x_field, y_field],
-        columns='readmitted',
-        values='count',
-        fill_value=0
-    ).reset_index()
 
-    location_stats = location_stats.merge(readmit_pivot, on=[x_field, y_field])
+def binned_scatter_data(x_field, y_field, max_bins=MAX_BINS_PER_AXIS, max_points=MAX_POINTS):
+    """Per-bin counts of ``x_field`` against ``y_field`` over all encounters."""
+    data = load_and_preprocess_data()
+    return scatter_cache().get_or_compute((x_field, y_field, max_bins, max_points), lambda: BinnedCounts.from_frame(
+        data, x_field, y_field, max_bins).limit_points(max_points).to_frame(x_field, y_field))
 
-    if '<30' in location_stats.columns and '>30' in location_stats.columns:
-        location_stats['readmission_rate'] = (
-                (location_stats['<30'] + location_stats['>30']) / location_stats['total_count'] * 100
-        )
-    else:
-        location_stats['readmission_rate'] = 0
 
-    location_stats['NO_pct'] = (location_stats.get('NO', 0) / location_stats['total_count'] * 100).round(1)
-    location_stats['<30_pct'] = (location_stats.get('<30', 0) / location_stats['total_count'] * 100).round(1)
-    location_stats['>30_pct'] = (location_stats.get('>30', 0) / location_stats['total_count'] * 100).round(1)
+def create_scatter_aggregated(x_field, y_field, x_title, y_title, title):
+    location_stats = binned_scatter_data(x_field, y_field)
 
     return alt.Chart(location_stats).mark_circle(opacity=0.8, stroke='white', strokeWidth=0.5).encode(
         x=alt.X(f'{x_field}:Q', title=x_title, scale=alt.Scale(zero=False)),
@@ -136,7 +121,6 @@ col1, col2 = st.columns(2)
 
 with col1:
     chart1 = create_scatter_aggregated(
-        dataframe,
         'num_medications',
         'time_in_hospital',
         'Number of Medications',
@@ -147,7 +131,6 @@ with col1:
 
 with col2:
     chart2 = create_scatter_aggregated(
-        dataframe,
         'num_lab_procedures',
         'num_medications',
         'Number of Lab Procedures',
@@ -160,7 +143,6 @@ col3, col4 = st.columns(2)
 
 with col3:
     chart3 = create_scatter_aggregated(
-        dataframe,
         'num_procedures',
         'num_medications',
         'Number of Procedures (non-lab)',
@@ -170,9 +152,7 @@ with col3:
     st.altair_chart(chart3, use_container_width=True)
 
 with col4:
-    age_df = dataframe[dataframe['age_midpoint'].notna()]
     chart4 = create_scatter_aggregated(
-        age_df,
         'age_midpoint',
         'num_medications',
         'Age (years)',
@@ -183,13 +163,23 @@ with col4:
 
 st.header("Correlations Summary")
 
+@st.cache_resource(show_spinner="Aggregating encounters...")
+def load_correlation_stats():
+    """Correlation moments of the full dataset, accumulated over chunks of its memory-mapped columns."""
+    return build_correlation_stats()
+
+
+stats = load_correlation_stats()
+pearson, spearman = stats.pearson(), stats.spearman()
+pairs = [
+    ('num_medications', 'time_in_hospital'),
+    ('num_lab_procedures', 'num_medications'),
+    ('num_procedures', 'num_medications'),
+    ('age_lb', 'num_medications'),
+]
 correlations = pd.DataFrame({
-    'Correlation': [
-        dataframe[['num_medications', 'time_in_hospital']].corr().iloc[0, 1],
-        dataframe[['num_lab_procedures', 'num_medications']].corr().iloc[0, 1],
-        dataframe[['num_procedures', 'num_medications']].corr().iloc[0, 1],
-        dataframe[dataframe['age_midpoint'].notna()][['age_midpoint', 'num_medications']].corr().iloc[0, 1]
-    ]
+    'Correlation': [pearson.loc[a, b] for a, b in pairs],
+    'Spearman': [spearman.loc[a, b] for a, b in pairs],
 }, index=[
     'Medication Count ↔ Hospital Stay',
     'Lab Procedures ↔ Medications',
@@ -205,7 +195,7 @@ with col_stat1:
         correlations.style.background_gradient(cmap='RdYlGn', vmin=-1, vmax=1).format('{:.3f}'),
         use_container_width=True
     )
-    st.caption("Pearson correlation coefficients.")
+    st.caption("Pearson (Correlation) and Spearman rank correlation coefficients.")
 
 with col_stat2:
     st.subheader("Key Insights")
@@ -219,17 +209,20 @@ with col_stat2:
         border=True,
     )
 
-    med_by_readmit = dataframe.groupby('readmitted')['num_medications'].mean()
+    med_by_readmit = dataframe.groupby('readmitted', observed=True)['num_medications'].mean()
 
 st.header("Readmission Rate by Medication Count")
 
-dataframe['med_count_bin'] = pd.cut(
+med_count_bin = pd.cut(
     dataframe['num_medications'],
     bins=[0, 5, 10, 15, 20, 100],
     labels=['0-5', '6-10', '11-15', '16-20', '20+']
 )
 
-readmit_by_med_bin = dataframe.groupby(['med_count_bin', 'readmitted']).size().reset_index(name='count')
+readmit_by_med_bin = (
+    dataframe.groupby([med_count_bin.rename('med_count_bin'), 'readmitted'], observed=False)
+    .size().reset_index(name='count')
+)
 
 stacked_bar = alt.Chart(readmit_by_med_bin).mark_bar().encode(
     x=alt.X('med_count_bin:N', title='Number of Medications'),
@@ -0,0 +1,296 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+from kernels import crosstab_counts
+from medications import STATUSES, combination_codes, medication_masks, status_matrix, unpack_codes
+from readmission import READMIT_LABELS, fold_readmission, readmission_labels
+from streaming_stats import iter_chunks
+
+# Rows per chunk when DataCube.from_frame builds a cube.
+CUBE_CHUNK_ROWS = 1 << 18
+
+
+def bracket_codes(df: pd.DataFrame):
+    """
+    Age and weight brackets of every encounter, as used by the sidebar sliders.
+
+    Returns the sorted age lower bounds, each row's age bracket, the sorted known weight lower
+    bounds and each row's weight bracket, where the extra last weight bracket means unknown.
+    """
+    age_values, age_idx = np.unique(df["age_lb"].to_numpy(), return_inverse=True)
+
+    weight = df["weight_lb"].to_numpy(dtype=float)
+    known = ~np.isnan(weight)
+    weight_values = np.unique(weight[known])
+    weight_idx = np.full(len(df), len(weight_values), dtype=np.int64)
+    weight_idx[known] = np.searchsorted(weight_values, weight[known])
+    return age_values, age_idx, weight_values, weight_idx
+
+
+def select_brackets(age_values, weight_values, age_range, weight_range, include_unknown_weight=True):
+    """Age and weight brackets kept by a filter state, with the same semantics as filters.filter_all."""
+    min_age, max_age = age_range
+    min_w, max_w = weight_range
+    age_sel = (age_values >= min_age) & (age_values < max_age)
+    weight_sel = np.append((weight_values >= min_w) & (weight_values < max_w), include_unknown_weight)
+    return age_sel, weight_sel
+
+
+def filter_key(age_range, weight_range, include_unknown_weight=True):
+    """Hashable key of the row filter part of a filter state."""
+    return tuple(age_range), tuple(weight_range), bool(include_unknown_weight)
+
+
+class BracketSums:
+    """
+    Per-bracket partial aggregates summed over a changing (age, weight) bracket selection.
+
+    ``partials`` has the age and weight brackets as its first two axes. The sum of the last
+    selection is kept and updated by adding the brackets that entered the selection and
+    subtracting those that left, so moving a slider costs O(changed brackets); when most
+    brackets change the sum is taken afresh. Shared between sessions under a lock; returned
+    sums are new arrays and never modified afterwards.
+    """
+
+    def __init__(self, partials):
+        self.partials = partials
+        self._selected = np.zeros(partials.shape[:2], dtype=bool)
+        self._total = np.zeros(partials.shape[2:], dtype=partials.dtype)
+        self._lock = threading.Lock()
+
+    def sum(self, age_sel, weight_sel) -> np.ndarray:
+        selected = np.outer(age_sel, weight_sel)
+        with self._lock:
+            entered = selected & ~self._selected
+            left = self._selected & ~selected
+            if entered.sum() + left.sum() < selected.sum():
+                self._total = self._total + self.partials[entered].sum(axis=0) - self.partials[left].sum(axis=0)
+            else:
+                self._total = self.partials[selected].sum(axis=0)
+            self._selected = selected
+            return self._total
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+
+class DataCube:
+    """
+    Encounter counts pre-aggregated over the sidebar filter dimensions.
+
+    Cells are (age lower bound, weight lower bound or unknown, race, readmitted). Per cell the
+    cube keeps the encounter count, the count per medication and status, and the counts per
+    observed medication mask. A filter state then only selects age/weight slices and sums them,
+    so answering it costs the same no matter how many rows the dataset has.
+    """
+
+    def __init__(self, df: pd.DataFrame, med_cols):
+        self.med_cols = list(med_cols)
+
+        self.age_values, age_idx, self.weight_values, weight_idx = bracket_codes(df)
+
+        race = pd.Categorical(df["race"])
+        self.races = list(race.categories)
+        # Missing race gets its own trailing slot so totals still include those encounters.
+        race_idx = np.where(race.codes < 0, len(self.races), race.codes)
+
+        readmit_idx = pd.Categorical(df["readmitted"], categories=READMIT_LABELS).codes
+        if (readmit_idx < 0).any():
+            raise ValueError(f"readmitted contains values outside {READMIT_LABELS}")
+
+        self.shape = (len(self.age_values), len(self.weight_values) + 1, len(self.races) + 1, len(READMIT_LABELS))
+        cell = np.ravel_multi_index((age_idx, weight_idx, race_idx, readmit_idx), self.shape)
+        n_cells = int(np.prod(self.shape))
+
+        self.counts = np.bincount(cell, minlength=n_cells).reshape(self.shape)
+
+        # (cell, medication, status) counts; statuses outside STATUSES are not counted.
+        self.status_counts = crosstab_counts(
+            [cell, np.arange(len(self.med_cols))[None, :], status_matrix(df, self.med_cols)],
+            (n_cells, len(self.med_cols), len(STATUSES)),
+        ).reshape(self.shape + (len(self.med_cols), len(STATUSES)))
+
+        # Sparse (cell, medication mask) counts over the combinations that actually occur.
+        masks = medication_masks(df, self.med_cols).astype(np.int64)
+        keys, self.mask_counts = np.unique((cell.astype(np.int64) << 32) | masks, return_counts=True)
+        self.mask_cells = keys >> 32
+        self.masks = (keys & 0xFFFFFFFF).astype(np.uint32)
+        self._sums = None
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, med_cols, chunk_rows=CUBE_CHUNK_ROWS):
+        """The cube of ``df`` built per chunk of rows and merged, so only one chunk is ever coded at a time."""
+        cube = None
+        for chunk in iter_chunks(df, chunk_rows):
+            part = cls(chunk, med_cols)
+            cube = part if cube is None else cube.merge(part)
+        return cube if cube is not None else cls(df, med_cols)
+
+    def bracket_sums(self):
+        """
+        BracketSums behind CubeSlice, built on first use: encounters per (race, readmitted),
+        statuses per (readmitted, medication, status), users of each medication per
+        readmitted, and users of each pair of medications.
+        """
+        if self._sums is None:
+            n_brackets = self.shape[0] * self.shape[1]
+            n_meds = len(self.med_cols)
+            age_idx, weight_idx, _, readmit_idx = np.unravel_index(self.mask_cells, self.shape)
+            bracket = age_idx * self.shape[1] + weight_idx
+            bits = unpack_codes(combination_codes(self.masks, self.med_cols), n_meds)
+            weighted = bits * self.mask_counts[:, None]
+
+            taking = np.zeros((n_brackets, len(READMIT_LABELS), n_meds), dtype=np.int64)
+            np.add.at(taking, (bracket, readmit_idx), weighted)
+            cooccurrence = np.zeros((n_brackets, n_meds, n_meds), dtype=np.int64)
+            order = np.argsort(bracket, kind="stable")
+            bounds = np.searchsorted(bracket[order], np.arange(n_brackets + 1))
+            for b in np.flatnonzero(np.diff(bounds)):
+                rows = order[bounds[b]:bounds[b + 1]]
+                cooccurrence[b] = bits[rows].T @ weighted[rows]
+
+            brackets = self.shape[:2]
+            self._sums = {
+                "race_readmit": BracketSums(self.counts),
+                "status": BracketSums(self.status_counts.sum(axis=2)),
+                "taking": BracketSums(taking.reshape(brackets + taking.shape[1:])),
+                "cooccurrence": BracketSums(cooccurrence.reshape(brackets + cooccurrence.shape[1:])),
+            }
+        return self._sums
+
+    def merge(self, other):
+        """
+        A cube over the rows of both cubes, e.g. two chunks of one file.
+
+        The bracket and race axes become the union of both; ``med_cols`` must match.
+        """
+        if other.med_cols != self.med_cols:
+            raise ValueError("cannot merge cubes over different medication columns")
+        merged = object.__new__(DataCube)
+        merged.med_cols = self.med_cols
+        merged.age_values = np.union1d(self.age_values, other.age_values)
+        merged.weight_values = np.union1d(self.weight_values, other.weight_values)
+        merged.races = sorted(set(self.races) | set(other.races))
+        merged.shape = (len(merged.age_values), len(merged.weight_values) + 1, len(merged.races) + 1,
+                        len(READMIT_LABELS))
+
+        merged.counts = np.zeros(merged.shape, dtype=np.int64)
+        merged.status_counts = np.zeros(merged.shape + self.status_counts.shape[-2:], dtype=np.int64)
+        cells, masks, mask_counts = [], [], []
+        for cube in (self, other):
+            positions = (
+                np.searchsorted(merged.age_values, cube.age_values),
+                np.append(np.searchsorted(merged.weight_values, cube.weight_values), len(merged.weight_values)),
+                np.append(np.searchsorted(merged.races, cube.races), len(merged.races)).astype(np.int64),
+                np.arange(len(READMIT_LABELS)),
+            )
+            merged.counts[np.ix_(*positions)] += cube.counts
+            merged.status_counts[np.ix_(*positions)] += cube.status_counts
+            old = np.unravel_index(cube.mask_cells, cube.shape)
+            cells.append(np.ravel_multi_index([p[o] for p, o in zip(positions, old)], merged.shape))
+            masks.append(cube.masks)
+            mask_counts.append(cube.mask_counts)
+
+        keys, inverse = np.unique((np.concatenate(cells).astype(np.int64) << 32)
+                                  | np.concatenate(masks).astype(np.int64), return_inverse=True)
+        merged.mask_counts = np.bincount(inverse, weights=np.concatenate(mask_counts),
+                                         minlength=len(keys)).astype(np.int64)
+        merged.mask_cells = keys >> 32
+        merged.masks = (keys & 0xFFFFFFFF).astype(np.uint32)
+        merged._sums = None
+        return merged
+
+    def slice(self, age_range, weight_range, include_unknown_weight=True, readmission_type="Any"):
+        """Counts for one filter state, with the same semantics as filters.filter_all."""
+        age_sel, weight_sel = select_brackets(self.age_values, self.weight_values, age_range, weight_range,
+                                              include_unknown_weight)
+        return CubeSlice(self, age_sel, weight_sel, readmission_type)
+
+
+class CubeSlice:
+    """
+    The cube summed over the age and weight slices selected by one filter state, from the
+    cube's incrementally maintained BracketSums.
+    """
+
+    def __init__(self, cube, age_sel, weight_sel, readmission_type):
+        self.cube = cube
+        self.readmission_type = readmission_type
+        self.labels = readmission_labels(readmission_type)
+
+        sums = cube.bracket_sums()
+        # (race, readmitted) and (medication, status, readmitted)
+        self.race_readmit = fold_readmission(sums["race_readmit"].sum(age_sel, weight_sel), readmission_type)
+        status = sums["status"].sum(age_sel, weight_sel)
+        self.status_readmit = fold_readmission(np.moveaxis(status, 0, -1), readmission_type)
+        # (readmitted, medication) users and (medication, medication) users of both
+        self._taking = fold_readmission(sums["taking"].sum(age_sel, weight_sel), readmission_type, axis=0)
+        self._cooccurrence = sums["cooccurrence"].sum(age_sel, weight_sel)
+
+        age_idx, weight_idx, race_idx, readmit_idx = np.unravel_index(cube.mask_cells, cube.shape)
+        keep = age_sel[age_idx] & weight_sel[weight_idx]
+        self._mask_race = race_idx[keep]
+        self._mask_readmit = readmit_idx[keep]
+        if readmission_type != "Any":
+            self._mask_readmit = np.where(self._mask_readmit == 2, 0, self._mask_readmit)
+        self._masks = cube.masks[keep]
+        self._mask_counts = cube.mask_counts[keep]
+
+    @property
+    def total(self):
+        return int(self.race_readmit.sum())
+
+    def readmission_rate(self):
+        """Share of encounters not labelled "NO" under the slice's readmission definition."""
+        total = self.total
+        return float(self.race_readmit[:, 1:].sum()) / total if total else float("nan")
+
+    def race_counts(self):
+        """Encounters per race, like ``filtered_df["race"].value_counts()``."""
+        counts = pd.Series(self.race_readmit[:-1].sum(axis=1), index=pd.Index(self.cube.races, name="race"))
+        return counts.sort_values(ascending=False, kind="stable").rename("count").reset_index()
+
+    def status_counts(self, med_cols):
+        """
+        (medication, status, outcome) counts for ``med_cols`` with statuses in STATUSES order.
+
+        The outcome axis is (not readmitted, readmitted): any readmission for "Any", "<30" only
+        otherwise.
+        """
+        idx = [self.cube.med_cols.index(m) for m in med_cols]
+        counts = self.status_readmit[idx]
+        return np.stack([counts[..., 0], counts[..., 1:].sum(axis=-1)], axis=-1)
+
+    def medication_counts(self, med_cols):
+        """
+        Users of each of ``med_cols`` per readmission label, as (label, medication), and users
+        of both medications of each pair, with the frequencies on the diagonal.
+        """
+        idx = [self.cube.med_cols.index(m) for m in med_cols]
+        return self._taking[:, idx], self._cooccurrence[np.ix_(idx, idx)]
+
+    def readmission_by_race(self, med_cols):
+        """Encounters taking any of ``med_cols`` per (race, readmission label)."""
+        selected = combination_codes(self._masks, med_cols) != 0
+        n_races = len(self.cube.races) + 1
+        counts = np.bincount(
+            self._mask_race[selected] * len(self.labels) + self._mask_readmit[selected],
+            weights=self._mask_counts[selected],
+            minlength=n_races * len(self.labels),
+        ).reshape(n_races, len(self.labels)).astype(np.int64)
+
+        races = self.cube.races + [None]
+        table = pd.DataFrame({
+            "race": np.repeat(races, len(self.labels)),
+            "readmission_label": np.tile(self.labels, n_races),
+            "count": counts.ravel(),
+        })
+        return table[table["count"] > 0].reset_index(drop=True)
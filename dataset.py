@@ -0,0 +1,120 @@
+import logging
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from artifacts import load_or_build
+from cluster import Cooccurrence
+from columnar_cache import file_fingerprint
+from cube import DataCube, filter_key
+from diagnoses import DiagnosisService
+from feature_store import memory_report
+from filters import DATA_FILE, FilterEngine, load_data, prepare_frame
+from profiling import profiled
+from utils import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+def freeze_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    ``df`` rebuilt on read-only arrays (categoricals on read-only codes), so no session can
+    modify the shared data in place. Arrays that already are read-only, e.g. memory-mapped
+    cache columns, are used as they are.
+    """
+    columns = {}
+    for col in df.columns:
+        series = df[col]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            codes = series.cat.codes.to_numpy()
+            codes.flags.writeable = False
+            columns[col] = pd.Categorical.from_codes(codes, dtype=series.dtype)
+        else:
+            values = series.to_numpy()
+            values.flags.writeable = False
+            columns[col] = values
+    return pd.DataFrame(columns, index=df.index, copy=False)
+
+
+class SharedDataset:
+    """
+    The prepared dataset and everything derived from it, built once per process.
+
+    ``frame`` is the feature store on read-only arrays. Sessions never copy it: a filter
+    state is an index array from ``rows``, which chart code uses to gather the single columns
+    it needs, and the cube and diagnosis service answer the aggregate charts directly.
+
+    Derived results are memoized on ``key``, a tuple of the filter state and ``version``,
+    which hashes in microseconds; the frame is only looked at when a key misses. With a
+    ``source`` file the prepared frame and the cube also persist in the artifact cache, so
+    they outlive the process.
+    """
+
+    def __init__(self, raw: pd.DataFrame, med_cols, version=None, source=None):
+        self.version = version
+        self.source = source
+        self.med_cols = list(med_cols)
+        self.source_columns = list(raw.columns)
+        frame, self.memory_report = self._artifact("feature_store", None, lambda: self._prepare(raw))
+        logger.info("feature store: %(rows)d rows, %(store_mb).1f MB (%(csv_frame_mb).1f MB as CSV strings, "
+                    "%(reduction).1fx smaller)", self.memory_report)
+        self.frame = freeze_frame(frame)
+        self.cube = self._artifact("cube", None, self._build_cube)
+        self.engine = FilterEngine(self.frame)
+        self.diagnoses = DiagnosisService(self.engine)
+        self._cooccurrence = LRUCache(8, name="cooccurrence")
+
+    def _prepare(self, raw):
+        frame = prepare_frame(raw, self.med_cols)
+        return frame, memory_report(raw, frame)
+
+    def _build_cube(self):
+        cube = DataCube.from_frame(self.frame, self.med_cols)
+        cube.bracket_sums()
+        return cube
+
+    def _artifact(self, name, params, build):
+        if self.source is None:
+            return build()
+        return load_or_build(name, self.source, build, params=[self.med_cols, params])
+
+    def __len__(self):
+        return len(self.frame)
+
+    def rows(self, age_range, weight_range, include_unknown_weight=True) -> np.ndarray:
+        """Read-only, sorted positions of the rows kept by a filter state."""
+        return self.engine.indices(age_range, weight_range, include_unknown_weight)
+
+    def key(self, age_range, weight_range, include_unknown_weight=True, readmission_type=None, med_cols=()):
+        """Canonical cache key of a filter state on this dataset."""
+        return (self.version, filter_key(age_range, weight_range, include_unknown_weight), readmission_type,
+                tuple(med_cols))
+
+    @profiled("cooccurrence")
+    def cooccurrence(self, age_range, weight_range, include_unknown_weight, readmission_type, med_cols):
+        """Co-occurrence counts and readmission rates of a filter state, for cluster graphs."""
+        key = self.key(age_range, weight_range, include_unknown_weight, readmission_type, med_cols)
+        return self._cooccurrence.get_or_compute(key, lambda: Cooccurrence.from_slice(
+            self.cube.slice(age_range, weight_range, include_unknown_weight, readmission_type), list(med_cols)))
+
+    def cache_stats(self):
+        """Hits, misses, evictions and bytes of the per-filter-state caches."""
+        return {
+            "rows": self.engine.cache.stats(),
+            "diagnoses": self.diagnoses.cache.stats(),
+            "cooccurrence": self._cooccurrence.stats(),
+        }
+
+
+def build_dataset() -> SharedDataset:
+    fingerprint = file_fingerprint(DATA_FILE)
+    return SharedDataset(*load_data(), version=(DATA_FILE, fingerprint["size"], fingerprint["mtime_ns"]),
+                         source=DATA_FILE)
+
+
+@profiled(cached=True)
+@st.cache_resource(show_spinner="Preparing data...")
+def load_dataset() -> SharedDataset:
+    """The dashboard dataset, shared by every session and page of this process."""
+    return build_dataset()
@@ -1,8 +1,8 @@
 import streamlit as st
-import pandas as pd
 import altair as alt
 
 from filters import load_data_full
+from histograms import load_overview_histograms
 
 st.set_page_config(page_title="Dataset Overview", page_icon="📊", layout="wide")
 
@@ -28,6 +28,7 @@ with st.expander("Dataset Source"):
     """)
 
 dataframe, medication_column_names_filtered = load_data_full()
+histograms = load_overview_histograms()
 
 st.subheader("Dataset Summary")
 col1, col2, col3 = st.columns(3)
@@ -43,8 +44,7 @@ st.header("Patient Demographics")
 demo_col1, demo_col2 = st.columns(2, width="stretch")
 
 with demo_col1:
-    gender_counts = dataframe['gender'].value_counts().reset_index()
-    gender_counts.columns = ['gender', 'count']
+    gender_counts = histograms.group_counts().rename(columns={'group': 'gender'})
 
     select = alt.selection_point(fields=['gender'], name='select')
 
@@ -61,19 +61,17 @@ with demo_col1:
     )
     gender_selection = st.altair_chart(gender_chart, on_select="rerun", key="gender_filter")
 
-    filtered_df = dataframe.copy()
+    # Distributions of every gender selection are precomputed; a selection only picks its tables.
+    selected_genders = []
     if gender_selection and gender_selection.selection and 'select' in gender_selection.selection:
-        points = gender_selection.selection['select']
-        if points:
-            selected_genders = [p.get('gender') for p in points if 'gender' in p]
-            if selected_genders:
-                filtered_df = filtered_df[filtered_df['gender'].isin(selected_genders)]
-                st.info(
-                    f"Filtered by Gender: {', '.join(selected_genders)} — Showing {len(filtered_df):,} of {len(dataframe):,} encounters")
+        selected_genders = [p.get('gender') for p in gender_selection.selection['select'] if 'gender' in p]
+    n_selected, counts = histograms.tables(selected_genders)
+    if selected_genders:
+        st.info(
+            f"Filtered by Gender: {', '.join(selected_genders)} — Showing {n_selected:,} of {len(dataframe):,} encounters")
 
 with demo_col2:
-    age_counts = filtered_df['age'].value_counts().reset_index()
-    age_counts.columns = ['age', 'count']
+    age_counts = counts['age']
     age_order = ['[0-10)', '[10-20)', '[20-30)', '[30-40)', '[40-50)',
                  '[50-60)', '[60-70)', '[70-80)', '[80-90)', '[90-100)']
 
@@ -87,8 +85,7 @@ with demo_col2:
     )
     st.altair_chart(age_chart)
 
-race_counts = filtered_df['race'].value_counts().reset_index()
-race_counts.columns = ['race', 'count']
+race_counts = counts['race']
 
 race_chart = alt.Chart(race_counts).mark_bar().encode(
     x=alt.X('race:N', sort='-y', title='Ethnicity'),
@@ -108,8 +105,7 @@ st.header("Clinical Outcomes")
 outcome_col1, outcome_col2 = st.columns(2)
 
 with outcome_col1:
-    readmit_counts = filtered_df['readmitted'].value_counts().reset_index()
-    readmit_counts.columns = ['readmitted', 'count']
+    readmit_counts = counts['readmitted']
 
     readmit_chart = alt.Chart(readmit_counts).mark_arc(innerRadius=50).encode(
         theta=alt.Theta('count:Q'),
@@ -124,8 +120,7 @@ with outcome_col1:
     st.altair_chart(readmit_chart)
 
 with outcome_col2:
-    time_counts = filtered_df['time_in_hospital'].value_counts().reset_index()
-    time_counts.columns = ['days', 'count']
+    time_counts = counts['time_in_hospital']
 
     time_chart = alt.Chart(time_counts).mark_bar().encode(
         x=alt.X('days:O', title='Days in Hospital'),
@@ -142,10 +137,7 @@ st.header("Healthcare Utilization")
 util_col1, util_col2, util_col3 = st.columns(3)
 
 with util_col1:
-    lab_bins = pd.cut(filtered_df['num_lab_procedures'], bins=20)
-    lab_counts = lab_bins.value_counts().sort_index().reset_index()
-    lab_counts.columns = ['bin', 'count']
-    lab_counts['bin_mid'] = lab_counts['bin'].apply(lambda x: x.mid)
+    lab_counts = counts['num_lab_procedures']
 
     lab_hist = alt.Chart(lab_counts).mark_bar().encode(
         x=alt.X('bin_mid:Q', title='Lab Procedures'),
@@ -158,10 +150,7 @@ with util_col1:
     st.altair_chart(lab_hist)
 
 with util_col2:
-    med_bins = pd.cut(filtered_df['num_medications'], bins=20)
-    med_counts = med_bins.value_counts().sort_index().reset_index()
-    med_counts.columns = ['bin', 'count']
-    med_counts['bin_mid'] = med_counts['bin'].apply(lambda x: x.mid)
+    med_counts = counts['num_medications']
 
     med_hist = alt.Chart(med_counts).mark_bar().encode(
         x=alt.X('bin_mid:Q', title='Medications'),
@@ -174,8 +163,7 @@ with util_col2:
     st.altair_chart(med_hist)
 
 with util_col3:
-    diag_counts = filtered_df['number_diagnoses'].value_counts().reset_index()
-    diag_counts.columns = ['diagnoses', 'count']
+    diag_counts = counts['number_diagnoses']
 
     diag_chart = alt.Chart(diag_counts).mark_bar().encode(
         x=alt.X('diagnoses:O', title='Number of Diagnoses'),
@@ -192,8 +180,7 @@ st.header("Prior Healthcare Visits")
 visit_col1, visit_col2, visit_col3 = st.columns(3)
 
 with visit_col1:
-    outpatient_counts = filtered_df['number_outpatient'].clip(upper=10).value_counts().reset_index()
-    outpatient_counts.columns = ['visits', 'count']
+    outpatient_counts = counts['number_outpatient']
 
     outpatient_chart = alt.Chart(outpatient_counts).mark_bar().encode(
         x=alt.X('visits:O', title='Outpatient Visits'),
@@ -206,8 +193,7 @@ with visit_col1:
     st.altair_chart(outpatient_chart)
 
 with visit_col2:
-    emergency_counts = filtered_df['number_emergency'].clip(upper=10).value_counts().reset_index()
-    emergency_counts.columns = ['visits', 'count']
+    emergency_counts = counts['number_emergency']
 
     emergency_chart = alt.Chart(emergency_counts).mark_bar().encode(
         x=alt.X('visits:O', title='Emergency Visits'),
@@ -220,8 +206,7 @@ with visit_col2:
     st.altair_chart(emergency_chart)
 
 with visit_col3:
-    inpatient_counts = filtered_df['number_inpatient'].clip(upper=10).value_counts().reset_index()
-    inpatient_counts.columns = ['visits', 'count']
+    inpatient_counts = counts['number_inpatient']
 
     inpatient_chart = alt.Chart(inpatient_counts).mark_bar().encode(
         x=alt.X('visits:O', title='Inpatient Visits'),
@@ -0,0 +1,138 @@
+import numpy as np
+import pandas as pd
+
+from cube import BracketSums, filter_key, select_brackets
+from kernels import crosstab_counts
+from medications import MEDICATION_COLUMNS, medication_bit, medication_masks
+from profiling import profiled
+from readmission import READMIT_LABELS, fold_readmission, readmission_labels
+from utils import LRUCache, categorize_codes, code_categories
+
+DIAG_COLUMNS = ["diag_1", "diag_2", "diag_3"]
+DIAG_CATEGORY_COLUMNS = [f"{c}_cat" for c in DIAG_COLUMNS]
+
+
+def diagnosis_codes(df: pd.DataFrame) -> np.ndarray:
+    """(len(df), 3) int8 category codes of the three diagnoses, in code_categories() order."""
+    categories = code_categories()
+    codes = np.empty((len(df), len(DIAG_COLUMNS)), dtype=np.int8)
+    for i, (col, cat_col) in enumerate(zip(DIAG_COLUMNS, DIAG_CATEGORY_COLUMNS)):
+        if cat_col in df.columns and list(df[cat_col].cat.categories) == categories:
+            codes[:, i] = df[cat_col].cat.codes.to_numpy()
+        else:
+            codes[:, i] = categorize_codes(df[col].replace("?", pd.NA)).codes
+    return codes
+
+
+def _row_codes(df: pd.DataFrame):
+    """Race categories plus per-row race, readmitted, diagnosis and medication-mask codes."""
+    race = pd.Categorical(df["race"])
+    race_idx = np.where(race.codes < 0, len(race.categories), race.codes)
+    readmit_idx = pd.Categorical(df["readmitted"], categories=READMIT_LABELS).codes
+    masks = medication_masks(df, [m for m in MEDICATION_COLUMNS if m in df.columns])
+    return race.categories, race_idx, readmit_idx, diagnosis_codes(df), masks
+
+
+def diagnosis_tensors(group_idx, n_groups, readmit_idx, diag, masks):
+    """
+    Encounter counts per (group, readmitted, diagnosis category) and medication use per
+    (group, diagnosis category, medication), counting each of an encounter's three diagnoses.
+    """
+    n_cats = len(code_categories())
+
+    # (group, readmitted, category) with the three diagnosis positions as a (n, 3) axis.
+    readmit_counts = crosstab_counts([group_idx, readmit_idx, diag], (n_groups, len(READMIT_LABELS), n_cats))
+
+    # Medication use: count the distinct (group, category, mask) keys, then spread each key's
+    # count over the medications set in its mask.
+    cell = group_idx.astype(np.int64)[:, None] * n_cats + diag
+    keys = ((cell << 32) | masks.astype(np.int64)[:, None]).ravel()
+    labels, uniques = pd.factorize(keys)
+    totals = np.bincount(labels, minlength=len(uniques))
+    bits = (uniques[:, None] >> np.arange(len(MEDICATION_COLUMNS))) & 1
+    used = np.zeros((n_groups * n_cats, len(MEDICATION_COLUMNS)), dtype=np.int64)
+    np.add.at(used, uniques >> 32, bits * totals[:, None])
+    return readmit_counts, used.reshape(n_groups, n_cats, len(MEDICATION_COLUMNS))
+
+
+class DiagnosisCounts:
+    """
+    Encounter counts per (race, readmitted, diagnosis category) and medication use per
+    (race, diagnosis category), counting each of an encounter's three diagnoses.
+
+    The last race slot holds encounters with a missing race; like a groupby over "race" the
+    chart tables leave it out.
+    """
+
+    def __init__(self, races, readmit_counts, used):
+        self.races = list(races)
+        self.categories = code_categories()
+        self.readmit_counts = readmit_counts
+        self.n = readmit_counts.sum(axis=1)
+        self.used = used
+
+    @classmethod
+    def from_codes(cls, races, race_idx, readmit_idx, diag, masks):
+        return cls(races, *diagnosis_tensors(race_idx, len(races) + 1, readmit_idx, diag, masks))
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame):
+        return cls.from_codes(*_row_codes(df))
+
+    def readmission_table(self, readmission_type):
+        """Non-zero counts as (race, readmitted, icd9_category, count) rows."""
+        labels = readmission_labels(readmission_type)
+        counts = fold_readmission(self.readmit_counts[:-1], readmission_type, axis=1)
+        race, readmit, cat = np.nonzero(counts)
+        return pd.DataFrame({
+            "race": np.asarray(self.races, dtype=object)[race],
+            "readmitted": np.asarray(labels, dtype=object)[readmit],
+            "icd9_category": np.asarray(self.categories, dtype=object)[cat],
+            "count": counts[race, readmit, cat],
+        })
+
+    def medication_table(self, med_cols):
+        """(race, diagnosis_category, n, used, medication) rows for the observed (race, category) pairs."""
+        race, cat = np.nonzero(self.n[:-1])
+        bits = [medication_bit(m) for m in med_cols]
+        return pd.DataFrame({
+            "race": np.tile(np.asarray(self.races, dtype=object)[race], len(bits)),
+            "diagnosis_category": np.tile(np.asarray(self.categories, dtype=object)[cat], len(bits)),
+            "n": np.tile(self.n[race, cat], len(bits)),
+            "used": self.used[race, cat][:, bits].T.ravel(),
+            "medication": np.repeat(list(med_cols), len(race)),
+        })
+
+
+class DiagnosisService:
+    """
+    DiagnosisCounts for the filter states of a FilterEngine.
+
+    The counts of every (age, weight) bracket are taken once from the prepared frame; a filter
+    state sums them with cube.BracketSums, which only adds and subtracts the brackets that
+    changed since the last state, and is memoized, independently of the readmission
+    definition which the tables apply afterwards.
+    """
+
+    def __init__(self, engine, cache_size=32):
+        self.engine = engine
+        races, race_idx, readmit_idx, diag, masks = _row_codes(engine.df)
+        self._races = list(races)
+        n_races = len(races) + 1
+        group_idx = engine.row_brackets() * n_races + race_idx
+        readmit_counts, used = diagnosis_tensors(group_idx, int(np.prod(engine.shape)) * n_races, readmit_idx,
+                                                 diag, masks)
+        self._readmit_counts = BracketSums(readmit_counts.reshape(engine.shape + (n_races,) + readmit_counts.shape[1:]))
+        self._used = BracketSums(used.reshape(engine.shape + (n_races,) + used.shape[1:]))
+        self.cache = LRUCache(cache_size, name="diagnosis_counts")
+
+    @profiled("diagnosis_counts")
+    def counts(self, age_range, weight_range, include_unknown_weight=True) -> DiagnosisCounts:
+        key = filter_key(age_range, weight_range, include_unknown_weight)
+        return self.cache.get_or_compute(key, lambda: self._counts(age_range, weight_range, include_unknown_weight))
+
+    def _counts(self, age_range, weight_range, include_unknown_weight):
+        age_sel, weight_sel = select_brackets(self.engine.age_values, self.engine.weight_values, age_range,
+                                              weight_range, include_unknown_weight)
+        return DiagnosisCounts(self._races, self._readmit_counts.sum(age_sel, weight_sel),
+                               self._used.sum(age_sel, weight_sel))
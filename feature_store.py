@@ -0,0 +1,72 @@
+import sys
+
+import numpy as np
+import pandas as pd
+
+from medications import MASK_COLUMN, STATUS_SUFFIX, STATUSES
+from readmission import OUTCOME_COLUMNS
+
+# Columns of the encoded frame returned by filters.prepare_frame, with their dtypes. Category columns hold
+# small integer codes plus their labels.
+FEATURE_SCHEMA = {
+    "race": ("category", "race label; unknown race keeps the source label ? as a category"),
+    "gender": ("category", "gender label"),
+    "age": ("category", "age bracket label, e.g. [60-70)"),
+    "age_lb": ("int16", "lower bound of the age bracket"),
+    "weight_lb": ("float32", "lower bound of the weight bracket, NaN when unknown; >200 is 200"),
+    "diag_1_cat": ("category", "ICD-9 chapter of the primary diagnosis (utils.code_categories)"),
+    "diag_2_cat": ("category", "ICD-9 chapter of the secondary diagnosis"),
+    "diag_3_cat": ("category", "ICD-9 chapter of the additional diagnosis"),
+    "readmitted": ("category", "NO, <30 or >30"),
+    OUTCOME_COLUMNS["Any"]: ("int8", "1 if readmitted at all"),
+    OUTCOME_COLUMNS["<30 days only"]: ("int8", "1 if readmitted within 30 days"),
+    MASK_COLUMN: ("uint32", "bit medications.medication_bit(med) set when med is taken"),
+}
+# One per medication passed to prepare_frame.
+STATUS_SCHEMA = ("int8", f"index into {STATUSES}, -1 when missing")
+# Integer source columns are kept as they are (int16/int64 from the columnar cache).
+
+
+def feature_columns(df: pd.DataFrame, med_cols, keep_columns=()):
+    """Columns of ``df`` that belong in the feature store, plus any ``keep_columns``."""
+    wanted = list(FEATURE_SCHEMA) + [m + STATUS_SUFFIX for m in med_cols]
+    numeric = [c for c in df.columns if pd.api.types.is_integer_dtype(df[c]) and c not in wanted]
+    keep = [c for c in keep_columns if c not in wanted and c not in numeric]
+    return [c for c in df.columns if c in wanted or c in numeric or c in keep]
+
+
+def frame_bytes(df: pd.DataFrame):
+    return int(df.memory_usage(deep=True, index=False).sum())
+
+
+def object_frame_bytes(df: pd.DataFrame):
+    """
+    Size of ``df`` as read_csv leaves it without dtypes: category columns as one Python
+    string per row, numbers as 64-bit values.
+    """
+    total = 0
+    for col in df.columns:
+        series = df[col]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            codes = series.cat.codes.to_numpy()
+            label_bytes = np.array([sys.getsizeof(str(c)) for c in series.cat.categories], dtype=np.int64)
+            counts = np.bincount(codes[codes >= 0], minlength=len(label_bytes))
+            total += len(series) * 8 + int(counts @ label_bytes)
+        elif series.dtype == object:
+            total += frame_bytes(series.to_frame())
+        else:
+            total += len(series) * 8
+    return total
+
+
+def memory_report(source: pd.DataFrame, store: pd.DataFrame):
+    """Memory of the source as loaded, as plain CSV strings, and of the feature store."""
+    store_bytes = frame_bytes(store)
+    report = {
+        "rows": len(store),
+        "source_mb": frame_bytes(source) / 2 ** 20,
+        "csv_frame_mb": object_frame_bytes(source) / 2 ** 20,
+        "store_mb": store_bytes / 2 ** 20,
+    }
+    report["reduction"] = report["csv_frame_mb"] / report["store_mb"] if store_bytes else float("nan")
+    return report
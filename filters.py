@@ -1,58 +1,76 @@
+import numpy as np
 import streamlit as st
 import pandas as pd
 
-from utils import icd9_to_category
+from columnar_cache import load_csv_cached
+from cube import bracket_codes, filter_key, select_brackets
+from feature_store import feature_columns
+from medications import MASK_COLUMN, STATUS_SUFFIX, pack_medications, status_codes
+from profiling import profiled
+from readmission import add_outcome_columns
+from utils import LRUCache, categorize_codes
 
+DATA_FILE = "data/diabetic_data_smol.csv"
+FULL_DATA_FILE = "data/diabetic_data.csv"
 
-@st.cache_data(show_spinner=True)
-def load_data():
-    df = pd.read_csv("data/diabetic_data_smol.csv")
 
-    medication_column_names = df.columns[24 - 17:47 - 17].tolist()
-    # medication_column_names = df.columns[24:47].tolist()
-    medication_column_names_filtered = [
-        c for c in medication_column_names
-        if (df[c] != "No").sum() > 100
-    ]
-    return df, medication_column_names_filtered
+# Loaded frames are memory-mapped from the columnar cache and treated as read-only, so they
+# are shared as resources instead of being pickled into every session.
+@profiled(cached=True)
+@st.cache_resource(show_spinner=True)
+def load_data():
+    return load_csv_cached(DATA_FILE, medication_slice=slice(24 - 17, 47 - 17))
 
 
-@st.cache_data(show_spinner=False)
+# The full CSV keeps the 17 leading columns the small file drops, so its medications are
+# columns 24:47. (The small file's slice, used here before, picked admission, ID and lab
+# columns instead, and the Dataset Overview counted 21 "medications" rather than 11.)
+@profiled(cached=True)
+@st.cache_resource(show_spinner=False)
 def load_data_full():
-    df = pd.read_csv("data/diabetic_data.csv")
+    return load_csv_cached(FULL_DATA_FILE, medication_slice=slice(24, 47))
+
+
+def leading_numbers(series: pd.Series) -> np.ndarray:
+    """The first number in each label, e.g. 60 for "[60-70)" or 200 for ">200"; NaN when there is none."""
+    cat = series.astype("category")
+    labels = cat.cat.categories.astype(str).str.extract(r"(\d+)")[0]
+    numbers = pd.to_numeric(labels, errors="coerce").to_numpy(dtype=float)
+    return np.append(numbers, np.nan)[cat.cat.codes.to_numpy()]
 
-    medication_column_names = df.columns[24 - 17:47 - 17].tolist()
-    medication_column_names_filtered = [
-        c for c in medication_column_names
-        if (df[c] != "No").sum() > 100
-    ]
-    return df, medication_column_names_filtered
 
+@profiled()
+def prepare_frame(df: pd.DataFrame, med_cols_all=None, keep_columns=()) -> pd.DataFrame:
+    """
+    Encode ``df`` into the feature store described by feature_store.FEATURE_SCHEMA.
 
-@st.cache_data(show_spinner=False)
-def prepare_df(df: pd.DataFrame, med_cols_all=None) -> pd.DataFrame:
+    Medication statuses become int8 codes plus the packed medication mask, diagnoses their
+    ICD-9 chapter, labels categoricals, and the readmission outcomes int8 vectors. Integer
+    columns are kept; other source columns (the status and diagnosis strings, weight, ...)
+    are dropped unless listed in ``keep_columns``. Works on any chunk of a file as well.
+    """
     df = df.copy()
 
-    df["age_lb"] = df["age"].str.extract(r"(\d+)").astype("int16")
+    for col in ["race", "gender", "age", "readmitted"]:
+        if col in df.columns:
+            df[col] = df[col].astype("category")
 
-    # Weight lower bound: "?", ">200" -> NaN or 200
-    w = df["weight"].replace({"?": pd.NA, ">200": "200"})
-    df["weight_lb"] = pd.to_numeric(w.str.extract(r"(\d+)")[0], errors="coerce").astype("float32")
+    df["age_lb"] = leading_numbers(df["age"]).astype("int16")
+    # Weight lower bound: "?" -> NaN, ">200" -> 200
+    df["weight_lb"] = leading_numbers(df["weight"]).astype("float32")
 
-    diag_cols = ["diag_1", "diag_2", "diag_3"]
-    df[diag_cols] = df[diag_cols].replace("?", pd.NA)
-    for col in diag_cols:
-        df[f"{col}_cat"] = df[col].apply(icd9_to_category)
+    for col in ["diag_1", "diag_2", "diag_3"]:
+        df[f"{col}_cat"] = categorize_codes(df[col])
 
+    med_cols_all = list(med_cols_all or [])
+    for c in med_cols_all:
+        df[c + STATUS_SUFFIX] = status_codes(df[c])
     if med_cols_all:
-        df[med_cols_all] = df[med_cols_all].replace("?", pd.NA)
-        for c in med_cols_all:
-            df[f"{c}_bin"] = (df[c].isin(["Up", "Down", "Steady"])).astype("int8")
+        df[MASK_COLUMN] = pack_medications(df, med_cols_all)
 
-    for col in ["readmitted", "race"]:
-        if col in df.columns:
-            df[col] = df[col].astype("category")
-    return df
+    if "readmitted" in df.columns:
+        add_outcome_columns(df)
+    return df[feature_columns(df, med_cols_all, keep_columns)]
 
 
 def filter_by_age(df: pd.DataFrame, age_range: tuple):
@@ -86,14 +104,12 @@ def filter_by_race(df: pd.DataFrame, selected_races: list):
 
 
 def filter_by_readmission(df: pd.DataFrame, selectedType):
-    if selectedType == "Any":
-        print("using any")
-        return df
-    print("using selected type: " + selectedType)
-    # return df[df["readmitted"].isin(["<30", "NO"])]
-    return df[df["readmitted"].replace(">30", "NO", inplace=True)]
+    # Both definitions keep every encounter; "<30 days only" only relabels ">30" as "NO", which
+    # consumers derive from the readmit_* outcome columns (see readmission.readmitted_labels).
+    return df
 
 
+@profiled()
 def filter_all(df, age_range, weight_range, include_unknown_weight=True, readmission_type="Any"):
     min_age, max_age = age_range
     min_w, max_w = weight_range
@@ -108,12 +124,71 @@ def filter_all(df, age_range, weight_range, include_unknown_weight=True, readmis
         mask_weight = df["weight_lb"].notna() & (
                 (df["weight_lb"] >= min_w) & (df["weight_lb"] < max_w)
         )
-    if readmission_type == "Any":
-        mask_readm = pd.Series(True, index=df.index)
-    else:
-        # mask_readm = df["readmitted"].isin(["NO", "<30"])
-        df["readmitted"].replace(">30", "NO", inplace=True)
-        mask_readm = df["readmitted"].isin(["NO", "<30"])
 
-    mask = mask_age & mask_weight & mask_readm
+    mask = mask_age & mask_weight
     return df.loc[mask]
+
+
+def take_rows(df: pd.DataFrame, rows=None) -> pd.DataFrame:
+    """
+    ``df`` at the positions ``rows``, or ``df`` itself when ``rows`` is None or keeps every row.
+
+    This gathers every column; code on the rerun path reads the columns it needs at ``rows``
+    instead and keeps this for fallbacks.
+    """
+    if rows is None or len(rows) == len(df):
+        return df
+    return df.iloc[rows]
+
+
+class FilterEngine:
+    """
+    filter_all for repeated filter states over one prepared frame.
+
+    Rows are grouped once by (age bracket, weight bracket), so a filter state is answered by
+    concatenating the precomputed row ranges of its brackets. The resulting index arrays are
+    kept in a small LRU cache, and the readmission definition never touches the rows.
+    """
+
+    def __init__(self, df: pd.DataFrame, cache_size=32):
+        self.df = df
+        self.age_values, age_idx, self.weight_values, weight_idx = bracket_codes(df)
+
+        self.shape = (len(self.age_values), len(self.weight_values) + 1)
+        cell = np.ravel_multi_index((age_idx, weight_idx), self.shape)
+        # Row positions grouped by bracket, ascending within each bracket.
+        self._order = np.argsort(cell, kind="stable")
+        self._offsets = np.concatenate([[0], np.cumsum(np.bincount(cell, minlength=int(np.prod(self.shape))))])
+        self.cache = LRUCache(cache_size, name="filter_rows")
+
+    def row_brackets(self) -> np.ndarray:
+        """Flat (age, weight) bracket index of every row, as used by BracketSums partials."""
+        brackets = np.empty(len(self._order), dtype=np.int64)
+        brackets[self._order] = np.repeat(np.arange(len(self._offsets) - 1), np.diff(self._offsets))
+        return brackets
+
+    def bracket_rows(self, age_i, weight_i):
+        """Row positions in one (age, weight) bracket."""
+        c = np.ravel_multi_index((age_i, weight_i), self.shape)
+        return self._order[self._offsets[c]:self._offsets[c + 1]]
+
+    @profiled("filter_rows")
+    def indices(self, age_range, weight_range, include_unknown_weight=True) -> np.ndarray:
+        """Sorted row positions kept by a filter state."""
+        key = filter_key(age_range, weight_range, include_unknown_weight)
+        return self.cache.get_or_compute(key, lambda: self._indices(age_range, weight_range, include_unknown_weight))
+
+    def _indices(self, age_range, weight_range, include_unknown_weight):
+        age_sel, weight_sel = select_brackets(self.age_values, self.weight_values, age_range, weight_range,
+                                              include_unknown_weight)
+        if age_sel.all() and weight_sel.all():
+            idx = np.arange(len(self.df))
+        else:
+            parts = [self.bracket_rows(a, w) for a in np.flatnonzero(age_sel) for w in np.flatnonzero(weight_sel)]
+            idx = np.sort(np.concatenate(parts)) if parts else np.empty(0, dtype=np.int64)
+        idx.flags.writeable = False
+        return idx
+
+    def filter(self, age_range, weight_range, include_unknown_weight=True) -> pd.DataFrame:
+        """The filtered frame; the prepared frame itself when nothing is filtered out."""
+        return take_rows(self.df, self.indices(age_range, weight_range, include_unknown_weight))
@@ -0,0 +1,137 @@
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from artifacts import load_or_build
+from filters import FULL_DATA_FILE, load_data_full
+from kernels import crosstab_counts
+from profiling import profiled
+from streaming_stats import STATS_CHUNK_ROWS, iter_chunks
+
+# Fixed bin edges covering the UCI value ranges (1-132 lab procedures, 1-81 medications), so
+# bins do not move with the data or the selection; values past the last edge count in the last bin.
+LAB_PROCEDURE_EDGES = np.arange(0, 141, 7)
+MEDICATION_EDGES = np.arange(0, 85, 4)
+# Prior visits above this are counted here.
+MAX_VISITS = 10
+
+# Dataset Overview histograms: column -> field name of its table and how values are binned.
+OVERVIEW_HISTOGRAMS = {
+    "age": {"field": "age"},
+    "race": {"field": "race"},
+    "readmitted": {"field": "readmitted"},
+    "time_in_hospital": {"field": "days"},
+    "num_lab_procedures": {"field": "bin_mid", "edges": LAB_PROCEDURE_EDGES},
+    "num_medications": {"field": "bin_mid", "edges": MEDICATION_EDGES},
+    "number_diagnoses": {"field": "diagnoses"},
+    "number_outpatient": {"field": "visits", "upper": MAX_VISITS},
+    "number_emergency": {"field": "visits", "upper": MAX_VISITS},
+    "number_inpatient": {"field": "visits", "upper": MAX_VISITS},
+}
+
+
+def histogram_labels(series: pd.Series, edges=None, upper=None) -> np.ndarray:
+    """
+    The label of every histogram bin of ``series``.
+
+    Labels (categoricals, strings) get one bin per category. Numbers fall in the bins between
+    ``edges``, labelled by their midpoints, or without edges get one bin per integer from the
+    column minimum to its maximum or ``upper``, whichever is lower.
+    """
+    if not pd.api.types.is_numeric_dtype(series):
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            return np.asarray(series.cat.categories)
+        return np.asarray(pd.Categorical(series).categories)
+    if edges is not None:
+        edges = np.asarray(edges)
+        return (edges[:-1] + edges[1:]) / 2
+    values = series.to_numpy()
+    low = int(values.min()) if len(values) else 0
+    high = int(values.max()) if len(values) else 0
+    if upper is not None:
+        high = min(high, upper)
+    return np.arange(low, high + 1)
+
+
+def histogram_codes(series: pd.Series, labels, edges=None) -> np.ndarray:
+    """Bin index of every value of ``series`` among ``labels`` from histogram_labels; -1 for missing labels."""
+    if not pd.api.types.is_numeric_dtype(series):
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            return series.cat.codes.to_numpy()
+        return pd.Categorical(series, categories=labels).codes
+    values = series.to_numpy()
+    if edges is not None:
+        return np.clip(np.searchsorted(edges, values, side="right") - 1, 0, len(edges) - 2)
+    return np.minimum(values, labels[-1]).astype(np.int64) - labels[0]
+
+
+class GroupedHistograms:
+    """
+    Histograms of several columns for every combination of groups, e.g. of genders.
+
+    Bin labels are taken from the whole columns first; the rows are then binned into integer
+    codes and counted per group with crosstab_counts one chunk at a time, so only a chunk of
+    codes is ever held. The tables of each group combination are built up front from those
+    counts, so selecting groups only looks up tables and never touches the rows.
+    """
+
+    def __init__(self, df: pd.DataFrame, group, columns, chunk_rows=STATS_CHUNK_ROWS):
+        self.groups = histogram_labels(df[group]).tolist()
+        self.fields = {col: spec["field"] for col, spec in columns.items()}
+        self.categorical = {col: not pd.api.types.is_numeric_dtype(df[col]) for col in columns}
+        labels = {col: histogram_labels(df[col], spec.get("edges"), spec.get("upper"))
+                  for col, spec in columns.items()}
+        n_bins = max(len(l) for l in labels.values())
+        shape = (len(self.groups) + 1, n_bins, len(columns))
+        counts = np.zeros(shape, dtype=np.int64)
+        self.group_totals = np.zeros(len(self.groups) + 1, dtype=np.int64)
+        column_axis = np.arange(len(columns))[None, :]
+        for chunk in iter_chunks(df, chunk_rows):
+            group_codes = histogram_codes(chunk[group], self.groups)
+            # Missing groups get a trailing slot, counted only when no group is selected.
+            group_idx = np.where(group_codes < 0, len(self.groups), group_codes)
+            codes = np.column_stack([
+                np.asarray(histogram_codes(chunk[col], labels[col], spec.get("edges")), dtype=np.int16)
+                for col, spec in columns.items()])
+            counts += crosstab_counts([group_idx, codes, column_axis], shape)
+            self.group_totals += np.bincount(group_idx, minlength=len(self.groups) + 1)
+
+        self._tables = {}
+        for r in range(len(self.groups) + 1):
+            for selected in combinations(range(len(self.groups)), r):
+                slots = list(selected) if selected else slice(None)
+                key = frozenset(self.groups[i] for i in selected)
+                self._tables[key] = (int(self.group_totals[slots].sum()),
+                                     self._build_tables(counts[slots].sum(axis=0), labels))
+
+    def _build_tables(self, counts, labels):
+        tables = {}
+        for j, (col, col_labels) in enumerate(labels.items()):
+            table = pd.DataFrame({self.fields[col]: col_labels, "count": counts[:len(col_labels), j]})
+            # Like value_counts: every category, but only the numeric bins that occur.
+            if not self.categorical[col]:
+                table = table[table["count"] > 0].reset_index(drop=True)
+            tables[col] = table
+        return tables
+
+    def group_counts(self) -> pd.DataFrame:
+        """Rows per group, without missing groups."""
+        return pd.DataFrame({"group": self.groups, "count": self.group_totals[:len(self.groups)]})
+
+    def tables(self, selected=()):
+        """Row count and per-column tables of the rows in the ``selected`` groups (all rows when empty)."""
+        return self._tables[frozenset(selected)]
+
+
+def build_overview_histograms() -> GroupedHistograms:
+    return load_or_build("overview_histograms", FULL_DATA_FILE, lambda: GroupedHistograms(
+        load_data_full()[0], "gender", OVERVIEW_HISTOGRAMS))
+
+
+@profiled(cached=True)
+@st.cache_resource(show_spinner="Summarizing data...")
+def load_overview_histograms() -> GroupedHistograms:
+    """The Dataset Overview histograms per gender selection, shared by every session."""
+    return build_overview_histograms()
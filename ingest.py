@@ -0,0 +1,216 @@
+"""
+Streaming ingestion for encounter files larger than memory.
+
+The source is read in chunks (from the columnar cache when an entry exists, else from the
+CSV), each chunk goes through the prepare_frame transformations and is folded into mergeable
+aggregates: the filter-cell count cube, the medication co-occurrence matrix, value
+histograms and correlation moments. Only one chunk is held in memory at a time.
+
+Run from the repository root to ingest a file and print the aggregate summary:
+    python ingest.py data/diabetic_data.csv [--memory-mb 512] [--chunk-rows N]
+"""
+import argparse
+import logging
+import os
+import resource
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from artifacts import load_or_build
+from columnar_cache import CACHE_DIR, MEDICATION_MIN_COUNT, csv_dtypes, open_cached
+from cube import DataCube
+from filters import FULL_DATA_FILE, leading_numbers, load_data_full, prepare_frame
+from medications import STATUSES, cooccurrence_matrix, combination_codes, medication_masks
+from streaming_stats import CorrelationAccumulator, iter_chunks
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MEMORY_MB = 512
+# Rows read first to estimate the memory taken per prepared row.
+PROBE_ROWS = 2000
+# A chunk is held raw, copied by prepare_frame and extended with derived columns at once.
+CHUNK_OVERHEAD = 4
+
+HISTOGRAM_COLUMNS = [
+    "race", "gender", "age", "readmitted", "time_in_hospital", "num_lab_procedures", "num_procedures",
+    "num_medications", "number_diagnoses", "number_outpatient", "number_emergency", "number_inpatient",
+]
+# age_lb stands in for the age midpoint: correlations do not change under a constant shift.
+CORRELATION_COLUMNS = ["time_in_hospital", "num_lab_procedures", "num_procedures", "num_medications", "age_lb"]
+
+
+def current_rss_bytes():
+    """Resident set size of this process; falls back to the peak where /proc is unavailable."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return peak_rss_bytes()
+
+
+def peak_rss_bytes():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class EncounterAggregates:
+    """
+    Mergeable aggregates over encounter chunks.
+
+    ``cube`` is a DataCube over all ``med_cols``, ``cooccurrence`` counts encounters taking
+    both medications, ``histograms`` maps each HISTOGRAM_COLUMNS column to its value counts
+    and ``correlations`` accumulates CORRELATION_COLUMNS. Every part adds up across chunks,
+    so aggregates of separate files or processes combine with ``merge``.
+    """
+
+    def __init__(self, med_cols):
+        self.med_cols = list(med_cols)
+        self.rows = 0
+        self.cube = None
+        self.cooccurrence = np.zeros((len(self.med_cols), len(self.med_cols)), dtype=np.int64)
+        self.histograms = {}
+        self.correlations = CorrelationAccumulator(CORRELATION_COLUMNS)
+
+    def update(self, df: pd.DataFrame):
+        """Adds one chunk that went through prepare_frame."""
+        self.rows += len(df)
+        cube = DataCube(df, self.med_cols)
+        self.cube = cube if self.cube is None else self.cube.merge(cube)
+        codes = combination_codes(medication_masks(df, self.med_cols), self.med_cols)
+        self.cooccurrence += cooccurrence_matrix(codes, len(self.med_cols))
+        for col in HISTOGRAM_COLUMNS:
+            if col in df.columns:
+                self._add_histogram(col, df[col].value_counts(sort=False))
+        self.correlations.update(df)
+        return self
+
+    def _add_histogram(self, col, counts):
+        counts = counts[counts > 0]
+        counts = pd.Series(counts.to_numpy(), index=np.asarray(counts.index))
+        if col in self.histograms:
+            counts = self.histograms[col].add(counts, fill_value=0)
+        self.histograms[col] = counts.astype(np.int64).sort_index()
+
+    def merge(self, other):
+        if other.med_cols != self.med_cols:
+            raise ValueError("cannot merge aggregates over different medication columns")
+        self.rows += other.rows
+        if other.cube is not None:
+            self.cube = other.cube if self.cube is None else self.cube.merge(other.cube)
+        self.cooccurrence += other.cooccurrence
+        for col, counts in other.histograms.items():
+            self._add_histogram(col, counts)
+        self.correlations.merge(other.correlations)
+        return self
+
+    def medication_users(self) -> pd.Series:
+        """Encounters with a status other than "No" per medication."""
+        status = self.cube.status_counts.sum(axis=tuple(range(len(self.cube.shape))))
+        return pd.Series(status[:, STATUSES.index("No") + 1:].sum(axis=1), index=self.med_cols)
+
+    def filtered_medications(self, min_count=MEDICATION_MIN_COUNT):
+        """The medications load_csv_cached keeps: those with more than ``min_count`` users."""
+        users = self.medication_users()
+        return [m for m in self.med_cols if users[m] > min_count]
+
+
+def correlation_stats(df: pd.DataFrame) -> CorrelationAccumulator:
+    """
+    CORRELATION_COLUMNS of a loaded source frame, e.g. the memory-mapped columnar cache entry,
+    accumulated chunk by chunk over views of its columns without preparing it.
+    """
+    columns = {col: df[col] for col in CORRELATION_COLUMNS if col in df.columns}
+    columns["age_lb"] = leading_numbers(df["age"])
+    return CorrelationAccumulator.from_chunks(CORRELATION_COLUMNS, iter_chunks(pd.DataFrame(columns, copy=False)))
+
+
+def build_correlation_stats() -> CorrelationAccumulator:
+    """Correlations of the full dataset, read from the artifact cache when it has them."""
+    return load_or_build("correlation_stats", FULL_DATA_FILE, lambda: correlation_stats(load_data_full()[0]))
+
+
+def iter_source_chunks(path, medication_slice, chunk_rows, cache_dir=CACHE_DIR):
+    """Raw chunks of ``path``, sliced from its columnar cache entry when there is one."""
+    cached = open_cached(path, medication_slice, cache_dir=cache_dir)
+    if cached is not None:
+        df, _ = cached
+        for start in range(0, len(df), chunk_rows):
+            yield df.iloc[start:start + chunk_rows]
+        return
+    header = pd.read_csv(path, nrows=0).columns
+    yield from pd.read_csv(path, dtype=csv_dtypes(header), chunksize=chunk_rows)
+
+
+def estimate_chunk_rows(path, med_cols, memory_mb):
+    """Rows per chunk that keep a chunk's working set within what is left of ``memory_mb``."""
+    header = pd.read_csv(path, nrows=0).columns
+    probe = pd.read_csv(path, dtype=csv_dtypes(header), nrows=PROBE_ROWS)
+    prepared = prepare_frame(probe, med_cols)
+    row_bytes = probe.memory_usage(deep=True).sum() + prepared.memory_usage(deep=True).sum()
+    bytes_per_row = row_bytes / max(len(probe), 1)
+
+    available = memory_mb * 2 ** 20 - current_rss_bytes()
+    if available <= 0:
+        logger.warning("process already uses more than the %d MB budget; reading %d-row chunks",
+                       memory_mb, PROBE_ROWS)
+        return PROBE_ROWS
+    return max(PROBE_ROWS, int(available / (CHUNK_OVERHEAD * bytes_per_row)))
+
+
+def ingest(path, medication_slice, memory_mb=DEFAULT_MEMORY_MB, chunk_rows=None, cache_dir=CACHE_DIR):
+    """
+    Stream ``path`` into EncounterAggregates.
+
+    ``chunk_rows`` defaults to an estimate from ``memory_mb``. Returns the aggregates and a
+    report with the row and chunk counts, the chunk size, the elapsed time and the peak RSS
+    of the process, which is logged as a warning when it exceeds the budget.
+    """
+    start = time.perf_counter()
+    med_cols = pd.read_csv(path, nrows=0).columns[medication_slice].tolist()
+    if chunk_rows is None:
+        chunk_rows = estimate_chunk_rows(path, med_cols, memory_mb)
+
+    aggregates = EncounterAggregates(med_cols)
+    chunks = 0
+    for chunk in iter_source_chunks(path, medication_slice, chunk_rows, cache_dir):
+        aggregates.update(prepare_frame(chunk, med_cols))
+        chunks += 1
+
+    report = {
+        "rows": aggregates.rows,
+        "chunks": chunks,
+        "chunk_rows": chunk_rows,
+        "seconds": round(time.perf_counter() - start, 3),
+        "memory_budget_mb": memory_mb,
+        "peak_rss_mb": round(peak_rss_bytes() / 2 ** 20, 1),
+    }
+    if report["peak_rss_mb"] > memory_mb:
+        logger.warning("peak RSS %.1f MB exceeded the %d MB budget", report["peak_rss_mb"], memory_mb)
+    return aggregates, report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("path")
+    parser.add_argument("--medication-columns", default="24:47",
+                        help="column slice holding the medications, as start:stop (default 24:47)")
+    parser.add_argument("--memory-mb", type=int, default=DEFAULT_MEMORY_MB)
+    parser.add_argument("--chunk-rows", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+    start, stop = (int(v) for v in args.medication_columns.split(":"))
+    aggregates, report = ingest(args.path, slice(start, stop), args.memory_mb, args.chunk_rows)
+
+    for key, value in report.items():
+        print(f"{key:>18}: {value}")
+    print(f"{'medications':>18}: {', '.join(aggregates.filtered_medications())}")
+    return 0 if report["peak_rss_mb"] <= args.memory_mb else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,49 @@
+from functools import reduce
+
+import numpy as np
+
+# Rows per chunk in crosstab_counts; bounds the temporary key array for wide inputs.
+CHUNK_ROWS = 1 << 14
+
+
+def crosstab_counts(codes, shape, weights=None, chunk_rows=CHUNK_ROWS) -> np.ndarray:
+    """
+    Dense count tensor over several integer-coded columns, in one bincount per chunk of rows.
+
+    ``codes`` holds one array per axis of ``shape``: either per row, (n,) or (n, k), or a
+    single (1, k) row that applies to every row. They broadcast against each other, so a
+    (n, n_meds) status matrix, a (n,) outcome and a (1, n_meds) medication index give the
+    (medication, status, outcome) tensor at once. Entries with a negative code on any axis are
+    skipped. With ``weights`` (one per row) the weights are summed instead of counting rows.
+    Without rows the tensor is all zeros.
+    """
+    codes = [np.asarray(c) for c in codes]
+    # Rows come from the per-row arrays; a (1, k) row that applies to every row does not count,
+    # so no rows give zero counts.
+    per_row = [c.shape[0] for c in codes if not (c.ndim == 2 and c.shape[0] == 1)]
+    n = max(per_row) if per_row else 1
+    size = int(np.prod(shape))
+    strides = np.cumprod((tuple(shape[1:]) + (1,))[::-1])[::-1]
+
+    key_dtype = np.int32 if size < 2 ** 31 else np.int64
+
+    counts = np.zeros(size, dtype=np.int64 if weights is None else np.float64)
+    for start in range(0, n, chunk_rows):
+        stop = min(start + chunk_rows, n)
+        parts = [c if c.shape[0] == 1 and n > 1 else c[start:stop] for c in codes]
+        parts = [p.reshape(len(p), -1) for p in parts]
+
+        key = reduce(np.add, [p.astype(key_dtype) * key_dtype(stride) for p, stride in zip(parts, strides)])
+        key = np.broadcast_to(key, np.broadcast_shapes(*(p.shape for p in parts)))
+        chunk_weights = None
+        if weights is not None:
+            chunk_weights = np.broadcast_to(np.asarray(weights[start:stop])[:, None], key.shape)
+
+        negative = [p < 0 for p in parts if p.size and p.min() < 0]
+        if negative:
+            valid = ~np.broadcast_to(reduce(np.logical_or, negative), key.shape)
+            key = key[valid]
+            chunk_weights = chunk_weights[valid] if chunk_weights is not None else None
+        counts += np.bincount(key.ravel(), weights=None if chunk_weights is None else chunk_weights.ravel(),
+                              minlength=size).astype(counts.dtype)
+    return counts.reshape(shape)
@@ -1,26 +1,177 @@
-import tempfile
+import functools
+import time
 
 import streamlit as st
 import pandas as pd
 import altair as alt
 
+import profiling
 from basicplots import get_barchart, get_piechart, getStackedBarChart, getMosaic
-from cluster import render_graph, build_graph
-from filters import load_data, prepare_df, filter_all
-from upset import getUpsetPlot
+from cluster import EDGE_WEIGHTS, graph_html
+from dataset import load_dataset
+from medications import DEFAULT_SELECTION
+from upset import MAX_INTERSECTIONS, getUpsetPlot
 from overviewPlots import getOverviewPlots
+from scheduler import ChartTasks
 
 
 # Running the Streamlit app
 # streamlit run app.py
 
+def timed_fragment(func):
+    """
+    Runs a page section as an st.fragment: its own widgets rerun only the section, with the
+    arguments of the last full run. The duration of each run is kept per section in
+    st.session_state.section_timings and shown below the section.
+    """
+    @st.fragment
+    @functools.wraps(func)
+    def section(*args, **kwargs):
+        start = time.perf_counter()
+        with profiling.session_profiler(func.__name__), profiling.stage(func.__name__):
+            func(*args, **kwargs)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        st.session_state.setdefault("section_timings", {})[func.__name__] = elapsed_ms
+        st.caption(f"Rendered in {elapsed_ms:.0f} ms")
+
+    return section
+
+
+# Chart data for the sections below. These run in scheduler.ChartTasks worker threads, so
+# they take the same objects the sections get and never call Streamlit.
+def overview_chart(dataset, cube_slice, readmission_type, selected_medications, rows):
+    return getOverviewPlots(dataset.frame, readmission_type, selected_medications,
+                            status_counts=cube_slice.status_counts(selected_medications), rows=rows)
+
+
+def upset_chart(dataset, selected_medications, top_k, min_size, rows):
+    return getUpsetPlot(dataset.frame, selected_medications, top_k=top_k, min_size=min_size, rows=rows)
+
+
+def cluster_html(dataset, age_range, weight_range, include_unknown_weight, readmission_type, selected_medications,
+                 min_cooccurrence, size_mode, edge_weight):
+    cooccurrence = dataset.cooccurrence(age_range, weight_range, include_unknown_weight,
+                                        readmission_type, selected_medications)
+    return graph_html(cooccurrence.graph(min_cooccurrence, edge_weight), size_mode)
+
+
+def composition_chart(dataset, cube_slice, diagnoses, readmission_type, selected_medications, rows):
+    df_prep = dataset.frame
+    race_selection = alt.selection_point(fields=['race'], toggle=True)
+
+    race_count = get_barchart(cube_slice.race_counts(), race_selection)
+    race_count = race_count + alt.Chart(pd.DataFrame({'dummy': [0]})).mark_point(opacity=0)
+    pie_chart = get_piechart(df_prep, readmission_type, selected_medications, race_selection=race_selection,
+                             counts=cube_slice.readmission_by_race(selected_medications), rows=rows)
+
+    if (selected_medications.__len__() > 1):
+        return (race_count | pie_chart | getMosaic(df_prep, readmission_type, selected_medications,
+                                                   race_selection=race_selection,
+                                                   diagnoses=diagnoses, rows=rows)).resolve_scale(
+            color='independent')
+    stacked_bar_chart = getStackedBarChart(df_prep, readmission_type, race_selection=race_selection,
+                                           diagnoses=diagnoses, rows=rows)
+    return (race_count | pie_chart | stacked_bar_chart).resolve_scale(color='shared')
+
+
+# Widget defaults, also read by submit_charts before the sections create the widgets.
+UPSET_DEFAULTS = {"upset_top_k": MAX_INTERSECTIONS, "upset_min_size": 1}
+CLUSTER_DEFAULTS = {"show_clusters": False, "min_cooccurrence": 50, "size_mode": "Medication frequency",
+                    "edge_weight": next(iter(EDGE_WEIGHTS))}
+
+
+def widget_value(key, defaults):
+    return st.session_state.get(key, defaults[key])
+
+
+def submit_charts(dataset, cube_slice, diagnoses, age_range, weight_range, include_unknown_weight, readmission_type,
+                  selected_medications, rows) -> ChartTasks:
+    """Starts the chart data of every section at once, with the section widgets' current values."""
+    tasks = ChartTasks()
+    tasks.submit("overview_chart", overview_chart, dataset, cube_slice, readmission_type, selected_medications, rows)
+    tasks.submit("upset_chart", upset_chart, dataset, selected_medications, widget_value("upset_top_k", UPSET_DEFAULTS),
+                 widget_value("upset_min_size", UPSET_DEFAULTS), rows)
+    if widget_value("show_clusters", CLUSTER_DEFAULTS):
+        tasks.submit("cluster_html", cluster_html, dataset, age_range, weight_range, include_unknown_weight,
+                     readmission_type, selected_medications, widget_value("min_cooccurrence", CLUSTER_DEFAULTS),
+                     widget_value("size_mode", CLUSTER_DEFAULTS), widget_value("edge_weight", CLUSTER_DEFAULTS))
+    tasks.submit("composition_chart", composition_chart, dataset, cube_slice, diagnoses, readmission_type,
+                 selected_medications, rows)
+    return tasks
+
+
+@timed_fragment
+def overview_section(tasks, dataset, cube_slice, readmission_type, selected_medications, rows):
+    tab1, tab2 = st.tabs(["Medication Strategy", "Medication Distribution"])
+
+    with tab1:
+        st.header("Medication Strategy")
+        st.altair_chart(tasks.result("overview_chart", overview_chart, dataset, cube_slice, readmission_type,
+                                     selected_medications, rows))
+    with tab2:
+        upset_section(tasks, dataset, selected_medications, rows)
+
+
+@timed_fragment
+def upset_section(tasks, dataset, selected_medications, rows):
+    st.header("Medication Distribution")
+    top_col, size_col = st.columns(2)
+    top_k = top_col.slider("Intersections shown", min_value=5, max_value=50, value=UPSET_DEFAULTS["upset_top_k"],
+                           step=5, key="upset_top_k")
+    min_size = size_col.number_input("Minimum intersection size", min_value=1, value=UPSET_DEFAULTS["upset_min_size"],
+                                     step=10, key="upset_min_size")
+    st.altair_chart(tasks.result("upset_chart", upset_chart, dataset, selected_medications, top_k, min_size, rows))
+
+
+@timed_fragment
+def cluster_section(tasks, dataset, age_range, weight_range, include_unknown_weight, readmission_type,
+                    selected_medications):
+    st.header("Medication Clusters")
+    show = st.toggle("Show clusters", value=CLUSTER_DEFAULTS["show_clusters"], key="show_clusters")
+    cooccurrence_col, size_col, weight_col = st.columns(3)
+    min_cooccurrence = cooccurrence_col.slider(
+        "Minimum co-occurrence",
+        min_value=10,
+        max_value=500,
+        value=CLUSTER_DEFAULTS["min_cooccurrence"],
+        step=10,
+        key="min_cooccurrence"
+    )
+    size_mode = size_col.radio(
+        "Node size represents",
+        ["Medication frequency", "Readmission risk"],
+        key="size_mode"
+    )
+    edge_weight = weight_col.selectbox(
+        "Edge weight",
+        list(EDGE_WEIGHTS),
+        help="Overlap: shared patients over the smaller group. Jaccard: shared over either. "
+             "Lift: shared relative to chance. PMI: log2 of lift.",
+        key="edge_weight"
+    )
+
+    if show:
+        with st.spinner("Building cluster graph..."):
+            html = tasks.result("cluster_html", cluster_html, dataset, age_range, weight_range, include_unknown_weight,
+                                readmission_type, selected_medications, min_cooccurrence, size_mode, edge_weight)
+            st.components.v1.html(html, height=800)
+
+
+@timed_fragment
+def composition_section(tasks, dataset, cube_slice, diagnoses, readmission_type, selected_medications, rows):
+    st.altair_chart(tasks.result("composition_chart", composition_chart, dataset, cube_slice, diagnoses,
+                                 readmission_type, selected_medications, rows), use_container_width=True)
+
+
+@profiling.profiled_page("Medication Analysis")
 def main():
     st.set_page_config(page_title="Diabetic Medication Analysis Dashboard", page_icon="📊", layout="wide")
     st.title("Diabetic Medication Analysis Dashboard")
     st.markdown("Analyze medication strategies and their impact on clinical readmission rates.")
 
-    dataframe, medication_column_names_filtered = load_data()
-    df_prep = prepare_df(dataframe, med_cols_all=medication_column_names_filtered)
+    # One read-only dataset per process; sessions work on index arrays into it.
+    dataset = load_dataset()
+    medication_column_names_filtered = dataset.med_cols
 
     st.sidebar.title("Filter Options")
 
@@ -49,34 +200,19 @@ def main():
         ["Any", "<30 days only"]
     )
 
-    filtered_df = filter_all(
-        df_prep,
-        age_range=age_range,
-        weight_range=weight_range,
-        include_unknown_weight=include_unknown_weight,
-        readmission_type=readmission_type
-    )
-
-    race_counts = filtered_df['race'].value_counts().reset_index()
-    race_counts.columns = ['race', 'count']  # rename columns for Altair
+    # Positions of the filtered rows in dataset.frame. The readmission definition does not remove
+    # rows; charts apply it via the readmit_* columns.
+    rows = dataset.rows(age_range, weight_range, include_unknown_weight)
 
-    race_selection = alt.selection_point(fields=['race'], toggle=True)
+    # Metrics, race counts, the overview heatmap and the pie chart are answered from the cube.
+    cube_slice = dataset.cube.slice(age_range, weight_range, include_unknown_weight, readmission_type)
 
-    cluster_container = st.sidebar.container(border=True)
-    with cluster_container:
-        st.header("Medication Clusters")
-    min_cooccurrence = cluster_container.slider(
-        "Minimum co-occurrence",
-        min_value=10,
-        max_value=500,
-        value=50,
-        step=10
-    )
+    # Shared by the stacked bar chart and the mosaic.
+    diagnoses = dataset.diagnoses.counts(age_range, weight_range, include_unknown_weight)
 
-    size_mode = cluster_container.radio(
-        "Node size represents",
-        ["Medication frequency", "Readmission risk"]
-    )
+    report = dataset.memory_report
+    st.sidebar.caption(f"Feature store: {report['store_mb']:.1f} MB in memory, "
+                       f"{report['reduction']:.0f}x less than the CSV as strings")
 
     def render_main_view():
         col_left, col_right = st.columns(2)
@@ -84,7 +220,7 @@ def main():
             selected_medications = st.multiselect(
                 "Select Medications",
                 list(medication_column_names_filtered),
-                default=['insulin', 'metformin', 'glipizide', 'glyburide', 'rosiglitazone']
+                default=DEFAULT_SELECTION
             )
 
         if medication_column_names_filtered.__len__() == 0:
@@ -99,64 +235,31 @@ def main():
 
         col1, col2, col3, col4 = st.columns(4)
 
-        col1.metric("Total Encounters", f"{filtered_df.shape[0]}", border=True)
+        col1.metric("Total Encounters", f"{cube_slice.total}", border=True)
 
-        total_readmission_rate = (filtered_df['readmitted'] != 'NO').mean() * 100
+        total_readmission_rate = cube_slice.readmission_rate() * 100
 
         col2.metric("Overall Readmission Rate", f"{total_readmission_rate:.2f}%", border=True)
 
         with col3:
-            st.metric("Number of Features", f"{len(dataframe.columns)}", border=True,
+            st.metric("Number of Features", f"{len(dataset.source_columns)}", border=True,
                       help="Some features from the original dataset were removed during preprocessing.")
         with col4:
             st.metric("Selected Medications", f"{len(selected_medications)}", border=True,
                       help="Medications with low occurrence were excluded.")
 
-        race_count = get_barchart(race_counts, race_selection)
-
+        # Chart data of all sections is prepared concurrently; each section waits for its own.
+        tasks = submit_charts(dataset, cube_slice, diagnoses, age_range, weight_range, include_unknown_weight,
+                              readmission_type, selected_medications, rows)
         col1, col2 = st.columns(2)
-        # overview plot
-        tab1, tab2 = col1.tabs(["Medication Strategy", "Medication Distribution"])
-
-        with tab1:
-            st.header("Medication Strategy")
-            st.altair_chart(getOverviewPlots(filtered_df, readmission_type, selected_medications))
-        with tab2:
-            st.header("Medication Distribution")
-            if selected_medications.__len__() > 6:
-                st.warning("There are too many medications selected. Please select a maximum of 6 medications.")
-            else:
-                upset_plot = getUpsetPlot(filtered_df, selected_medications)
-
-                st.altair_chart(upset_plot)
-
-        stacked_bar_chart = getStackedBarChart(filtered_df, readmission_type, race_selection=race_selection)
-
-        @st.cache_data(show_spinner=True, max_entries=8)
-        def cached_build_graph(df, min_cooccurrence, readmission_type, selected_meds):
-            G = build_graph(df, min_cooccurrence, readmission_type, selected_meds)
-            return G
-
+        with col1:
+            overview_section(tasks, dataset, cube_slice, readmission_type, selected_medications, rows)
         with col2:
-            st.header("Medication Clusters")
-            if st.toggle("Show clusters", value=False):
-                with st.spinner("Building cluster graph..."):
-                    G = cached_build_graph(filtered_df, min_cooccurrence, readmission_type, selected_medications)
-                    net = render_graph(G, size_mode)
-                    with tempfile.NamedTemporaryFile(delete=False, suffix=".html") as tmp:
-                        net.save_graph(tmp.name)
-                        st.components.v1.html(open(tmp.name).read(), height=800)
-
-        race_count = race_count + alt.Chart(pd.DataFrame({'dummy': [0]})).mark_point(opacity=0)
-        pie_chart = get_piechart(filtered_df, readmission_type, selected_medications, race_selection=race_selection)
-
-        if (selected_medications.__len__() > 1):
-            st.altair_chart((race_count | pie_chart | getMosaic(filtered_df, readmission_type, selected_medications,
-                                                                race_selection=race_selection)).resolve_scale(
-                color='independent'), use_container_width=True)
-        else:
-            st.altair_chart((race_count | pie_chart | stacked_bar_chart).resolve_scale(color='shared'),
-                            use_container_width=True)
+            cluster_section(tasks, dataset, age_range, weight_range, include_unknown_weight, readmission_type,
+                            selected_medications)
+
+        composition_section(tasks, dataset, cube_slice, diagnoses, readmission_type, selected_medications, rows)
+        st.session_state.chart_timings = tasks.timings
 
     render_main_view()
 
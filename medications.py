@@ -0,0 +1,117 @@
+import numpy as np
+import pandas as pd
+
+# The 23 medication columns of the UCI diabetes dataset. A medication's position in this list is
+# its bit in the packed "med_mask" column, so masks stay comparable across filtered med lists.
+MEDICATION_COLUMNS = [
+    "metformin", "repaglinide", "nateglinide", "chlorpropamide", "glimepiride", "acetohexamide",
+    "glipizide", "glyburide", "tolbutamide", "pioglitazone", "rosiglitazone", "acarbose", "miglitol",
+    "troglitazone", "tolazamide", "examide", "citoglipton", "insulin", "glyburide-metformin",
+    "glipizide-metformin", "glimepiride-pioglitazone", "metformin-rosiglitazone", "metformin-pioglitazone",
+]
+STATUSES = ["No", "Steady", "Up", "Down"]
+TAKEN_STATUSES = ["Up", "Down", "Steady"]
+MASK_COLUMN = "med_mask"
+STATUS_SUFFIX = "_status"
+# Preselected on the Medication Analysis page.
+DEFAULT_SELECTION = ["insulin", "metformin", "glipizide", "glyburide", "rosiglitazone"]
+
+# Up to this many selected medications, combinations are counted with a dense bincount.
+_DENSE_BITS = 16
+
+
+def medication_bit(med):
+    try:
+        return MEDICATION_COLUMNS.index(med)
+    except ValueError:
+        raise ValueError(f"'{med}' is not a known medication column") from None
+
+
+def pack_medications(df: pd.DataFrame, med_cols) -> np.ndarray:
+    """One uint32 per encounter with the bit of every medication the patient takes set."""
+    masks = np.zeros(len(df), dtype=np.uint32)
+    for med in med_cols:
+        taken = df[med].isin(TAKEN_STATUSES).to_numpy()
+        masks |= taken.astype(np.uint32) << np.uint32(medication_bit(med))
+    return masks
+
+
+def status_codes(values) -> np.ndarray:
+    """int8 index into STATUSES per encounter; -1 for missing or unknown statuses."""
+    return pd.Categorical(values, categories=STATUSES).codes.astype(np.int8)
+
+
+def _take(values, rows):
+    return values if rows is None else values[rows]
+
+
+def status_matrix(df: pd.DataFrame, med_cols, rows=None) -> np.ndarray:
+    """
+    (n, len(med_cols)) int8 status codes of ``df``, or of the positions ``rows`` of it, using
+    the prepare_frame status columns when present.
+    """
+    status = np.empty((len(df) if rows is None else len(rows), len(med_cols)), dtype=np.int8)
+    for m, med in enumerate(med_cols):
+        col = med + STATUS_SUFFIX
+        status[:, m] = _take(df[col].to_numpy() if col in df.columns else status_codes(df[med]), rows)
+    return status
+
+
+def medication_masks(df: pd.DataFrame, med_cols, rows=None) -> np.ndarray:
+    """The packed masks of ``df`` (at ``rows``), using the column from prepare_frame when it is there."""
+    if MASK_COLUMN in df.columns:
+        return _take(df[MASK_COLUMN].to_numpy(), rows)
+    return _take(pack_medications(df, med_cols), rows)
+
+
+def combination_codes(masks: np.ndarray, med_cols) -> np.ndarray:
+    """
+    Compact the masks to the selected medications.
+
+    ``med_cols[0]`` becomes the most significant bit, so sorting codes numerically orders the
+    combinations the same way as ``groupby(med_cols)`` over 0/1 columns.
+    """
+    n_bits = len(med_cols)
+    codes = np.zeros(len(masks), dtype=np.uint32)
+    for i, med in enumerate(med_cols):
+        codes |= ((masks >> np.uint32(medication_bit(med))) & np.uint32(1)) << np.uint32(n_bits - 1 - i)
+    return codes
+
+
+def unpack_codes(codes: np.ndarray, n_bits) -> np.ndarray:
+    """(len(codes), n_bits) 0/1 matrix, column i holding the bit of ``med_cols[i]``."""
+    shifts = np.arange(n_bits - 1, -1, -1, dtype=np.uint32)
+    return ((codes[:, None] >> shifts) & np.uint32(1)).astype(np.int64)
+
+
+def combination_totals(codes: np.ndarray, n_bits, weights=None):
+    """Observed combination codes with their row counts (or summed ``weights``)."""
+    if n_bits <= _DENSE_BITS:
+        counts = np.bincount(codes, minlength=1 << n_bits)
+        combos = np.flatnonzero(counts)
+        if weights is not None:
+            counts = np.bincount(codes, weights=weights, minlength=1 << n_bits)
+        return combos.astype(np.uint32), counts[combos]
+    # Too many bits for a dense table: hash the observed combinations and count those only.
+    labels, combos = pd.factorize(codes)
+    totals = np.bincount(labels, weights=weights, minlength=len(combos))
+    order = np.argsort(combos)
+    return combos[order].astype(np.uint32), totals[order]
+
+
+def intersection_counts(codes: np.ndarray, n_bits):
+    """Encounters per observed medication combination, as (combos, counts)."""
+    return combination_totals(codes, n_bits)
+
+
+def medication_frequencies(codes: np.ndarray, n_bits, weights=None) -> np.ndarray:
+    """Encounters taking each medication, or the sum of ``weights`` over those encounters."""
+    combos, totals = combination_totals(codes, n_bits, weights)
+    return unpack_codes(combos, n_bits).T @ totals
+
+
+def cooccurrence_matrix(codes: np.ndarray, n_bits) -> np.ndarray:
+    """Encounters taking both medication i and j; the diagonal holds the frequencies."""
+    combos, totals = combination_totals(codes, n_bits)
+    bits = unpack_codes(combos, n_bits)
+    return bits.T @ (bits * totals[:, None])
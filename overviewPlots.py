@@ -1,25 +1,38 @@
+import numpy as np
 import pandas as pd
 import altair as alt
 
+from kernels import crosstab_counts
+from medications import STATUSES, status_matrix
+from payload import log_chart_payload
+from profiling import profiled
+from readmission import readmission_outcome
 
-def getOverviewPlots(df, readmission_type, med_cols):
-    statuses = ['Up', 'Down', 'No', 'Steady']
-    if readmission_type == "Any":
-        readmit = df["readmitted"].isin([">30", "<30"]).astype(int)
-    else:
-        readmit = (df["readmitted"] == "<30").astype(int)
+
+def status_outcome_counts(df, readmission_type, med_cols, rows=None):
+    """(medication, status, outcome) counts for ``med_cols`` in one pass over the status codes."""
+    status = status_matrix(df, med_cols, rows)
+    outcome = readmission_outcome(df, readmission_type, rows)
+    med_index = np.arange(len(med_cols))[None, :]
+    return crosstab_counts([med_index, status, outcome], (len(med_cols), len(STATUSES), 2))
+
+
+@profiled()
+def getOverviewPlots(df, readmission_type, med_cols, status_counts=None, rows=None):
+    """
+    ``status_counts`` is an optional precomputed (medication, status, outcome) tensor, e.g. from
+    cube.CubeSlice.status_counts; without it the counts are computed from ``df`` (at ``rows``).
+    """
+    if status_counts is None:
+        status_counts = status_outcome_counts(df, readmission_type, med_cols, rows)
 
     data = []
-    for med in med_cols:
-        for status in statuses:
-            count = (df[med] == status).sum()
-            count_med_and_readmit = ((df[med] == status) & readmit).sum()
-            if (count > 0) & (status != 'No'):
-                percent = (count_med_and_readmit / count) * 100
-            else:
-                percent = 0.0
-            if status != 'No':
-                data.append({'medication': med, 'status': status, 'count': count, 'percent': percent})
+    for m, med in enumerate(med_cols):
+        for status in ['Up', 'Down', 'Steady']:
+            not_readmitted, count_med_and_readmit = status_counts[m, STATUSES.index(status)]
+            count = not_readmitted + count_med_and_readmit
+            percent = (count_med_and_readmit / count) * 100 if count > 0 else 0.0
+            data.append({'medication': med, 'status': status, 'count': count, 'percent': percent})
     heatmap_df = pd.DataFrame(data)
 
     n_categories = len(heatmap_df["medication"].unique())
@@ -45,4 +58,5 @@ def getOverviewPlots(df, readmission_type, med_cols):
     ).
              interactive()
              )
+    log_chart_payload("getOverviewPlots", chart)
     return chart
@@ -0,0 +1,54 @@
+import logging
+
+import altair as alt
+import pandas as pd
+
+import profiling
+
+logger = logging.getLogger(__name__)
+
+# Per-chart budget for the serialized Vega-Lite spec, data included.
+PAYLOAD_BUDGET_BYTES = 200 * 1024
+# Attributes holding the sub-charts of compound charts.
+NESTED_CHARTS = ("layer", "hconcat", "vconcat", "concat", "spec")
+
+
+def _without_frames(chart, frames):
+    """
+    Copy of ``chart`` whose inline DataFrames, also in sub-charts, are emptied into ``frames``,
+    keyed by id: like Altair's named datasets, a frame shared by sub-charts is shipped once.
+    """
+    chart = chart.copy(deep=False)
+    if isinstance(chart.data, pd.DataFrame):
+        frames[id(chart.data)] = chart.data
+        chart.data = chart.data.iloc[:0]
+    for attr in NESTED_CHARTS:
+        nested = getattr(chart, attr, alt.Undefined)
+        if isinstance(nested, list):
+            setattr(chart, attr, [_without_frames(c, frames) if hasattr(c, "data") else c for c in nested])
+        elif hasattr(nested, "data"):
+            setattr(chart, attr, _without_frames(nested, frames))
+    return chart
+
+
+def chart_payload_bytes(chart) -> int:
+    """
+    Size of the chart's Vega-Lite JSON as shipped to the browser: the spec with its data
+    emptied plus every DataFrame as JSON records. Measured without Altair's max_rows check, so
+    the process-wide data transformer, shared with concurrent chart tasks, is left alone.
+    """
+    frames = {}
+    spec = _without_frames(chart, frames).to_json(validate=False, indent=None)
+    data = "".join(df.to_json(orient="records", date_format="iso") for df in frames.values())
+    return len(spec.encode("utf-8")) + len(data.encode("utf-8"))
+
+
+def log_chart_payload(name, chart, budget=PAYLOAD_BUDGET_BYTES):
+    """Log the chart's payload size, as a warning when it exceeds ``budget``."""
+    size = chart_payload_bytes(chart)
+    profiling.note(spec_bytes=size)
+    if size > budget:
+        logger.warning("%s payload is %.1f KB, over the %.0f KB budget", name, size / 1024, budget / 1024)
+    else:
+        logger.info("%s payload is %.1f KB", name, size / 1024)
+    return size
@@ -0,0 +1,300 @@
+"""
+Opt-in per-rerun instrumentation.
+
+Stages are marked with the ``profiled`` decorator or the ``stage`` context manager. They cost
+a thread-local lookup unless a Profiler is active for the calling session, which happens when
+the page is opened with ``?profile=1`` or for every session when DASHBOARD_PROFILE=1 is set.
+An active profiler records per stage the wall time, the peak of Python allocations
+(tracemalloc), the rows processed, LRUCache / st.cache hits and misses and the size of the
+Vega-Lite spec (from payload.log_chart_payload) or HTML produced. Records are shown in a
+sidebar panel, next to the memory and hit rate of all LRUCaches (utils.cache_manager), are
+downloadable as JSON lines and, with DASHBOARD_PROFILE_LOG=<path>, appended to that file as
+they are taken.
+
+Cache counts and memory peaks of a stage include its nested stages. tracemalloc is
+process-wide and slows every session down while it runs, so it is only started while at least
+one profiled run is in progress and stopped when the last one ends; memory peaks include
+allocations of concurrent sessions.
+"""
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+PROFILE_ENV = "DASHBOARD_PROFILE"
+PROFILE_LOG_ENV = "DASHBOARD_PROFILE_LOG"
+PROFILER_KEY = "profiler"
+MAX_RECORDS = 2000
+
+_local = threading.local()
+_log_lock = threading.Lock()
+_tracing_lock = threading.Lock()
+# Profiled runs in progress, and whether tracemalloc was started for them (not e.g. by PYTHONTRACEMALLOC).
+_traced_runs = 0
+_started_tracing = False
+
+
+class Profiler:
+    """Stage records of one session, newest last, grouped by run."""
+
+    def __init__(self, max_records=MAX_RECORDS, log_path=None):
+        self.records = deque(maxlen=max_records)
+        self.log_path = log_path
+        self.run = 0
+        self.run_label = None
+        self._stack = []
+
+    def new_run(self, label):
+        self.run += 1
+        self.run_label = label
+
+    @contextmanager
+    def stage(self, name, **fields):
+        current, peak = tracemalloc.get_traced_memory()
+        if self._stack:
+            parent = self._stack[-1]
+            parent["_peak"] = max(parent["_peak"], peak)
+        tracemalloc.reset_peak()
+        record = {
+            "run": self.run, "page": self.run_label, "stage": name, "depth": len(self._stack),
+            "time": time.time(), "wall_ms": None, "peak_mb": None, "rows": None,
+            "cache_hits": 0, "cache_misses": 0, "spec_bytes": None,
+            "_start": current, "_peak": current,
+        }
+        record.update(fields)
+        self._stack.append(record)
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["wall_ms"] = round((time.perf_counter() - start) * 1000, 3)
+            self._stack.pop()
+            record["_peak"] = max(record["_peak"], tracemalloc.get_traced_memory()[1])
+            record["peak_mb"] = round((record.pop("_peak") - record.pop("_start")) / 2 ** 20, 3)
+            if self._stack:
+                parent = self._stack[-1]
+                parent["_peak"] = max(parent["_peak"], record["peak_mb"] * 2 ** 20 + parent["_start"])
+                parent["cache_hits"] += record["cache_hits"]
+                parent["cache_misses"] += record["cache_misses"]
+            self.records.append(record)
+            self._log(record)
+
+    def add(self, name, wall_ms, **fields):
+        """Records a stage that ran outside this profiler, e.g. in a worker thread, as finished now."""
+        record = {
+            "run": self.run, "page": self.run_label, "stage": name, "depth": len(self._stack),
+            "time": time.time(), "wall_ms": round(wall_ms, 3), "peak_mb": None, "rows": None,
+            "cache_hits": 0, "cache_misses": 0, "spec_bytes": None,
+        }
+        record.update(fields)
+        self.records.append(record)
+        self._log(record)
+
+    def count_cache(self, hit):
+        if self._stack:
+            self._stack[-1]["cache_hits" if hit else "cache_misses"] += 1
+
+    def frame(self, run=None) -> pd.DataFrame:
+        """Records of ``run`` (default: the latest) in call order."""
+        run = self.run if run is None else run
+        records = [r for r in self.records if r["run"] == run]
+        return pd.DataFrame(sorted(records, key=lambda r: r["time"]))
+
+    def to_jsonl(self):
+        return "".join(json.dumps(r) + "\n" for r in self.records)
+
+    def _log(self, record):
+        if self.log_path:
+            with _log_lock, open(self.log_path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+
+
+def active():
+    """The profiler of the calling session, or None when profiling is off."""
+    return getattr(_local, "profiler", None)
+
+
+@contextmanager
+def activate(profiler):
+    previous = active()
+    _local.profiler = profiler
+    try:
+        yield profiler
+    finally:
+        _local.profiler = previous
+
+
+@contextmanager
+def memory_tracing():
+    """Keeps tracemalloc running for the enclosed run, stopping it after the last such run ends."""
+    global _traced_runs, _started_tracing
+    with _tracing_lock:
+        if _traced_runs == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _started_tracing = True
+        _traced_runs += 1
+    try:
+        yield
+    finally:
+        with _tracing_lock:
+            _traced_runs -= 1
+            if _traced_runs == 0 and _started_tracing:
+                tracemalloc.stop()
+                _started_tracing = False
+
+
+@contextmanager
+def stage(name, **fields):
+    """Records the enclosed block as a stage; yields the record, or None when profiling is off."""
+    profiler = active()
+    if profiler is None:
+        yield None
+        return
+    with profiler.stage(name, **fields) as record:
+        yield record
+
+
+def record(name, wall_ms, **fields):
+    """Adds a stage measured elsewhere, e.g. by scheduler.ChartTasks in a worker thread."""
+    profiler = active()
+    if profiler is not None:
+        profiler.add(name, wall_ms, **fields)
+
+
+def count_cache(hit):
+    profiler = active()
+    if profiler is not None:
+        profiler.count_cache(hit)
+
+
+def note(**fields):
+    """Sets fields of the innermost running stage, e.g. spec_bytes from payload.log_chart_payload."""
+    profiler = active()
+    if profiler is not None and profiler._stack:
+        profiler._stack[-1].update(fields)
+
+
+def _row_count(bound, result):
+    if isinstance(result, np.ndarray):
+        return len(result)
+    rows = bound.arguments.get("rows")
+    if rows is not None:
+        return len(rows)
+    for value in bound.arguments.values():
+        if isinstance(value, pd.DataFrame):
+            return len(value)
+    return None
+
+
+def profiled(name=None, cached=False):
+    """
+    Decorator recording each call as a stage named ``name`` (default: the function name).
+
+    ``cached`` marks a function behind st.cache_data/st.cache_resource, decorated above the
+    cache decorator: the call counts as a cache hit unless a nested stage ran or a miss was
+    counted inside it.
+    """
+    def decorate(func):
+        signature = inspect.signature(func)
+        stage_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            profiler = active()
+            if profiler is None:
+                return func(*args, **kwargs)
+            with profiler.stage(stage_name) as record:
+                n_records = len(profiler.records)
+                result = func(*args, **kwargs)
+                if cached and len(profiler.records) == n_records and not record["cache_misses"]:
+                    record["cache_hits"] += 1
+                elif cached and not record["cache_misses"]:
+                    record["cache_misses"] += 1
+                try:
+                    bound = signature.bind_partial(*args, **kwargs)
+                except TypeError:
+                    bound = signature.bind_partial()
+                record["rows"] = _row_count(bound, result)
+                if isinstance(result, str):
+                    record["spec_bytes"] = len(result)
+            return result
+
+        return wrapper
+
+    return decorate
+
+
+def enabled():
+    return os.environ.get(PROFILE_ENV) == "1" or st.query_params.get("profile") == "1"
+
+
+@contextmanager
+def session_profiler(label):
+    """
+    Activates the session's profiler for one (full or fragment) run labelled ``label``;
+    yields None and does nothing when profiling is not enabled. Inside an active run, e.g. a
+    fragment called during a full run, it yields the running profiler.
+    """
+    if active() is not None:
+        yield active()
+        return
+    if not enabled():
+        yield None
+        return
+    profiler = st.session_state.get(PROFILER_KEY)
+    if profiler is None:
+        profiler = st.session_state[PROFILER_KEY] = Profiler(log_path=os.environ.get(PROFILE_LOG_ENV))
+    profiler.new_run(label)
+    with memory_tracing(), activate(profiler):
+        yield profiler
+
+
+def profiled_page(label):
+    """Decorator for a page function: profiles its runs and adds the sidebar panel."""
+    def decorate(func):
+        @functools.wraps(func)
+        def page(*args, **kwargs):
+            with session_profiler(label) as profiler:
+                with stage(label):
+                    func(*args, **kwargs)
+                render_panel(profiler)
+
+        return page
+
+    return decorate
+
+
+def render_panel(profiler):
+    """
+    Sidebar panel with the stages of the latest full run and a JSON lines export. Memory peaks
+    are traced only during profiled runs, so other sessions run untraced in between.
+    """
+    if profiler is None:
+        return
+    with st.sidebar.expander("Performance", expanded=False):
+        frame = profiler.frame()
+        if frame.empty:
+            st.caption("No stages recorded yet.")
+        else:
+            top = frame[frame["depth"] == 0]
+            st.caption(f"Run {profiler.run}: {top['wall_ms'].sum():.0f} ms in {len(top)} top-level stages")
+            frame = frame.assign(stage=["  " * d + s for d, s in zip(frame["depth"], frame["stage"])])
+            columns = ["stage", "wall_ms", "peak_mb", "rows", "cache_hits", "cache_misses", "spec_bytes"]
+            st.dataframe(frame[columns + (["wait_ms"] if "wait_ms" in frame else [])], hide_index=True)
+        # utils imports this module, so the cache manager is looked up at render time.
+        from utils import cache_manager
+        caches = cache_manager.stats()
+        hit_rate = "n/a" if caches["hit_rate"] is None else f"{caches['hit_rate']:.0%}"
+        st.caption(f"Caches: {caches['resident_bytes'] / 2 ** 20:.1f} of {caches['max_bytes'] / 2 ** 20:.0f} MB, "
+                   f"{hit_rate} hits, {caches['evictions']} evictions")
+        st.download_button("Export records (JSON lines)", profiler.to_jsonl(), file_name="profile.jsonl",
+                           mime="application/jsonl")
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+
+READMIT_LABELS = ["NO", "<30", ">30"]
+
+# int8 outcome columns added by filters.prepare_frame, one per readmission definition.
+OUTCOME_COLUMNS = {"Any": "readmit_any", "<30 days only": "readmit_lt30"}
+
+
+def readmission_labels(readmission_type):
+    """Readmission classes shown for a readmission definition; ">30" folds into "NO" for "<30 days only"."""
+    return READMIT_LABELS if readmission_type == "Any" else READMIT_LABELS[:2]
+
+
+def outcome_column(readmission_type):
+    return OUTCOME_COLUMNS["Any" if readmission_type == "Any" else "<30 days only"]
+
+
+def fold_readmission(counts, readmission_type, axis=-1):
+    """Fold a (NO, <30, >30) axis of ``counts`` to the classes of ``readmission_type``."""
+    if readmission_type == "Any":
+        return counts
+    no, lt30, gt30 = np.moveaxis(counts, axis, 0)
+    return np.moveaxis(np.stack([no + gt30, lt30]), 0, axis)
+
+
+def add_outcome_columns(df: pd.DataFrame):
+    df[OUTCOME_COLUMNS["Any"]] = df["readmitted"].isin([">30", "<30"]).astype("int8")
+    df[OUTCOME_COLUMNS["<30 days only"]] = (df["readmitted"] == "<30").astype("int8")
+
+
+def readmission_outcome(df: pd.DataFrame, readmission_type, rows=None) -> np.ndarray:
+    """1 for encounters (at ``rows``) counted as readmitted under ``readmission_type``, else 0."""
+    col = outcome_column(readmission_type)
+    if col in df.columns:
+        outcome = df[col].to_numpy()
+    elif readmission_type == "Any":
+        outcome = df["readmitted"].isin([">30", "<30"]).to_numpy(dtype=np.int8)
+    else:
+        outcome = (df["readmitted"] == "<30").to_numpy(dtype=np.int8)
+    return outcome if rows is None else outcome[rows]
+
+
+def readmitted_labels(df: pd.DataFrame, readmission_type) -> pd.Series:
+    """``df["readmitted"]`` as shown under ``readmission_type``, without modifying ``df``."""
+    if readmission_type == "Any":
+        return df["readmitted"]
+    labels = np.where(readmission_outcome(df, readmission_type) == 1, "<30", "NO")
+    return pd.Series(pd.Categorical(labels, categories=readmission_labels(readmission_type)),
+                     index=df.index, name="readmitted")
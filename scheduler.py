@@ -0,0 +1,84 @@
+"""
+Concurrent chart preparation for one page run.
+
+Chart builders are independent aggregations over the same read-only data, and most of their
+time is spent in NumPy and pandas kernels that release the GIL. A page submits all of them
+to a bounded thread pool shared by every session (DASHBOARD_WORKERS threads, by default up
+to 4), then renders the results in page order, so a run takes about as long as its slowest
+chart rather than the sum of all charts. Tasks must not call Streamlit: they run without the
+session's script context and profiler.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import profiling
+
+WORKERS_ENV = "DASHBOARD_WORKERS"
+MAX_WORKERS = int(os.environ.get(WORKERS_ENV, min(4, os.cpu_count() or 1)))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _shared_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(MAX_WORKERS, thread_name_prefix="charts")
+        return _pool
+
+
+def _timed(fn, args, kwargs):
+    start = time.perf_counter()
+    value = fn(*args, **kwargs)
+    return value, (time.perf_counter() - start) * 1000
+
+
+def _same(a, b):
+    if a is b:
+        return True
+    if type(a) is not type(b) or not isinstance(a, (str, int, float, bool, tuple, list)):
+        return False
+    try:
+        return bool(a == b)
+    except (TypeError, ValueError):
+        return False
+
+
+def _same_call(call, other):
+    (fn, args, kwargs), (other_fn, other_args, other_kwargs) = call, other
+    return (fn is other_fn and len(args) == len(other_args) and all(map(_same, args, other_args))
+            and kwargs.keys() == other_kwargs.keys() and all(_same(kwargs[k], other_kwargs[k]) for k in kwargs))
+
+
+class ChartTasks:
+    """
+    Chart computations of one page run, started together and joined where they are rendered.
+
+    ``submit`` starts ``fn(*args, **kwargs)`` in the shared thread pool. ``result`` waits for
+    the task of that name when it was submitted with the same function and arguments (the
+    same objects, or equal plain values); otherwise it computes the chart inline, e.g. when a section reruns as a fragment with other widget values. Each task's wall
+    time is kept in ``timings`` and recorded as a profiling stage, along with how long the
+    page waited for it.
+    """
+
+    def __init__(self):
+        self.timings = {}
+        self._tasks = {}
+
+    def submit(self, name, fn, *args, **kwargs):
+        future = _shared_pool().submit(_timed, fn, args, kwargs)
+        self._tasks[name] = ((fn, args, kwargs), future)
+
+    def result(self, name, fn, *args, **kwargs):
+        task = self._tasks.get(name)
+        if task is None or not _same_call(task[0], (fn, args, kwargs)):
+            with profiling.stage(name):
+                value, self.timings[name] = _timed(fn, args, kwargs)
+            return value
+        start = time.perf_counter()
+        value, self.timings[name] = task[1].result()
+        profiling.record(name, self.timings[name], wait_ms=round((time.perf_counter() - start) * 1000, 3))
+        return value
@@ -0,0 +1,159 @@
+import numpy as np
+import pandas as pd
+
+# Rows per chunk when a frame in memory is streamed through an accumulator.
+STATS_CHUNK_ROWS = 1 << 16
+# Columns whose values are integers in [0, RANK_DOMAIN) get Spearman coefficients.
+RANK_DOMAIN = 1 << 12
+
+
+def iter_chunks(df: pd.DataFrame, chunk_rows=STATS_CHUNK_ROWS):
+    for start in range(0, len(df), chunk_rows):
+        yield df.iloc[start:start + chunk_rows]
+
+
+def _weighted_pearson(x, y, w):
+    total = w.sum()
+    if total == 0:
+        return np.nan
+    mx, my = (w * x).sum() / total, (w * y).sum() / total
+    cov = (w * (x - mx) * (y - my)).sum()
+    var = (w * (x - mx) ** 2).sum() * (w * (y - my) ** 2).sum()
+    return cov / np.sqrt(var) if var > 0 else np.nan
+
+
+class CorrelationAccumulator:
+    """
+    Pearson and Spearman correlation matrices over a stream of chunks.
+
+    Pearson uses co-moments per column pair over the rows where both values are present,
+    the same pairwise-complete semantics as ``DataFrame.corr()``. Each chunk is reduced to
+    (count, means, co-moments) and combined with the running state by the pairwise Welford
+    update of Chan et al., so accumulators built over separate chunks, or in separate
+    processes, can be merged in any order.
+
+    Spearman needs global ranks, which a single pass cannot know in general. For columns of
+    small non-negative integers it keeps a joint value histogram per column pair instead; the
+    histograms add up across chunks and give exact average ranks at the end.
+    """
+
+    def __init__(self, columns, rank_domain=RANK_DOMAIN):
+        self.columns = list(columns)
+        self.rank_domain = rank_domain
+        k = len(self.columns)
+        # [i, j] entries are over rows where both column i and column j are present.
+        self.n = np.zeros((k, k))
+        self.mean = np.zeros((k, k))      # mean of column i
+        self.m2 = np.zeros((k, k))        # sum of squared deviations of column i
+        self.comoment = np.zeros((k, k))  # sum of (x_i - mean_i) * (x_j - mean_j)
+        self.rankable = np.ones(k, dtype=bool)
+        self.histograms = {}
+
+    def update(self, chunk):
+        """Adds a chunk, a DataFrame with ``columns`` or a (rows, len(columns)) array."""
+        if isinstance(chunk, pd.DataFrame):
+            chunk = chunk[self.columns].to_numpy(dtype=float, na_value=np.nan)
+        x = np.asarray(chunk, dtype=float)
+        if not len(x):
+            return self
+        self._update_moments(x)
+        self._update_histograms(x)
+        return self
+
+    def _update_moments(self, x):
+        valid = ~np.isnan(x)
+        v = valid.astype(float)
+        # Centre on the chunk's column means first, to keep the sums small.
+        present = v.sum(axis=0)
+        shift = np.divide(np.where(valid, x, 0.0).sum(axis=0), present, out=np.zeros(x.shape[1]), where=present > 0)
+        xc = np.where(valid, x - shift, 0.0)
+
+        n = v.T @ v
+        sums = xc.T @ v
+        mean_c = np.divide(sums, n, out=np.zeros_like(n), where=n > 0)
+        chunk = (
+            n,
+            mean_c + shift[:, None],
+            (xc ** 2).T @ v - mean_c * sums,
+            xc.T @ xc - mean_c * sums.T,
+        )
+        self._merge_moments(*chunk)
+
+    def _merge_moments(self, n_b, mean_b, m2_b, comoment_b):
+        n = self.n + n_b
+        delta = mean_b - self.mean
+        self.mean = self.mean + delta * np.divide(n_b, n, out=np.zeros_like(n), where=n > 0)
+        weight = np.divide(self.n * n_b, n, out=np.zeros_like(n), where=n > 0)
+        self.m2 = self.m2 + m2_b + delta ** 2 * weight
+        self.comoment = self.comoment + comoment_b + delta * delta.T * weight
+        self.n = n
+
+    def _update_histograms(self, x):
+        with np.errstate(invalid="ignore"):
+            finite = np.where(np.isnan(x), 0, x)
+            self.rankable &= ((finite == np.floor(finite)) & (finite >= 0) & (finite < self.rank_domain)).all(axis=0)
+        k = len(self.columns)
+        for i in range(k):
+            for j in range(i + 1, k):
+                if not (self.rankable[i] and self.rankable[j]):
+                    continue
+                both = ~(np.isnan(x[:, i]) | np.isnan(x[:, j]))
+                xi, xj = x[both, i].astype(np.int64), x[both, j].astype(np.int64)
+                if not len(xi):
+                    continue
+                shape = (xi.max() + 1, xj.max() + 1)
+                counts = np.bincount(xi * shape[1] + xj, minlength=shape[0] * shape[1]).reshape(shape)
+                self._add_histogram((i, j), counts)
+
+    def _add_histogram(self, pair, counts):
+        current = self.histograms.get(pair)
+        if current is not None:
+            shape = np.maximum(current.shape, counts.shape)
+            grown = np.zeros(shape, dtype=np.int64)
+            grown[:current.shape[0], :current.shape[1]] += current
+            grown[:counts.shape[0], :counts.shape[1]] += counts
+            counts = grown
+        self.histograms[pair] = counts
+
+    def merge(self, other):
+        """Folds another accumulator over the same columns into this one."""
+        if other.columns != self.columns:
+            raise ValueError("cannot merge accumulators over different columns")
+        self._merge_moments(other.n, other.mean, other.m2, other.comoment)
+        self.rankable &= other.rankable
+        for pair, counts in other.histograms.items():
+            self._add_histogram(pair, counts)
+        return self
+
+    @classmethod
+    def from_chunks(cls, columns, chunks, **kwargs):
+        acc = cls(columns, **kwargs)
+        for chunk in chunks:
+            acc.update(chunk)
+        return acc
+
+    def pearson(self) -> pd.DataFrame:
+        with np.errstate(invalid="ignore", divide="ignore"):
+            corr = self.comoment / np.sqrt(self.m2 * self.m2.T)
+        corr[self.n < 2] = np.nan
+        return pd.DataFrame(corr, index=self.columns, columns=self.columns)
+
+    def spearman(self) -> pd.DataFrame:
+        """Spearman coefficients; NaN for pairs involving a column that is not small integers."""
+        k = len(self.columns)
+        corr = np.full((k, k), np.nan)
+        for (i, j), counts in self.histograms.items():
+            if not (self.rankable[i] and self.rankable[j]):
+                continue
+            rank_i = self._average_ranks(counts.sum(axis=1))
+            rank_j = self._average_ranks(counts.sum(axis=0))
+            a, b = np.nonzero(counts)
+            corr[i, j] = corr[j, i] = _weighted_pearson(rank_i[a], rank_j[b], counts[a, b])
+        np.fill_diagonal(corr, 1.0)
+        return pd.DataFrame(corr, index=self.columns, columns=self.columns)
+
+    @staticmethod
+    def _average_ranks(value_counts):
+        """1-based average rank of each value, given how often every value occurs."""
+        ends = np.cumsum(value_counts)
+        return ends - (value_counts - 1) / 2
@@ -1,21 +1,44 @@
+import numpy as np
 import pandas as pd
 import altair as alt
 from globals import primary_color
+from medications import (combination_codes, intersection_counts, medication_frequencies, medication_masks,
+                         unpack_codes)
+from payload import log_chart_payload
+from profiling import profiled
 
 height_per_medication = 30
+# Intersections shown by default; only these rows are sent to the browser.
+MAX_INTERSECTIONS = 20
 
 
-def getUpsetPlot(raw_data, med_cols):
-    df = raw_data.copy()
-    for col in med_cols:
-        df[col] = df[col].apply(lambda x: 0 if x == 'No' else 1)
+def intersection_table(raw_data, med_cols, top_k=MAX_INTERSECTIONS, min_size=1, rows=None):
+    """
+    Per-medication totals and the ``top_k`` largest non-empty medication combinations with at
+    least ``min_size`` encounters, as one 0/1 column per medication plus 'count'. With ``rows``
+    only those positions of ``raw_data`` are counted.
 
-    df_active = df[df[med_cols].sum(axis=1) > 0].copy()
+    Counts come from one pass over the packed medication masks, and only combinations that
+    occur are materialized, so all medications can be selected at once.
+    """
+    n_meds = len(med_cols)
+    codes = combination_codes(medication_masks(raw_data, med_cols, rows), med_cols)
 
-    total_counts = df[med_cols].sum().reset_index()
-    total_counts.columns = ['medication', 'count']
+    total_counts = pd.DataFrame({'medication': med_cols, 'count': medication_frequencies(codes, n_meds)})
 
-    intersection_df = df_active.groupby(med_cols).size().reset_index(name='count')
+    combos, counts = intersection_counts(codes, n_meds)
+    keep = (combos != 0) & (counts >= min_size)
+    combos, counts = combos[keep], counts[keep]
+    top = np.argsort(-counts, kind='stable')[:top_k]
+
+    intersection_df = pd.DataFrame(unpack_codes(combos[top], n_meds), columns=med_cols)
+    intersection_df['count'] = counts[top]
+    return total_counts, intersection_df
+
+
+@profiled()
+def getUpsetPlot(raw_data, med_cols, top_k=MAX_INTERSECTIONS, min_size=1, rows=None):
+    total_counts, intersection_df = intersection_table(raw_data, med_cols, top_k, min_size, rows)
 
     intersection_df['id'] = intersection_df.index
 
@@ -50,7 +73,6 @@ def getUpsetPlot(raw_data, med_cols):
         on='id'
     )
 
-    print(intersection_with_meds.head())
     intersection_bars_combined = alt.Chart(intersection_with_meds).mark_bar().encode(
         x=alt.X('id:O', axis=None, sort=alt.EncodingSortField(field='count', order='descending')),
         y=alt.Y('count:Q', title=None, aggregate='max'),
@@ -84,4 +106,5 @@ def getUpsetPlot(raw_data, med_cols):
         color="independent"
     )
 
+    log_chart_payload("getUpsetPlot", final_chart)
     return final_chart
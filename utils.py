@@ -1,7 +1,17 @@
 import colorsys
+import os
+import sys
+import threading
+import weakref
+from collections import OrderedDict
+
+import numpy as np
 import pandas as pd
 import re
 
+import profiling
+
+
 class color_utils:
     """
     Utility functions for color manipulation.
@@ -26,64 +36,265 @@ class color_utils:
         return color_utils.rgb_to_hex((r, g, b))
 
 
+# Memory budget, in MB, of all LRUCache entries together.
+CACHE_BUDGET_ENV = "DASHBOARD_CACHE_MB"
+DEFAULT_CACHE_BUDGET_MB = 512
+
+
+def estimate_bytes(value, _seen=None) -> int:
+    """
+    Approximate memory held by ``value``: arrays and frames by their buffers, containers and
+    plain objects recursively. Objects reached twice count once, and views of memory-mapped
+    files count nothing.
+    """
+    seen = set() if _seen is None else _seen
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    if isinstance(value, np.ndarray):
+        if value.flags.owndata and not isinstance(value, np.memmap):
+            return value.nbytes
+        return estimate_bytes(value.base, seen) if isinstance(value.base, np.ndarray) else 0
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return int(np.sum(value.memory_usage(deep=True)))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(estimate_bytes(k, seen) + estimate_bytes(v, seen) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(estimate_bytes(v, seen) for v in value)
+    elif hasattr(value, "__dict__") and not isinstance(value, type):
+        size += estimate_bytes(vars(value), seen)
+    return size
+
+
+class CacheManager:
+    """
+    Memory budget shared by every LRUCache of the process.
+
+    Entries are sized with estimate_bytes when they are stored. Once the caches together hold
+    more than ``max_bytes``, the least recently used entries across all caches are evicted, so
+    a rarely used cache gives up memory to a busy one; an entry larger than the whole budget is
+    returned but not kept. Caches and entries are updated under one lock.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.resident_bytes = 0
+        self.lock = threading.RLock()
+        # (id(cache), key) -> (weak reference to the cache, bytes), least recently used first.
+        self._entries = OrderedDict()
+
+    def register(self, cache):
+        weakref.finalize(cache, self._forget, id(cache))
+
+    def touch(self, cache, key):
+        with self.lock:
+            cache._entries.move_to_end(key)
+            self._entries.move_to_end((id(cache), key))
+
+    def store(self, cache, key, value, nbytes):
+        """
+        Puts ``value`` in ``cache`` and books its bytes, then evicts the cache's own oldest
+        entries past ``max_entries`` and the least recently used entries of all caches past the
+        budget. The caller checks that ``nbytes`` fits the budget.
+        """
+        with self.lock:
+            self.discard(cache, key)
+            cache._entries[key] = value
+            self._entries[(id(cache), key)] = (weakref.ref(cache), nbytes)
+            cache.bytes += nbytes
+            self.resident_bytes += nbytes
+            while len(cache._entries) > cache.max_entries:
+                self._evict((id(cache), next(iter(cache._entries))))
+            while self.resident_bytes > self.max_bytes and self._entries:
+                self._evict(next(iter(self._entries)))
+
+    def _evict(self, entry_key):
+        ref, nbytes = self._entries.pop(entry_key)
+        self.resident_bytes -= nbytes
+        owner = ref()
+        if owner is not None:
+            owner._entries.pop(entry_key[1], None)
+            owner.bytes -= nbytes
+            owner.evictions += 1
+
+    def discard(self, cache, key):
+        with self.lock:
+            cache._entries.pop(key, None)
+            entry = self._entries.pop((id(cache), key), None)
+            if entry is not None:
+                cache.bytes -= entry[1]
+                self.resident_bytes -= entry[1]
+
+    def _forget(self, cache_id):
+        with self.lock:
+            for entry_key in [k for k in self._entries if k[0] == cache_id]:
+                self.resident_bytes -= self._entries.pop(entry_key)[1]
+
+    def stats(self):
+        """Budget, resident bytes, evictions and hit rate, overall and per cache name."""
+        with self.lock:
+            caches = {}
+            for cache in list(LRUCache.instances):
+                totals = caches.setdefault(cache.name, {})
+                for field, value in cache.stats().items():
+                    totals[field] = totals.get(field, 0) + value
+            hits = sum(c["hits"] for c in caches.values())
+            lookups = hits + sum(c["misses"] for c in caches.values())
+            return {
+                "max_bytes": self.max_bytes, "resident_bytes": self.resident_bytes,
+                "evictions": sum(c["evictions"] for c in caches.values()),
+                "hit_rate": hits / lookups if lookups else None, "caches": caches,
+            }
+
+
+cache_manager = CacheManager(int(float(os.environ.get(CACHE_BUDGET_ENV, DEFAULT_CACHE_BUDGET_MB)) * 2 ** 20))
+
+
+class LRUCache:
+    """
+    Small least-recently-used mapping for per-filter-state results, with hit and miss counts.
+
+    Besides its own ``max_entries`` every cache is bound by the byte budget of its ``manager``,
+    which evicts across caches. Safe to share between sessions: the mapping is updated under
+    the manager's lock, while ``compute`` runs outside of it, so two sessions missing the same
+    key may both compute it.
+    """
+
+    instances = weakref.WeakSet()
+
+    def __init__(self, max_entries=32, name="cache", manager=None):
+        self.max_entries = max_entries
+        self.name = name
+        self.manager = manager or cache_manager
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes = 0
+        self._entries = OrderedDict()
+        self._lock = self.manager.lock
+        self.manager.register(self)
+        LRUCache.instances.add(self)
+
+    def get_or_compute(self, key, compute):
+        with self._lock:
+            hit = key in self._entries
+            profiling.count_cache(hit)
+            if hit:
+                self.hits += 1
+                self.manager.touch(self, key)
+                return self._entries[key]
+            self.misses += 1
+        value = compute()
+        nbytes = estimate_bytes(value)
+        with self._lock:
+            if nbytes > self.manager.max_bytes:
+                # Keeping it would evict every other entry first; it counts as evicted instead.
+                self.evictions += 1
+            else:
+                self.manager.store(self, key, value, nbytes)
+        return value
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self), "evictions": self.evictions,
+                "bytes": self.bytes}
+
+    def __len__(self):
+        return len(self._entries)
+
+
+UNKNOWN_CATEGORY = "Unknown"
+
+# Range table of icd9_to_category and categorize_codes: (first, last, category) over the
+# numeric prefix of a code, plus categories for letter-prefixed codes.
+ICD9_RANGES = [
+    (1, 139, "Infectious and parasitic"),
+    (140, 239, "Neoplasms"),
+    (240, 279, "Endocrine, nutritional, metabolic, immunity"),
+    (280, 289, "Diseases of the blood"),
+    (290, 319, "Mental disorders"),
+    (320, 389, "Nervous system and sense organs"),
+    (390, 459, "Circulatory system"),
+    (460, 519, "Respiratory system"),
+    (520, 579, "Digestive system"),
+    (580, 629, "Genitourinary system"),
+    (630, 679, "Pregnancy, childbirth, puerperium"),
+    (680, 709, "Skin and subcutaneous tissue"),
+    (710, 739, "Musculoskeletal and connective tissue"),
+    (740, 759, "Congenital anomalies"),
+    (760, 779, "Perinatal conditions"),
+    (780, 799, "Symptoms, signs, ill-defined"),
+    (800, 999, "Injury and poisoning"),
+]
+ICD9_PREFIXES = {
+    "V": "Factors influencing health status / contact with health services",
+    "E": "External causes of injury and poisoning",
+}
+
+
 def icd9_to_category(code: str) -> str:
     """
-    Map an ICD-9(-CM) diagnosis code (001-999, V, E) to a high-level category.
+    Map an ICD-9(-CM) diagnosis code (001-999, V, E) to a high-level category, by the same
+    range table and prefixes as categorize_codes.
     This was generated with the help of generative AI (Perplexity)
     """
-
     if pd.isna(code):
-        return "Unknown"
+        return UNKNOWN_CATEGORY
 
     code_str = str(code).strip().upper()
+    for prefix, label in ICD9_PREFIXES.items():
+        if code_str.startswith(prefix):
+            return label
 
-    # V codes: factors influencing health status / contact with health services
-    if code_str.startswith("V"):
-        return "Factors influencing health status / contact with health services"
-
-    # E codes: external causes of injury/poisoning
-    if code_str.startswith("E"):
-        return "External causes of injury and poisoning"
-
-    # Otherwise treat as numeric 001–999
     m = re.match(r"(\d+)", code_str)
     if not m:
-        return "Unknown"
+        return UNKNOWN_CATEGORY
     num = int(m.group(1))
+    for first, last, label in ICD9_RANGES:
+        if first <= num <= last:
+            return label
+    return UNKNOWN_CATEGORY
+
+
+def code_categories(ranges=ICD9_RANGES, prefixes=ICD9_PREFIXES):
+    """Category labels of a range table, in the order used for the Categorical codes."""
+    labels = []
+    for label in [r[2] for r in ranges] + list(prefixes.values()) + [UNKNOWN_CATEGORY]:
+        if label not in labels:
+            labels.append(label)
+    return labels
+
+
+def _range_lookup(ranges, categories):
+    size = max(last for _, last, _ in ranges) + 1
+    lookup = np.full(size, categories.index(UNKNOWN_CATEGORY), dtype=np.int8)
+    for first, last, label in ranges:
+        lookup[first:last + 1] = categories.index(label)
+    return lookup
+
+
+def categorize_codes(codes, ranges=ICD9_RANGES, prefixes=ICD9_PREFIXES) -> pd.Categorical:
+    """
+    Vectorized icd9_to_category for a whole column.
+
+    Codes are factorized first, so the string work only runs on the unique codes; their
+    numeric prefixes are then mapped through a lookup array built from ``ranges``. Other
+    code systems can be categorized by passing their own range table and prefix mapping.
+    """
+    categories = code_categories(ranges, prefixes)
+    unknown = categories.index(UNKNOWN_CATEGORY)
+
+    positions, uniques = pd.factorize(pd.Series(codes), use_na_sentinel=True)
+    uniques = pd.Series(uniques, dtype=object).astype(str).str.strip().str.upper()
+
+    lookup = _range_lookup(ranges, categories)
+    numeric = pd.to_numeric(uniques.str.extract(r"^(\d+)")[0], errors="coerce").to_numpy()
+    in_table = ~np.isnan(numeric) & (numeric < len(lookup))
+    unique_cats = np.full(len(uniques), unknown, dtype=np.int8)
+    unique_cats[in_table] = lookup[numeric[in_table].astype(np.int64)]
+    for prefix, label in reversed(list(prefixes.items())):
+        unique_cats[uniques.str.startswith(prefix).to_numpy()] = categories.index(label)
 
-    if 1 <= num <= 139:
-        return "Infectious and parasitic"
-    elif 140 <= num <= 239:
-        return "Neoplasms"
-    elif 240 <= num <= 279:
-        return "Endocrine, nutritional, metabolic, immunity"
-    elif 280 <= num <= 289:
-        return "Diseases of the blood"
-    elif 290 <= num <= 319:
-        return "Mental disorders"
-    elif 320 <= num <= 389:
-        return "Nervous system and sense organs"
-    elif 390 <= num <= 459:
-        return "Circulatory system"
-    elif 460 <= num <= 519:
-        return "Respiratory system"
-    elif 520 <= num <= 579:
-        return "Digestive system"
-    elif 580 <= num <= 629:
-        return "Genitourinary system"
-    elif 630 <= num <= 679:
-        return "Pregnancy, childbirth, puerperium"
-    elif 680 <= num <= 709:
-        return "Skin and subcutaneous tissue"
-    elif 710 <= num <= 739:
-        return "Musculoskeletal and connective tissue"
-    elif 740 <= num <= 759:
-        return "Congenital anomalies"
-    elif 760 <= num <= 779:
-        return "Perinatal conditions"
-    elif 780 <= num <= 799:
-        return "Symptoms, signs, ill-defined"
-    elif 800 <= num <= 999:
-        return "Injury and poisoning"
-    else:
-        return "Unknown"
\ No newline at end of file
+    # NaN codes come back from factorize as -1 and map to the last slot, i.e. "Unknown".
+    unique_cats = np.append(unique_cats, np.int8(unknown))
+    return pd.Categorical.from_codes(unique_cats[positions], categories=categories)